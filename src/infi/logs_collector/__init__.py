@@ -1,7 +1,7 @@
 from __future__ import print_function
 from logging import getLogger
 from contextlib import contextmanager
-from .util import LOGGING_FORMATTER_KWARGS, STRFTIME_SHORT, get_timestamp, init_colors
+from .util import LOGGING_FORMATTER_KWARGS, STRFTIME_SHORT, get_timestamp, init_colors, make_blocking
 
 logger = getLogger(__name__)
 
@@ -12,8 +12,11 @@ def create_logging_handler_for_collection(tempdir, prefix):
     from os import path
     from logging import FileHandler, DEBUG, Formatter
     from logging.handlers import MemoryHandler
+    from .redaction import get_active_redactor, RedactingFormatter
+    redactor = get_active_redactor()
     target = FileHandler(path.join(tempdir, "collection-logs", "{}.{}.debug.log".format(prefix, get_timestamp())))
-    target.setFormatter(Formatter(**LOGGING_FORMATTER_KWARGS))
+    target.setFormatter(Formatter(**LOGGING_FORMATTER_KWARGS) if redactor is None else
+                        RedactingFormatter(redactor, **LOGGING_FORMATTER_KWARGS))
     handler = MemoryHandler(maxsize, target=target)
     handler.setLevel(DEBUG)
     try:
@@ -23,22 +26,50 @@ def create_logging_handler_for_collection(tempdir, prefix):
         target.close()
 
 @contextmanager
-def create_temporary_directory_for_log_collection(creation_dir, parent_dir_name, timestamp):
+def create_temporary_directory_for_log_collection(creation_dir, parent_dir_name, timestamp, work_dir=None):
+    # if work_dir is given, the collection is copied aside there instead, and it is kept if the collection fails
     from tempfile import mkdtemp
     from shutil import rmtree
     from os import path, makedirs
-    from socket import gethostname
-    tempdir = mkdtemp(dir=creation_dir)
+    from .util import get_host_dirname
+    tempdir = mkdtemp(dir=creation_dir) if work_dir is None else work_dir
     collect_dir = path.join(tempdir, parent_dir_name)
-    specific_dir = path.join(collect_dir, gethostname(), timestamp.strftime(STRFTIME_SHORT))
+    specific_dir = path.join(collect_dir, get_host_dirname(), timestamp.strftime(STRFTIME_SHORT))
     for dirname in ["commands", "files", "collection-logs"]:
-        makedirs(path.join(specific_dir, dirname))
+        if not path.exists(path.join(specific_dir, dirname)):
+            makedirs(path.join(specific_dir, dirname))
     def onerror(function, path, exc_info):
         logger.debug("Failed to delete {!r}".format(path))
+    completed = False
     try:
         yield collect_dir, specific_dir
+        completed = True
     finally:
-        rmtree(tempdir, onerror=onerror)
+        if work_dir is None or completed:
+            rmtree(tempdir, onerror=onerror)
+
+
+@contextmanager
+def collection_environment(items, silent=False, samples_dir=None, resource_limits=None, redactor=None,
+                           scan_cache=None, mount_health=None):
+    """ the setup shared by run() and incidents.run_windows(): yields (items, bucket), with the samples added to the
+    items, while the throttling, redaction, scan cache and mount probing of the collection are active; the offset
+    indexes of the items are pruned once the collection is done """
+    from .throttling import bandwidth_limit, lowered_priority
+    from .redaction import redaction
+    from .scan_cache import scan_caching
+    from .mounts import mount_probing
+    from .offset_index import prune_offset_indexes
+    if not silent:
+        init_colors()
+    if samples_dir is not None:
+        from .sampling import Samples
+        items = list(items) + [Samples(samples_dir)]
+    bucket = None if resource_limits is None else resource_limits.get_bucket()
+    with bandwidth_limit(bucket), lowered_priority(resource_limits), redaction(redactor), scan_caching(scan_cache), \
+            mount_probing(mount_health):
+        yield items, bucket
+    prune_offset_indexes(items)
 
 
 def get_tar_path(prefix, output_path, timestamp, creation_dir=None):
@@ -84,24 +115,50 @@ def log_collection_context(logging_memory_handler, tempdir, prefix, timestamp, o
     try:
         yield path
     finally:
-        with open_archive(path) as archive:
-            root.removeHandler(logging_memory_handler)
-            logging_memory_handler.flush()
-            logging_memory_handler.close()
-            add_directory(archive, tempdir)
-            print("Logs collected successfully to {}".format(path))
+        root.removeHandler(logging_memory_handler)
+        logging_memory_handler.flush()
+        logging_memory_handler.close()
+        write_archive(path, tempdir)
+        print("Logs collected successfully to {}".format(path))
+
+
+@contextmanager
+def upload_collection_context(logging_memory_handler, tempdir, prefix, timestamp, upload):
+    from logging import root, DEBUG
+    from uuid import uuid4
+    name = "{}-logs.{}-{}.tar.gz".format(prefix, timestamp.strftime(STRFTIME_SHORT), uuid4().hex[:8])
+    streaming_archive = upload.start(name, tempdir)
+    root.addHandler(logging_memory_handler)
+    root.setLevel(DEBUG)
+    try:
+        yield streaming_archive
+    finally:
+        root.removeHandler(logging_memory_handler)
+        logging_memory_handler.flush()
+        logging_memory_handler.close()
+        make_blocking(streaming_archive.close, timeout=None)
+        print("Logs uploaded successfully to {}".format(streaming_archive.location))
 
 
 @contextmanager
 def open_archive(path):
-    from tarfile import TarFile
-    archive = TarFile.open(name=path, mode="w:gz", bufsize=16*1024)
+    from tarfile import PAX_FORMAT
+    from .archive import CollectionTarFile
+    archive = CollectionTarFile.open(name=path, mode="w:gz", bufsize=16*1024, format=PAX_FORMAT)
     try:
         yield archive
     finally:
         archive.close()
 
 
+def write_archive(path, srcdir):
+    """ archives srcdir into path; the compression runs in a worker thread, with the priority of the collection """
+    def write():
+        with open_archive(path) as archive:
+            add_directory(archive, srcdir)
+    make_blocking(write, timeout=None)
+
+
 def workaround_issue_10760(srcdir):
     # WORKAROUND for http://bugs.python.org/issue10760
     # Python's TarFile has issues with files have less data than the reported size
@@ -109,20 +166,42 @@ def workaround_issue_10760(srcdir):
     # But due to the structure of tar files, the workaround was a bit cumbersome
     # This time around, since we're already copying aside what we want to put in the archive, we can fix the files
     # before adding them to the archive
-    from os import path, walk, stat
+    from os import path, walk
     for dirpath, dirnames, filenames in walk(srcdir):
         for filename in filenames:
-            filepath = path.join(dirpath, filename)
-            expected = stat(filepath).st_size
-            actual = 0
-            with open(filepath, 'rb') as fd:
-                actual = bytes_read = len(fd.read(512))
-                while bytes_read == 512:
-                    bytes_read = len(fd.read(512))
-                    actual += bytes_read
-            if actual < expected:
-                with open(filepath, 'ab') as fd:
-                    fd.write(b'\x00' * (expected-actual))
+            fix_short_file(path.join(dirpath, filename))
+
+
+def fix_short_file(filepath):
+    from os import stat
+    expected = stat(filepath).st_size
+    with open(filepath, 'rb') as fd:
+        actual = _count_readable_bytes(fd, expected)
+    if actual < expected:
+        with open(filepath, 'ab') as fd:
+            fd.write(b'\x00' * (expected-actual))
+
+
+def _count_readable_bytes(fd, expected):
+    from os import fstat
+    from .fastcopy import is_sparse, get_data_extents
+    extents = get_data_extents(fd.fileno(), expected) if is_sparse(fstat(fd.fileno())) else None
+    if extents is None:
+        actual = bytes_read = len(fd.read(512))
+        while bytes_read == 512:
+            bytes_read = len(fd.read(512))
+            actual += bytes_read
+        return actual
+    # only the data extents of sparse files are read, the holes are readable as zeros by definition
+    for offset, length in extents:
+        fd.seek(offset)
+        remaining = length
+        while remaining > 0:
+            bytes_read = len(fd.read(min(remaining, 1024 * 1024)))
+            if not bytes_read:
+                return offset + length - remaining
+            remaining -= bytes_read
+    return expected
 
 
 def add_directory(archive, srcdir):
@@ -139,8 +218,13 @@ def user_wants_to_collect(item):
     return six.moves.input('Do you want to collect {} [y/N]? '.format(item)).lower() in ('y', 'yes')
 
 
-def collect(item, tempdir, timestamp, delta, silent, interactive=False):
+def _print_result(text, color):
+    # colorama is only imported when something is printed
     from colorama import Fore
+    print(getattr(Fore, color) + text + Fore.RESET)
+
+
+def collect(item, tempdir, timestamp, delta, silent, interactive=False):
     from sys import stdout
     if interactive and not user_wants_to_collect(item):
         return
@@ -155,16 +239,19 @@ def collect(item, tempdir, timestamp, delta, silent, interactive=False):
         item.collect(tempdir, timestamp, delta)
         logger.info("Collected  {!r} successfully".format(item))
         if not silent:
-            print(Fore.GREEN + "ok" + Fore.RESET)
+            _print_result("ok", "GREEN")
         return True
     except:
         logger.exception("An error ocurred while collecting {!r}".format(item))
         if not silent:
-            print(Fore.MAGENTA + "error" + Fore.RESET)
+            _print_result("error", "MAGENTA")
         return False
 
 
-def run(prefix, items, timestamp, delta, output_path=None, creation_dir=None, parent_dir_name="logs", silent=False, interactive=False):
+def run(prefix, items, timestamp, delta, output_path=None, creation_dir=None, parent_dir_name="logs", silent=False, interactive=False,
+        samples_dir=None, resource_limits=None, redactor=None, plan=None, metrics_history_path=None,
+        scan_cache=None, windows=None, single_archive=False, work_dir=None, resume=False, upload=None,
+        deadline_seconds=None, mount_health=None, roots=None):
     """ collects log items and creates an archive with all collected items.
     items is a list of instances of 'Item' subclasses (see the collectables submodule).
     timestamp and delta indicate the timeframe of logs that need to be collected.
@@ -179,20 +266,102 @@ def run(prefix, items, timestamp, delta, output_path=None, creation_dir=None, pa
     and the current time.
     parent_dir_name is the name of the parent directory that will be created inside the output archive.
     silent specified whether or not to print the process to stdout. pass True to silence the prints. The process
-    will still be logged to a file under 'collection-logs' in the creation directory. """
-    init_colors()
+    will still be logged to a file under 'collection-logs' in the creation directory.
+    samples_dir is the ring directory of a background Sampler (see the sampling submodule); the samples taken within
+    the timeframe are added to the archive under 'samples'.
+    resource_limits is an optional throttling.ResourceLimits instance, capping the bandwidth of the collection and
+    lowering the priority of its copying, archiving and commands. How much throttling occurred is written to
+    'collection-logs/metrics.json'.
+    redactor is an optional redaction.Redactor, applied to the collected files, command outputs and environment
+    variables while they are written.
+    plan is an optional planning.Plan of these items, whose estimates schedule the items for deadline_seconds.
+    Files that more than one item matches are collected once, by the first item that copies them.
+    metrics_history_path is an optional file the metrics of this run are appended to, for planning later runs.
+    scan_cache is an optional scan_cache.ScanCache that Directory items scan their directories through.
+    windows is an optional list of more (timestamp, delta) windows to collect in the same pass (see the incidents
+    submodule). A list of (end_result, archive_path) is then returned, one per window, or a single one for a single
+    archive with a subtree per window if single_archive is True.
+    work_dir is an optional persistent directory to collect in, with a journal of the items and files that finished
+    (see the checkpoint submodule). It is kept if the collection is interrupted; pass resume=True to continue such a
+    collection, with the timestamp and delta it was started with.
+    upload is an optional upload.Upload; the archive is then uploaded while it is collected, instead of being written
+    to output_path, and its location is returned instead of the archive path.
+    deadline_seconds is an optional time limit for the collection. The items are then collected by priority, with
+    their timeouts shrunk to the time that remains, and the items that do not fit are skipped (see the scheduling
+    submodule).
+    mount_health is an optional mounts.MountHealth; the mounts every item needs are probed first, and the items on
+    dead mounts are skipped or narrowed instead of blocking until their timeouts.
+    roots is an optional list of roots.Root instances or paths (container or chroot root filesystems); the Directory
+    items are then collected under every root, concurrently, into 'files/<root id>' (see the roots submodule). """
+    from os import path
+    from time import time
+    from .metrics import Metrics
+    from .checkpoint import Checkpoint, checkpointing
+    from .scheduling import Scheduler
+    from .planning import CollectedFiles, deduplicating
+    if windows is not None:
+        from .incidents import run_windows
+        if any(arg is not None for arg in (plan, metrics_history_path, work_dir, upload, deadline_seconds, roots)):
+            raise ValueError("plan, metrics_history_path, work_dir, upload, deadline_seconds and roots are not "
+                             "supported when collecting several windows")
+        return run_windows(prefix, items, [(timestamp, delta)] + list(windows), output_path, creation_dir,
+                           parent_dir_name, silent, interactive, single_archive, samples_dir, resource_limits,
+                           redactor, scan_cache, mount_health)
+    if work_dir is not None and upload is not None:
+        raise ValueError("An uploaded collection cannot be resumed")
+    if roots is not None:
+        from .roots import apply_to_roots
+        items = apply_to_roots(items, roots)
     end_result = True
-    with create_temporary_directory_for_log_collection(creation_dir, parent_dir_name, timestamp) as (tempdir, runtime_dir):
-        with create_logging_handler_for_collection(runtime_dir, prefix) as handler:
-            with log_collection_context(handler, tempdir, prefix, timestamp, output_path, creation_dir) as archive_path:
-                kwargs = dict(prefix=prefix, timestamp=timestamp, delta=delta, output_path=output_path,
-                              creation_dir=creation_dir, parent_dir_name=parent_dir_name)
-                logger.info("Starting log collection with kwargs {!r}".format(kwargs))
-                for item in items:
-                    result = collect(item, runtime_dir, timestamp, delta, silent, interactive)
-                    end_result = end_result and result
-                end_result = 0 if end_result else 1
-                return end_result, archive_path
+    metrics = Metrics()
+    scheduler = Scheduler(deadline_seconds, metrics_history_path, plan)
+    checkpoint = None if work_dir is None else Checkpoint(work_dir, prefix, timestamp, delta, resume)
+    if checkpoint is not None:
+        timestamp, delta = checkpoint.timestamp, checkpoint.delta
+    tree_dir = None if checkpoint is None else checkpoint.tree_dir
+    with collection_environment(items, silent, samples_dir, resource_limits, redactor, scan_cache,
+                                mount_health) as (items, bucket), \
+            checkpointing(checkpoint), deduplicating(CollectedFiles()):
+        with create_temporary_directory_for_log_collection(creation_dir, parent_dir_name, timestamp, tree_dir) as (tempdir, runtime_dir):
+            with create_logging_handler_for_collection(runtime_dir, prefix) as handler:
+                if upload is None:
+                    context = log_collection_context(handler, tempdir, prefix, timestamp, output_path, creation_dir)
+                else:
+                    context = upload_collection_context(handler, tempdir, prefix, timestamp, upload)
+                with context as archive:
+                    archive_path = archive if upload is None else archive.location
+                    kwargs = dict(prefix=prefix, timestamp=timestamp, delta=delta, output_path=output_path,
+                                  creation_dir=creation_dir, parent_dir_name=parent_dir_name,
+                                  resource_limits=resource_limits, work_dir=work_dir, resume=resume,
+                                  deadline_seconds=deadline_seconds)
+                    logger.info("Starting log collection with kwargs {!r}".format(kwargs))
+                    for index, item in enumerate(scheduler.order(items)):
+                        key = None if checkpoint is None else checkpoint.get_item_key(index, item)
+                        if checkpoint is not None and checkpoint.is_item_done(key):
+                            logger.info("Skipping {!r}, it was collected before the collection was resumed".format(item))
+                            continue
+                        if not scheduler.should_collect(item):
+                            continue
+                        started = time()
+                        with scheduler.budget(item):
+                            result = collect(item, runtime_dir, timestamp, delta, silent, interactive)
+                        metrics.add_item(item, time() - started, result)
+                        if checkpoint is not None and result:
+                            checkpoint.item_done(key)
+                        if upload is not None:
+                            make_blocking(archive.add_new_files, timeout=None)
+                        end_result = end_result and result
+                    metrics.set_throttling(bucket)
+                    metrics.set_schedule(scheduler)
+                    metrics.write(path.join(runtime_dir, "collection-logs"))
+                    if metrics_history_path is not None:
+                        metrics.append_to_history(metrics_history_path)
+                    end_result = 0 if end_result else 1
+            if bucket is not None:
+                logger.info("Collection throttled with {!r}: {!r}".format(bucket, bucket.get_stats()))
+    if checkpoint is not None:
+        checkpoint.remove()
+    return end_result, archive_path
 
 
 # TODO A web frontend that parser log collections
@@ -0,0 +1,252 @@
+""" Offline analysis and indexing of collection archives.
+
+Archives are scanned in parallel by a process pool. Every archive is read as a single stream, and the lines of its
+members that match one of the SIGNATURES (kernel panics, OOM kills, tracebacks...) are recorded with the host and
+the time of the collection, and the time of the line if it has one. The findings are kept in an SQLite index with
+an inverted index of the words of every finding. The index is incremental: archives that were already indexed and
+did not change since are not scanned again.
+
+    python -m infi.logs_collector.analysis index findings.db /collections/*.tar.gz
+    python -m infi.logs_collector.analysis query findings.db --signature oom_kill --host node-3
+    python -m infi.logs_collector.analysis query findings.db --term nfs --since 2026-10-01
+"""
+from logging import getLogger
+from os import path
+
+logger = getLogger(__name__)
+
+CHUNK_SIZE = 4 * 1024 * 1024
+MAX_TEXT_LENGTH = 512
+SIGNATURES = [
+    ("kernel_panic", br'Kernel panic - not syncing'),
+    ("oom_kill", br'Out of memory: Kill|invoked oom-killer|oom-kill:'),
+    ("hung_task", br'blocked for more than \d+ seconds'),
+    ("call_trace", br'Call Trace:'),
+    ("segfault", br'segfault at [0-9a-f]+'),
+    ("traceback", br'Traceback \(most recent call last\)'),
+    ("io_error", br'I/O error|Buffer I/O error|blk_update_request: I/O error'),
+    ("error", br'\b(?:ERROR|CRITICAL|FATAL)\b'),
+]
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, host TEXT, collected_at REAL);
+CREATE TABLE IF NOT EXISTS findings (id INTEGER PRIMARY KEY, archive TEXT, host TEXT, collected_at REAL,
+                                     signature TEXT, member TEXT, line_number INTEGER, time REAL, text TEXT);
+CREATE TABLE IF NOT EXISTS terms (term TEXT, finding INTEGER);
+CREATE INDEX IF NOT EXISTS findings_by_signature ON findings (signature, host, time);
+CREATE INDEX IF NOT EXISTS findings_by_host ON findings (host, time);
+CREATE INDEX IF NOT EXISTS findings_by_archive ON findings (archive);
+CREATE INDEX IF NOT EXISTS terms_by_term ON terms (term);
+"""
+
+
+def _get_pattern():
+    from re import compile
+    return compile(b'|'.join(b'(?P<' + name.encode() + b'>' + pattern + b')' for name, pattern in SIGNATURES))
+
+
+def _parse_member_path(name):
+    """ returns (host, collected_at) of a member named <parent>/<host>/<timestamp>/... """
+    from datetime import datetime
+    from time import mktime
+    from .util import STRFTIME_SHORT
+    parts = name.split('/')
+    if len(parts) < 3:
+        return None, None
+    try:
+        return parts[1], mktime(datetime.strptime(parts[2], STRFTIME_SHORT).timetuple())
+    except ValueError:
+        return parts[1], None
+
+
+def get_terms(text):
+    from re import findall
+    return sorted(set(word.lower() for word in findall(r'[A-Za-z_][A-Za-z0-9_.-]{2,}', text)))
+
+
+def _scan_member(fileobj, pattern, year):
+    """ yields (signature, line_number, time, text) of the matching lines of a member """
+    from .util import parse_line_time
+    line_number, pending = 0, b''
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        data = pending + chunk
+        end = len(data) if not chunk else data.rfind(b'\n') + 1
+        if not end and chunk:
+            pending = data
+            continue
+        data, pending = data[:end], data[end:]
+        seen, position, lines_before = set(), 0, 0
+        # the lines are only split around the matches, the rest of the data is searched by the regex engine
+        for match in pattern.finditer(data):
+            start = data.rfind(b'\n', 0, match.start()) + 1
+            if (start, match.lastgroup) in seen:
+                continue
+            seen.add((start, match.lastgroup))
+            lines_before += data.count(b'\n', position, start)
+            position = start
+            stop = data.find(b'\n', start)
+            line = data[start:stop if stop >= 0 else len(data)]
+            yield (match.lastgroup, line_number + lines_before + 1, parse_line_time(line, year),
+                   line[:MAX_TEXT_LENGTH].decode("utf-8", "replace"))
+        line_number += data.count(b'\n')
+        if not chunk:
+            break
+
+
+def analyze_archive(archive_path):
+    """ returns dict(path, host, collected_at, findings=[(signature, member, line_number, time, text)]) """
+    from tarfile import TarFile
+    from time import localtime
+    from .checksums import is_manifest
+    pattern = _get_pattern()
+    result = dict(path=archive_path, host=None, collected_at=None, findings=[])
+    with TarFile.open(archive_path, "r|*") as archive:
+        for member in archive:
+            if not member.isfile() or is_manifest(member.name):
+                continue
+            host, collected_at = _parse_member_path(member.name)
+            result["host"] = result["host"] or host
+            result["collected_at"] = result["collected_at"] or collected_at
+            year = localtime(collected_at).tm_year if collected_at else None
+            for signature, line_number, line_time, text in _scan_member(archive.extractfile(member), pattern, year):
+                result["findings"].append((signature, member.name, line_number, line_time, text))
+    return result
+
+
+class Index(object):
+    def __init__(self, index_path):
+        super(Index, self).__init__()
+        import sqlite3
+        self.index_path = index_path
+        self._connection = sqlite3.connect(index_path)
+        self._connection.executescript(SCHEMA)
+
+    def __repr__(self):
+        return "<Index({!r})>".format(self.index_path)
+
+    def needs_analysis(self, archive_path):
+        from os import stat
+        stat_result = stat(archive_path)
+        row = self._connection.execute("SELECT size, mtime FROM archives WHERE path = ?",
+                                       (path.abspath(archive_path),)).fetchone()
+        return row != (stat_result.st_size, stat_result.st_mtime)
+
+    def add(self, result):
+        from os import stat
+        archive_path = path.abspath(result["path"])
+        stat_result = stat(result["path"])
+        cursor = self._connection.cursor()
+        cursor.execute("DELETE FROM terms WHERE finding IN (SELECT id FROM findings WHERE archive = ?)",
+                       (archive_path,))
+        cursor.execute("DELETE FROM findings WHERE archive = ?", (archive_path,))
+        cursor.execute("INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?, ?)",
+                       (archive_path, stat_result.st_size, stat_result.st_mtime, result["host"],
+                        result["collected_at"]))
+        for signature, member, line_number, line_time, text in result["findings"]:
+            cursor.execute("INSERT INTO findings (archive, host, collected_at, signature, member, line_number, time, "
+                           "text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           (archive_path, result["host"], result["collected_at"], signature, member, line_number,
+                            line_time if line_time is not None else result["collected_at"], text))
+            cursor.executemany("INSERT INTO terms VALUES (?, ?)",
+                               [(term, cursor.lastrowid) for term in get_terms(text)])
+        self._connection.commit()
+
+    def query(self, signature=None, host=None, since=None, until=None, term=None, limit=100):
+        """ returns a list of dicts of the findings, most recent first; since and until are seconds since the epoch """
+        conditions, args = [], []
+        for condition, value in (("signature = ?", signature), ("host = ?", host), ("time >= ?", since),
+                                 ("time <= ?", until)):
+            if value is not None:
+                conditions.append(condition)
+                args.append(value)
+        if term is not None:
+            conditions.append("id IN (SELECT finding FROM terms WHERE term = ?)")
+            args.append(term.lower())
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        columns = ["archive", "host", "collected_at", "signature", "member", "line_number", "time", "text"]
+        rows = self._connection.execute("SELECT {} FROM findings{} ORDER BY time DESC LIMIT ?".format(
+                                        ', '.join(columns), where), args + [limit]).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def get_summary(self):
+        """ returns {(host, signature): count} """
+        rows = self._connection.execute("SELECT host, signature, COUNT(*) FROM findings GROUP BY host, signature")
+        return dict(((host, signature), count) for host, signature, count in rows)
+
+    def close(self):
+        self._connection.close()
+
+
+def analyze(archive_paths, index_path, workers=None):
+    """ scans the archives that are not in the index yet in parallel, and adds their findings to the index.
+    Returns the number of archives scanned. """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    index = Index(index_path)
+    try:
+        pending = [archive_path for archive_path in archive_paths if index.needs_analysis(archive_path)]
+        if not pending:
+            return 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = dict((executor.submit(analyze_archive, archive_path), archive_path) for archive_path in pending)
+            for future in as_completed(futures):
+                try:
+                    index.add(future.result())
+                except Exception:
+                    logger.exception("Failed to analyze {!r}".format(futures[future]))
+        return len(pending)
+    finally:
+        index.close()
+
+
+def parse_query_time(value):
+    """ returns the time value stands for as seconds since the epoch. Unlike the --timestamp of a collection, it is
+    not moved to the end of the day or the minute, and not capped to now: a query boundary is exact. """
+    from argparse import ArgumentTypeError
+    from datetime import datetime
+    from time import mktime
+    from .scripts import DATE_FORMATS, fill_in_missing_date
+    for date_format in DATE_FORMATS:
+        try:
+            return mktime(fill_in_missing_date(datetime.strptime(value, date_format)).timetuple())
+        except ValueError:
+            pass
+    raise ArgumentTypeError("Invalid datetime string: {!r}".format(value))
+
+
+def main(argv=None):
+    from argparse import ArgumentParser
+    from time import strftime, localtime
+    parser = ArgumentParser(description="index collection archives and query their findings")
+    subparsers = parser.add_subparsers(dest="command")
+    index_parser = subparsers.add_parser("index")
+    index_parser.add_argument("index_path")
+    index_parser.add_argument("archives", nargs="+")
+    index_parser.add_argument("--workers", type=int, default=None)
+    query_parser = subparsers.add_parser("query")
+    query_parser.add_argument("index_path")
+    query_parser.add_argument("--signature", choices=[name for name, pattern in SIGNATURES])
+    query_parser.add_argument("--host")
+    query_parser.add_argument("--since", type=parse_query_time)
+    query_parser.add_argument("--until", type=parse_query_time)
+    query_parser.add_argument("--term")
+    query_parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args(argv)
+    if args.command == "index":
+        print("Analyzed {} archives".format(analyze(args.archives, args.index_path, args.workers)))
+    elif args.command == "query":
+        index = Index(args.index_path)
+        try:
+            for finding in index.query(args.signature, args.host, args.since, args.until, args.term, args.limit):
+                when = strftime("%Y-%m-%d %H:%M:%S", localtime(finding["time"])) if finding["time"] else "-"
+                print("{} {} {} {}:{}: {}".format(when, finding["host"], finding["signature"], finding["member"],
+                                                  finding["line_number"], finding["text"]))
+        finally:
+            index.close()
+    else:
+        parser.error("missing command")
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,135 @@
+""" The TarFile used for writing collection archives.
+
+Sparse files are stored as PAX 1.0 sparse members (the format GNU tar writes with --sparse --format=pax): the
+member data starts with a map of the data extents, followed by the data of the extents only. GNU tar, bsdtar and
+Python's tarfile restore the holes when extracting.
+
+The contents of every file are hashed while they are read into the archive, and the checksums manifest is written
+as the last member when the archive is closed (see the checksums submodule).
+"""
+from tarfile import TarFile, BLOCKSIZE
+
+
+class SparseReader(object):
+    """ reads the sparse map followed by the data extents of a file """
+    def __init__(self, fileobj, extents, map_bytes, hasher=None):
+        super(SparseReader, self).__init__()
+        self.fileobj = fileobj
+        self.hasher = hasher
+        self._map = map_bytes
+        self._extents = list(extents)
+        self._remaining = 0
+
+    def _read_extents(self, size):
+        while not self._remaining and self._extents:
+            offset, self._remaining = self._extents.pop(0)
+            self.fileobj.seek(offset)
+        if self.hasher is not None:
+            self.hasher.update_at(self.fileobj.tell(), b'')
+        data = self.fileobj.read(self._remaining if size < 0 else min(size, self._remaining))
+        if self.hasher is not None:
+            self.hasher.update(data)
+        self._remaining = self._remaining - len(data) if data else 0
+        return data
+
+    def read(self, size=-1):
+        output = []
+        if self._map:
+            data = self._map if size < 0 else self._map[:size]
+            self._map = self._map[len(data):]
+            output.append(data)
+            size = size if size < 0 else size - len(data)
+        while size != 0 and (self._remaining or self._extents):
+            data = self._read_extents(size)
+            if not data:
+                break
+            output.append(data)
+            if size > 0:
+                size -= len(data)
+        return b''.join(output)
+
+
+def get_sparse_map(extents):
+    lines = [str(len(extents))] + ["{}\n{}".format(offset, length) for offset, length in extents]
+    map_bytes = ('\n'.join(lines) + '\n').encode()
+    return map_bytes + b'\0' * (-len(map_bytes) % BLOCKSIZE)
+
+
+class CollectionTarFile(TarFile):
+    def __init__(self, *args, **kwargs):
+        from .checksums import get_default_algorithm
+        self.checksum_algorithm = kwargs.pop("checksum_algorithm", get_default_algorithm())
+        self.checksums = []
+        super(CollectionTarFile, self).__init__(*args, **kwargs)
+
+    def _get_sparse_extents(self, tarinfo, fileobj):
+        from os import fstat
+        from .fastcopy import is_sparse, get_data_extents
+        if not tarinfo.isreg() or not hasattr(fileobj, "fileno"):
+            return None
+        try:
+            fileno = fileobj.fileno()
+        except (AttributeError, IOError, OSError):
+            return None
+        if not is_sparse(fstat(fileno)):
+            return None
+        extents = get_data_extents(fileno, tarinfo.size)
+        if extents is not None and sum(extents[-1] if extents else (0, 0)) < tarinfo.size:
+            # like GNU tar, a trailing hole is marked with an empty extent at the end of the file
+            extents.append((tarinfo.size, 0))
+        return extents
+
+    def _make_sparse_tarinfo(self, tarinfo, extents):
+        from copy import copy
+        from posixpath import dirname, basename, join
+        sparse = copy(tarinfo)
+        sparse.pax_headers = dict(tarinfo.pax_headers)
+        sparse.pax_headers.update({"GNU.sparse.major": "1", "GNU.sparse.minor": "0",
+                                   "GNU.sparse.name": tarinfo.name, "GNU.sparse.realsize": str(tarinfo.size)})
+        sparse.name = join(dirname(tarinfo.name), "GNUSparseFile.0", basename(tarinfo.name))
+        sparse.size = len(get_sparse_map(extents)) + sum(length for offset, length in extents)
+        return sparse
+
+    def addfile(self, tarinfo, fileobj=None):
+        from .throttling import get_active_bucket, ThrottledReader
+        from .checksums import ContentHasher, HashingReader
+        hasher = None
+        if fileobj is not None and self.checksum_algorithm is not None and tarinfo.isreg():
+            hasher = ContentHasher(self.checksum_algorithm)
+        name, size = tarinfo.name, tarinfo.size
+        extents = None if fileobj is None else self._get_sparse_extents(tarinfo, fileobj)
+        if extents is not None:
+            fileobj = SparseReader(fileobj, extents, get_sparse_map(extents), hasher)
+            tarinfo = self._make_sparse_tarinfo(tarinfo, extents)
+        elif hasher is not None:
+            fileobj = HashingReader(fileobj, hasher)
+        bucket = get_active_bucket()
+        if fileobj is not None and bucket is not None:
+            fileobj = ThrottledReader(fileobj, bucket)
+        result = super(CollectionTarFile, self).addfile(tarinfo, fileobj)
+        if hasher is not None:
+            self.checksums.append((name, hasher.hexdigest(size)))
+        return result
+
+    def _get_manifest_name(self):
+        from posixpath import join
+        from .checksums import MANIFEST_NAME
+        roots = [member.name.split('/')[0] for member in self.members]
+        return join(roots[0], MANIFEST_NAME) if roots else MANIFEST_NAME
+
+    def close(self):
+        from io import BytesIO
+        from time import time
+        from tarfile import TarInfo
+        from .checksums import format_manifest
+        if self.mode in "aw" and not self.closed and self.checksum_algorithm is not None:
+            manifest = format_manifest(self.checksum_algorithm, self.checksums)
+            tarinfo = TarInfo(self._get_manifest_name())
+            tarinfo.size = len(manifest)
+            tarinfo.mtime = time()
+            algorithm, self.checksum_algorithm = self.checksum_algorithm, None
+            try:
+                self.addfile(tarinfo, BytesIO(manifest))
+            finally:
+                self.checksum_algorithm = algorithm
+        super(CollectionTarFile, self).close()
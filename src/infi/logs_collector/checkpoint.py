@@ -0,0 +1,152 @@
+""" Checkpointed, resumable collections.
+
+By default the collection is copied aside to a temporary directory that is deleted when the collection ends, so an
+interrupted collection starts from zero. With a work directory, the collection is copied aside to
+<work_dir>/tree, which is kept if the collection is interrupted, and a journal in <work_dir>/journal records the
+items and the files that finished. Resuming a collection from the same work directory uses the timeframe of the
+interrupted collection, skips the items and the files recorded in the journal and then writes the archive.
+
+The journal is a file of JSON lines:
+
+    {"prefix": "collection", "timestamp": "2026-10-19T10:00:00", "delta": 3600.0}
+    {"file": "/var/log/messages", "size": 1048576}
+    {"item": "0:<Directory(dirname='/var/log', ...)>"}
+
+Items that failed are not recorded, so they are collected again when resuming.
+"""
+from logging import getLogger
+from contextlib import contextmanager
+from os import path
+import threading
+
+logger = getLogger(__name__)
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+_active_checkpoint = None
+
+
+class Checkpoint(object):
+    def __init__(self, work_dir, prefix, timestamp, delta, resume=False):
+        """
+        work_dir - a persistent directory for the collection and its journal
+        prefix, timestamp, delta - the collection parameters, recorded in the journal
+        resume - continue the collection recorded in the journal of work_dir, if there is one; when resuming, the
+                 timestamp and delta are taken from the journal
+        """
+        super(Checkpoint, self).__init__()
+        self.work_dir = work_dir
+        self.journal_path = path.join(work_dir, "journal")
+        self.tree_dir = path.join(work_dir, "tree")
+        self.prefix, self.timestamp, self.delta = prefix, timestamp, delta
+        self._items = set()
+        self._files = {}
+        self._lock = threading.Lock()
+        if resume and path.exists(self.journal_path):
+            self._load()
+            self._journal = open(self.journal_path, 'a')
+        else:
+            self._reset()
+
+    def __repr__(self):
+        return "<Checkpoint({!r})>".format(self.work_dir)
+
+    def _reset(self):
+        from os import makedirs
+        from shutil import rmtree
+        if path.exists(self.tree_dir):
+            rmtree(self.tree_dir)
+        if not path.exists(self.work_dir):
+            makedirs(self.work_dir)
+        self._journal = open(self.journal_path, 'w')
+        self._write(dict(prefix=self.prefix, timestamp=self.timestamp.strftime(TIMESTAMP_FORMAT),
+                         delta=self.delta.total_seconds()), sync=True)
+
+    def _load(self):
+        from json import loads
+        with open(self.journal_path) as fd:
+            lines = fd.read().splitlines()
+        header = loads(lines[0])
+        self.prefix = header["prefix"]
+        self.timestamp, self.delta = _parse_timeframe(header)
+        for line in lines[1:]:
+            try:
+                record = loads(line)
+            except ValueError:
+                # the last line is partial if we were killed while writing it
+                logger.debug("Ignoring a partial journal record {!r}".format(line))
+                continue
+            if "item" in record:
+                self._items.add(record["item"])
+            else:
+                self._files[record["file"]] = record["size"]
+        logger.info("Resuming the collection in {!r}: {} items and {} files already collected".format(
+                    self.work_dir, len(self._items), len(self._files)))
+
+    def _write(self, record, sync=False):
+        from json import dumps
+        from os import fsync
+        with self._lock:
+            self._journal.write(dumps(record) + '\n')
+            self._journal.flush()
+            if sync:
+                fsync(self._journal.fileno())
+
+    @staticmethod
+    def get_item_key(index, item):
+        return "{}:{!r}".format(index, item)
+
+    def is_item_done(self, key):
+        return key in self._items
+
+    def item_done(self, key):
+        self._items.add(key)
+        self._write(dict(item=key), sync=True)
+
+    def is_file_done(self, src, dst):
+        """ a file is done if it was recorded and its copy still has the recorded size """
+        size = self._files.get(src)
+        return size is not None and path.exists(dst) and path.getsize(dst) == size
+
+    def file_done(self, src, size):
+        self._files[src] = size
+        self._write(dict(file=src, size=size))
+
+    def close(self):
+        self._journal.close()
+
+    def remove(self):
+        """ removes the journal after the collection finished """
+        from os import remove
+        self.close()
+        remove(self.journal_path)
+
+
+def _parse_timeframe(header):
+    from datetime import datetime, timedelta
+    return datetime.strptime(header["timestamp"], TIMESTAMP_FORMAT), timedelta(seconds=header["delta"])
+
+
+def read_timeframe(work_dir):
+    """ returns the (timestamp, delta) of the collection recorded in the journal of work_dir, or None """
+    from json import loads
+    journal_path = path.join(work_dir, "journal")
+    if not path.exists(journal_path):
+        return None
+    with open(journal_path) as fd:
+        return _parse_timeframe(loads(fd.readline()))
+
+
+def get_active_checkpoint():
+    return _active_checkpoint
+
+
+@contextmanager
+def checkpointing(checkpoint):
+    """ makes the files collected within the context recorded in (and skipped by) checkpoint """
+    global _active_checkpoint
+    previous, _active_checkpoint = _active_checkpoint, checkpoint
+    try:
+        yield checkpoint
+    finally:
+        _active_checkpoint = previous
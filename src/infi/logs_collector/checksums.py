@@ -0,0 +1,241 @@
+""" Per-member checksums of collection archives.
+
+The archive writer hashes the data of every file while it is already reading it for the archive, and writes a
+manifest named 'checksums' as the last member of the archive. The manifest has the format of sha256sum and
+friends, preceded by a line naming the algorithm:
+
+    # algorithm: blake2b
+    <hexdigest>  logs/host/2026-10-19.10-00/files/var/log/messages
+
+The digests are of the file contents, so they can be checked against the archive itself or against the extracted
+files:
+
+    python -m infi.logs_collector.checksums verify collection.tar.gz
+    python -m infi.logs_collector.checksums verify extracted/ --manifest extracted/logs/checksums
+
+xxh3_128 is used when the optional xxhash package is installed (the 'checksums' extra), blake2b otherwise.
+"""
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+MANIFEST_NAME = "checksums"
+CHUNK_SIZE = 1024 * 1024
+_ZEROS = b'\0' * CHUNK_SIZE
+
+
+def get_default_algorithm():
+    try:
+        import xxhash
+        return "xxh3_128"
+    except ImportError:
+        return "blake2b"
+
+
+def new_hash(algorithm):
+    """ returns a new hash object of algorithm, raises ValueError if it is not supported on this host """
+    from hashlib import new
+    try:
+        if algorithm.startswith("xxh"):
+            import xxhash
+            return getattr(xxhash, algorithm)()
+        return new(algorithm)
+    except (ImportError, AttributeError, ValueError):
+        raise ValueError("Unsupported algorithm: {!r}".format(algorithm))
+
+
+class ContentHasher(object):
+    """ hashes the contents of a file; update_at() skips over holes, which are hashed as zeros """
+    def __init__(self, algorithm):
+        super(ContentHasher, self).__init__()
+        self._hash = new_hash(algorithm)
+        self.position = 0
+
+    def update(self, data):
+        self._hash.update(data)
+        self.position += len(data)
+
+    def update_at(self, offset, data):
+        while self.position < offset:
+            self.update(_ZEROS[:min(CHUNK_SIZE, offset - self.position)])
+        self.update(data)
+
+    def hexdigest(self, size=None):
+        if size is not None:
+            self.update_at(size, b'')
+        return self._hash.hexdigest()
+
+
+class HashingReader(object):
+    def __init__(self, fileobj, hasher):
+        super(HashingReader, self).__init__()
+        self.fileobj = fileobj
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+def format_manifest(algorithm, checksums):
+    lines = ["# algorithm: {}".format(algorithm)]
+    lines += ["{}  {}".format(digest, name) for name, digest in checksums]
+    return ('\n'.join(lines) + '\n').encode("utf-8")
+
+
+def parse_manifest(data):
+    """ returns (algorithm, {name: digest}) """
+    lines = data.decode("utf-8").splitlines()
+    if not lines or not lines[0].startswith("# algorithm: "):
+        raise ValueError("Not a checksums manifest")
+    algorithm = lines[0].split(": ", 1)[1].strip()
+    checksums = {}
+    for line in lines[1:]:
+        if line.strip():
+            digest, name = line.split("  ", 1)
+            checksums[name] = digest
+    return algorithm, checksums
+
+
+def _hash_fileobj(fileobj, algorithm):
+    hasher = ContentHasher(algorithm)
+    while True:
+        data = fileobj.read(CHUNK_SIZE)
+        if not data:
+            break
+        hasher.update(data)
+    return hasher.hexdigest()
+
+
+def _hash_file(filepath, algorithm):
+    with open(filepath, 'rb') as fd:
+        return _hash_fileobj(fd, algorithm)
+
+
+def _compare(expected, actual):
+    """ returns a list of (name, problem) """
+    problems = [(name, "missing") for name in sorted(set(expected) - set(actual))]
+    problems += [(name, "not in manifest") for name in sorted(set(actual) - set(expected))]
+    problems += [(name, "checksum mismatch") for name in sorted(set(expected) & set(actual))
+                 if expected[name] != actual[name]]
+    return problems
+
+
+def is_manifest(name):
+    from posixpath import basename
+    return basename(name) == MANIFEST_NAME and name.strip('/').count('/') <= 1
+
+
+def verify_archive(archive_path, algorithm=None):
+    """ verifies the members of an archive against its manifest, returns a list of (name, problem).
+    The archive is decompressed in a single stream while a second thread hashes the members, so decompressing
+    and hashing overlap (both release the GIL). Raises ValueError if the algorithm is not supported. """
+    from tarfile import TarFile
+    from threading import Thread
+    from six.moves.queue import Queue
+    algorithm = algorithm or get_default_algorithm()
+    new_hash(algorithm)  # fails here rather than in the consumer
+    chunks = Queue(maxsize=16)
+    actual = {}
+    errors = []
+    manifest = None
+
+    def consume():
+        hasher = None
+        while True:
+            name, data = chunks.get()
+            if name is None:
+                break
+            if errors:
+                continue  # the queue is drained, so the producer never blocks on it
+            try:
+                if data is None:
+                    actual[name] = hasher.hexdigest()
+                    hasher = None
+                    continue
+                hasher = hasher or ContentHasher(algorithm)
+                hasher.update(data)
+            except Exception as error:
+                errors.append(error)
+
+    consumer = Thread(target=consume, name="checksums-verify")
+    consumer.start()
+    try:
+        with TarFile.open(archive_path, "r|*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                fileobj = archive.extractfile(member)
+                if is_manifest(member.name):
+                    manifest = fileobj.read()
+                    continue
+                chunks.put((member.name, b''))
+                for data in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+                    if errors:
+                        break
+                    chunks.put((member.name, data))
+                if errors:
+                    break
+                chunks.put((member.name, None))
+    finally:
+        chunks.put((None, None))
+        consumer.join()
+    if errors:
+        raise errors[0]
+    if manifest is None:
+        return [(archive_path, "no checksums manifest")]
+    manifest_algorithm, expected = parse_manifest(manifest)
+    if manifest_algorithm != algorithm:
+        return verify_archive(archive_path, manifest_algorithm)
+    return _compare(expected, actual)
+
+
+def verify_directory(dirpath, manifest_path, workers=4):
+    """ verifies extracted files under dirpath against a manifest, hashing the files in parallel """
+    from concurrent.futures import ThreadPoolExecutor
+    from os import path
+    with open(manifest_path, 'rb') as fd:
+        algorithm, expected = parse_manifest(fd.read())
+    existing = [name for name in expected if path.isfile(path.join(dirpath, name))]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        digests = executor.map(lambda name: _hash_file(path.join(dirpath, name), algorithm), existing)
+        actual = dict(zip(existing, digests))
+    return _compare(expected, actual)
+
+
+def main(argv=None):
+    from argparse import ArgumentParser
+    from os import path
+    parser = ArgumentParser(description="verify the checksums of a collection archive or an extracted collection")
+    subparsers = parser.add_subparsers(dest="command")
+    verify = subparsers.add_parser("verify")
+    verify.add_argument("path", help="an archive, or a directory it was extracted to")
+    verify.add_argument("--manifest", help="the manifest file, when verifying a directory")
+    verify.add_argument("--workers", type=int, default=4, help="number of files hashed in parallel (directories)")
+    args = parser.parse_args(argv)
+    if args.command != "verify":
+        parser.error("missing command")
+    if path.isdir(args.path):
+        if args.manifest is None:
+            parser.error("--manifest is required when verifying a directory")
+        problems = verify_directory(args.path, args.manifest, args.workers)
+    else:
+        try:
+            problems = verify_archive(args.path)
+        except ValueError as error:
+            print("{}: {}".format(args.path, error))
+            return 1
+    for name, problem in problems:
+        print("{}: {}".format(name, problem))
+    if not problems:
+        print("OK")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -6,6 +6,9 @@ from os import path, stat
 logger = getLogger(__name__)
 
 class Item(object): # pragma: no cover
+    priority = 0  # when run() has a deadline, items with higher priorities are collected first
+    expected_seconds = None  # how long collecting the item takes, if known better than the metrics history
+
     def collect(self, targetdir, timestamp, delta):
         raise NotImplementedError()
 
@@ -44,13 +47,30 @@ def reinit():
 
 
 class Directory(Item):
-    def __init__(self, dirname, regex_basename='.*', recursive=False, timeout_in_seconds=60, timeframe_only=True):
+    def __init__(self, dirname, regex_basename='.*', recursive=False, timeout_in_seconds=60, timeframe_only=True,
+                 hardlink_rotated=False, offset_index_dir=None):
+        """
+        Define a directory to collect files from.
+        dirname - the directory to collect
+        regex_basename - only the files whose name matches this regular expression are collected
+        recursive - collect from subdirectories as well
+        timeout_in_seconds - maximum time to wait for the collection to finish
+        timeframe_only - only collect the files that were modified within the timeframe
+        hardlink_rotated - hardlink rotated (immutable) logs instead of copying them, when possible
+        offset_index_dir - keep sparse timestamp to offset indexes of the files in this directory, and only collect
+                           the part of every file that is within the timeframe (see offset_index.py)
+        """
         super(Directory, self).__init__()
         self.dirname = dirname
         self.regex_basename = regex_basename
         self.recursive = recursive
         self.timeout_in_seconds = timeout_in_seconds
         self.timeframe_only = timeframe_only
+        self.hardlink_rotated = hardlink_rotated
+        self.offset_index_dir = offset_index_dir
+        self.root = None
+        self.shared_files = None
+        self.collected_bytes = None
 
     def __repr__(self):
         try:
@@ -74,10 +94,14 @@ class Directory(Item):
             logger.debug("{!r} is not a file, skipping it".format(filepath))
             return False
         try:
-            last_modified_time = datetime.fromtimestamp(stat(filepath).st_mtime)
+            return cls.is_in_timeframe(stat(filepath).st_mtime, timestamp, delta)
         except IOError as error:
             logger.debug("stat on filepath {!r} failed: {}".format(filepath, error))
             return False
+
+    @classmethod
+    def is_in_timeframe(cls, mtime, timestamp, delta):
+        last_modified_time = datetime.fromtimestamp(mtime)
         return last_modified_time >= (timestamp-delta) and last_modified_time <= (timestamp+delta)
 
     @classmethod
@@ -102,39 +126,133 @@ class Directory(Item):
                 filenames if cls.was_this_file_modified_recently(dirpath, filename, timestamp, delta)]
 
     @classmethod
-    def collect_logfile(cls, src_directory, filename, dst_directory):
+    def collect_logfile(cls, src_directory, filename, dst_directory, hardlink_rotated=False, byte_range=None):
+        """ returns the number of bytes copied; with byte_range, only the bytes between (start, end) are copied """
         import logging
-        from shutil import copy2
+        from ..fastcopy import copy_file, is_rotated_log
+        from ..throttling import get_active_bucket
+        from ..redaction import get_active_redactor
+        from ..checkpoint import get_active_checkpoint
+        from ..offset_index import copy_byte_range
+        from ..util import CollectionCancelled
         logger = logging.getLogger(__name__)
         src = path.join(src_directory, filename)
         dst = path.join(dst_directory, filename)
+        redactor = get_active_redactor()
+        checkpoint = get_active_checkpoint()
+        if checkpoint is not None and checkpoint.is_file_done(src, dst):
+            logger.debug("Skipping {!r}, it was copied before the collection was resumed".format(src))
+            return stat(dst).st_size
         try:
-            copy2(src, dst)
+            if byte_range is not None:
+                copy_byte_range(src, dst, byte_range[0], byte_range[1], get_active_bucket(), redactor)
+                logger.debug("Copied bytes {}-{} of {!r}".format(byte_range[0], byte_range[1], src))
+            elif redactor is not None:
+                redactor.redact_file(src, dst, get_active_bucket())
+                logger.debug("Copied {!r} through {!r}".format(src, redactor))
+            else:
+                method = copy_file(src, dst, get_active_bucket(), hardlink_rotated and is_rotated_log(filename))
+                logger.debug("Copied {!r} using {}".format(src, method))
+            size = stat(dst).st_size
+            if checkpoint is not None:
+                checkpoint.file_done(src, size)
+            return size
+        except CollectionCancelled:
+            raise
         except:
             logger.exception("Failed to copy {!r}".format(src))
+            return 0
 
     @classmethod
     def filter_matching_filenames(cls, filenames, pattern):
-        return [filename for filename in filenames if match(pattern, filename)]
+        from ..util import check_cancelled
+        matching = []
+        for filename in filenames:
+            check_cancelled()
+            if match(pattern, filename):
+                matching.append(filename)
+        return matching
 
     @classmethod
-    def collect_process(cls, dirname, regex_basename, recursive, targetdir, timeframe_only, timestamp, delta):
+    def iter_matching_files(cls, dirname, regex_basename, recursive, timeframe_only, timestamp, delta,
+                            pruned_dirs=frozenset()):
+        """ yields (dirpath, filenames) of the files that should be collected, without copying anything.
+        The directories in pruned_dirs (dead mounts) are not entered. """
+        from os import walk
+        from ..scan_cache import get_active_scan_cache
+        scan_cache = get_active_scan_cache()
+        if scan_cache is not None:
+            for dirpath, dirnames, filenames, stats in scan_cache.walk(dirname, recursive, pruned_dirs):
+                filenames = cls.filter_matching_filenames(filenames, regex_basename)
+                if timeframe_only:
+                    filenames = [filename for filename in filenames if filename in stats and
+                                 cls.is_in_timeframe(stats[filename][1], timestamp, delta)]
+                yield dirpath, filenames
+            return
+        for dirpath, dirnames, filenames in walk(dirname):
+            if not recursive:
+                dirnames[:] = []
+            dirnames[:] = [name for name in dirnames if path.join(dirpath, name) not in pruned_dirs]
+            filenames = cls.filter_matching_filenames(filenames, regex_basename)
+            filenames = cls.filter_old_files(dirpath, filenames, timestamp, delta) if timeframe_only else filenames
+            yield dirpath, filenames
+
+    @classmethod
+    def collect_process(cls, dirname, regex_basename, recursive, targetdir, timeframe_only, timestamp, delta,
+                        hardlink_rotated=False, pruned_dirs=frozenset(),
+                        offset_index_dir=None, root=None, shared_files=None):
+        """ returns the number of bytes collected.
+        With a root (see roots.py), the files are laid out as seen from inside the root, and with shared_files, the
+        files that were already collected under another root are hardlinked instead of copied; symlinks that lead
+        out of the root are not followed. The files another item already collected (see planning.CollectedFiles)
+        are skipped. """
         import logging
         logger = logging.getLogger(__name__)
         logger.debug("Collection of {!r} in subprocess started".format(dirname))
-        from os import walk, makedirs
-        for dirpath, dirnames, filenames in walk(dirname):
-            if dirpath != dirname and not recursive:
-                continue
-            relative_dirpath = strip_os_prefix_from_path(dirpath)
+        if root is not None and not root.contains(dirname):
+            logger.warning("Skipping {!r}, it leads out of {!r}".format(dirname, root))
+            return 0
+        from os import makedirs
+        from ..offset_index import OffsetIndex, get_trimmed_range
+        from ..planning import get_active_collected_files
+        from ..util import check_cancelled
+        offset_index = OffsetIndex(offset_index_dir) if offset_index_dir and timeframe_only else None
+        collected_files = get_active_collected_files()
+        collected_bytes = 0
+        for dirpath, filenames in cls.iter_matching_files(dirname, regex_basename, recursive, timeframe_only,
+                                                          timestamp, delta, pruned_dirs):
+            relative_dirpath = strip_os_prefix_from_path(dirpath if root is None else root.get_relative_path(dirpath))
             dst_directory = path.join(targetdir, relative_dirpath)
             if not path.exists(dst_directory):
                 makedirs(dst_directory)
-            filenames = cls.filter_matching_filenames(filenames, regex_basename)
-            filenames = cls.filter_old_files(dirpath, filenames, timestamp, delta) if timeframe_only else filenames
+            if collected_files is not None:
+                duplicates = [filename for filename in filenames if path.join(dirpath, filename) in collected_files]
+                if duplicates:
+                    logger.debug("Skipping {!r}, they were collected by another item".format(duplicates))
+                filenames = [filename for filename in filenames if filename not in duplicates]
+            if root is not None:
+                escaping = [filename for filename in filenames if not root.contains(path.join(dirpath, filename))]
+                if escaping:
+                    logger.debug("Skipping {!r}, they lead out of {!r}".format(escaping, root))
+                filenames = [filename for filename in filenames if filename not in escaping]
             logger.debug("Collecting {!r}".format(filenames))
-            [cls.collect_logfile(dirpath, filename, dst_directory) for filename in filenames]
+            for filename in filenames:
+                check_cancelled()
+                src, dst = path.join(dirpath, filename), path.join(dst_directory, filename)
+                claimed = None if shared_files is None else shared_files.claim(src, dst)
+                if claimed is not None and shared_files.link(claimed, dst):
+                    logger.debug("Linked {!r} to the copy of the same file under another root".format(src))
+                    continue
+                try:
+                    collected_bytes += cls.collect_logfile(dirpath, filename, dst_directory, hardlink_rotated,
+                                                           get_trimmed_range(offset_index, src, timestamp, delta))
+                    if collected_files is not None and path.exists(dst):
+                        collected_files.add(src)
+                finally:
+                    if shared_files is not None:
+                        shared_files.done(dst)
         logger.debug("Collection of {!r} in subprocess ended successfully".format(dirname))
+        return collected_bytes
 
     def _is_my_kind_of_logging_handler(self, handler):
         from logging.handlers import MemoryHandler
@@ -142,14 +260,39 @@ class Directory(Item):
         return isinstance(handler, MemoryHandler) and isinstance(handler.target, FileHandler)
 
 
+    def get_pruned_dirs(self):
+        """ returns the dead mounts under the directory, or None if the directory itself is on a dead mount """
+        from ..mounts import get_active_mount_health
+        mount_health = get_active_mount_health()
+        if mount_health is None:
+            return frozenset()
+        dead = mount_health.get_dead_mounts(self.dirname, self.recursive)
+        if mount_health.get_mount(self.dirname) in dead:
+            problem = mount_health.get_problem(self.dirname, recursive=False)
+            logger.warning("Skipping {!r}, it is on a dead mount: {}".format(self, problem))
+            return None
+        for mountpoint, problem in dead.items():
+            logger.warning("Not collecting {!r} for {!r}: {}".format(mountpoint, self, problem))
+        return frozenset(dead)
+
+    def _get_root_dirnames(self):
+        return [] if self.root is None else [self.root.root_id]
+
     def collect(self, targetdir, timestamp, delta):
         from logging import root
         from infi.logs_collector.util import make_blocking
 
+        pruned_dirs = self.get_pruned_dirs()
+        if pruned_dirs is None:
+            self.collected_bytes = 0
+            return
         # We want to copy the files in a child process, so in case the filesystem is stuck, we won't get stuck too
         kwargs = dict(dirname=self.dirname, regex_basename=self.regex_basename,
-                      recursive=self.recursive, targetdir=path.join(targetdir, "files"),
-                      timeframe_only=self.timeframe_only, timestamp=timestamp, delta=delta)
+                      recursive=self.recursive, targetdir=path.join(targetdir, "files", *self._get_root_dirnames()),
+                      timeframe_only=self.timeframe_only, timestamp=timestamp, delta=delta,
+                      hardlink_rotated=self.hardlink_rotated,
+                      pruned_dirs=pruned_dirs, offset_index_dir=self.offset_index_dir, root=self.root,
+                      shared_files=self.shared_files)
         try:
             [logfile_path] = [handler.target.baseFilename for handler in root.handlers
             if self._is_my_kind_of_logging_handler(handler)] or [None]
@@ -157,7 +300,7 @@ class Directory(Item):
             logfile_path = None
 
         try:
-            make_blocking(self.collect_process, kwargs=kwargs, timeout=self.timeout_in_seconds)
+            self.collected_bytes = make_blocking(self.collect_process, kwargs=kwargs, timeout=self.timeout_in_seconds)
         except TimeoutError:
             msg = "Did not finish collecting {!r} within the {} seconds timeout_in_seconds"
             logger.error(msg.format(self, self.timeout_in_seconds))
@@ -171,8 +314,23 @@ class File(Directory):
         super(File, self).__init__(path.dirname(filepath), path.basename(filepath),
                                    recursive=False, timeframe_only=False)
 
+_resolved_executables = {}
+
 def find_executable(executable_name):
     """Helper function to find executables"""
+    from os import path, environ
+    from sys import argv
+    key = (path.basename(executable_name), environ.get('PATH'), path.dirname(argv[0]))
+    resolved = _resolved_executables.get(key)
+    if resolved is not None and path.exists(resolved):
+        return resolved
+    resolved = _find_executable(executable_name)
+    if path.isabs(resolved):
+        # only successful lookups are remembered, a missing executable may get installed later
+        _resolved_executables[key] = resolved
+    return resolved
+
+def _find_executable(executable_name):
     from os import path, name, environ, pathsep
     from sys import argv
     executable_name = path.basename(executable_name)
@@ -195,8 +353,39 @@ def find_executable(executable_name):
     return existing_executables[0]
 
 
+class CachedResult(object):
+    def __init__(self, cmd):
+        super(CachedResult, self).__init__()
+        self._pid = cmd.get_pid()
+        self._returncode = cmd.get_returncode()
+        self._stdout = cmd.get_stdout()
+        self._stderr = cmd.get_stderr()
+
+    def get_pid(self):
+        return self._pid
+
+    def get_returncode(self):
+        return self._returncode
+
+    def get_stdout(self):
+        return self._stdout
+
+    def get_stderr(self):
+        return self._stderr
+
+
+_static_outputs = None
+
+def enable_static_output_cache(enabled=True):
+    """ when enabled, the results of commands defined with static=True are kept in memory and reused by later
+    collections in the same process (this is what the collector daemon does) """
+    global _static_outputs
+    _static_outputs = {} if enabled else None
+
+
 class Command(Item):
-    def __init__(self, executable, commandline_arguments=[], wait_time_in_seconds=60, prefix=None, env=None):
+    def __init__(self, executable, commandline_arguments=[], wait_time_in_seconds=60, prefix=None, env=None,
+                 static=False, paths=(), all_mounts=False):
         """
         Define a command to run and collect its output.
         executable - name of the executable to run
@@ -204,6 +393,10 @@ class Command(Item):
         wait_time_in_seconds - maximum time to wait for the command to finish
         prefix - optional prefix for the name of the output files (default: the executable name)
         env - a optional mapping of environment variables to run the command with
+        static - the output of the command does not change while the host is up, so it may be cached
+        paths - the paths the command reads (recursively); it is skipped if any of them is on a dead mount
+        all_mounts - the command reads all the mounts (like df); if some are dead, the healthy mounts are appended to
+                     its arguments
         """
         super(Command, self).__init__()
         self.executable = executable
@@ -211,6 +404,9 @@ class Command(Item):
         self.wait_time_in_seconds = wait_time_in_seconds
         self.prefix = prefix
         self.env = env
+        self.static = static
+        self.paths = list(paths)
+        self.all_mounts = all_mounts
 
     def __repr__(self):
         try:
@@ -225,13 +421,18 @@ class Command(Item):
         except:
             return super(Command, self).__str__()
 
-    def _execute(self):
+    def _execute(self, commandline_arguments=None):
         from infi.execute import execute_async, CommandTimeout
         from os import path
+        from ..throttling import get_active_resource_limits
         executable = self.executable if path.exists(self.executable) else find_executable(self.executable)
-        logger.info("Going to run {} {}".format(executable, self.commandline_arguments))
+        if commandline_arguments is None:
+            commandline_arguments = self.commandline_arguments
+        resource_limits = get_active_resource_limits()
+        prefix = [] if resource_limits is None else resource_limits.get_command_prefix()
+        logger.info("Going to run {} {}".format(executable, commandline_arguments))
         try:
-            cmd = execute_async([executable] + self.commandline_arguments, env=self.env)
+            cmd = execute_async(prefix + [executable] + commandline_arguments, env=self.env)
         except OSError:
             logger.error("executable {} not found".format(executable))
             return FakeResult
@@ -253,25 +454,78 @@ class Command(Item):
     def _write_output(self, cmd, targetdir):
         from os.path import basename, join
         from ..util import get_timestamp
+        from ..redaction import get_active_redactor
         executable_name = basename(self.executable).split('.')[0]
         pid = cmd.get_pid()
         timestamp = get_timestamp()
         output_format = "{prefix}.{timestamp}.{pid}.txt"
         kwargs = dict(prefix=self.prefix or executable_name, pid=pid, timestamp=timestamp)
         output_filename = output_format.format(**kwargs)
+        output = self._format_output(cmd)
+        redactor = get_active_redactor()
+        if redactor is not None:
+            output = redactor.redact(output)
         with open(join(targetdir, output_filename), 'wb') as fd:
-            fd.write(b"\n===%s===:\n%s" % (b"command", (' '.join([executable_name] + self.commandline_arguments)).encode()))
-            for output_type in ['returncode', 'stdout', 'stderr']:
-                output_value = getattr(cmd, "get_{}".format(output_type))()
-                if not isinstance(output_value, bytes):
-                    output_value = str(output_value).encode()
-                fd.write(b"\n===%s===:\n%s" % (output_type.encode(), output_value))
+            fd.write(output)
+
+    def _format_output(self, cmd):
+        from os.path import basename
+        executable_name = basename(self.executable).split('.')[0]
+        output = [b"\n===%s===:\n%s" % (b"command", (' '.join([executable_name] + self.commandline_arguments)).encode())]
+        for output_type in ['returncode', 'stdout', 'stderr']:
+            output_value = getattr(cmd, "get_{}".format(output_type))()
+            if not isinstance(output_value, bytes):
+                output_value = str(output_value).encode()
+            output.append(b"\n===%s===:\n%s" % (output_type.encode(), output_value))
+        return b''.join(output)
+
+    def _get_cache_key(self):
+        env = tuple(sorted(self.env.items())) if self.env else None
+        return (self.executable, tuple(self.commandline_arguments), env)
+
+    def _execute_or_get_cached(self):
+        if not self.static or _static_outputs is None:
+            return self._execute()
+        key = self._get_cache_key()
+        if key not in _static_outputs:
+            cmd = self._execute()
+            if cmd is FakeResult or cmd.get_returncode() != 0:
+                return cmd
+            _static_outputs[key] = CachedResult(cmd)
+        logger.info("Using cached output of {} {}".format(self.executable, self.commandline_arguments))
+        return _static_outputs[key]
+
+    def _get_narrowed_arguments(self):
+        """ returns the arguments to run the command with, or None if it should be skipped """
+        from ..mounts import get_active_mount_health
+        mount_health = get_active_mount_health()
+        if mount_health is None:
+            return self.commandline_arguments
+        for filepath in self.paths:
+            problem = mount_health.get_problem(filepath)
+            if problem is not None:
+                logger.warning("Skipping {!r}, {} is on a dead mount: {}".format(self, filepath, problem))
+                return None
+        if self.all_mounts and mount_health.get_dead_mounts():
+            logger.warning("Running {!r} on the healthy mounts only, skipping {}".format(
+                           self, ', '.join(sorted(mount_health.get_dead_mounts()))))
+            return self.commandline_arguments + mount_health.get_healthy_mounts()
+        return self.commandline_arguments
 
     def collect(self, targetdir, timestamp, delta):
-        cmd = self._execute()
+        commandline_arguments = self._get_narrowed_arguments()
+        if commandline_arguments is None:
+            return
+        if commandline_arguments is not self.commandline_arguments:
+            cmd = self._execute(commandline_arguments)
+        else:
+            cmd = self._execute_or_get_cached()
         self._write_output(cmd, path.join(targetdir, "commands"))
 
 
+_sys_path_headers = {}
+
+
 class Script(Item):
 
     def __init__(self, script, wait_time_in_seconds=60, prefix=None, env=None):
@@ -294,16 +548,24 @@ class Script(Item):
     def __str__(self):
         return self.prefix
 
+    @classmethod
+    def _get_sys_path_header(cls):
+        # the header is the same for all the scripts, as long as sys.path does not change
+        import sys
+        key = tuple(sys.path)
+        if key not in _sys_path_headers:
+            _sys_path_headers.clear()
+            _sys_path_headers[key] = 'import sys\nsys.path[0:0] = [\n' + \
+                ''.join('\t%r,\n' % entry for entry in sys.path) + ']\n\n'
+        return _sys_path_headers[key]
+
     def _create_script_file(self):
         from tempfile import mkstemp
-        import os, sys
+        import os
         fd, path = mkstemp(suffix='.py')
         os.close(fd)
         with open(path, 'w') as f:
-            f.write('import sys\nsys.path[0:0] = [\n')
-            for entry in sys.path:
-                f.write('\t%r,\n' % entry)
-            f.write(']\n\n')
+            f.write(self._get_sys_path_header())
             f.write(self.script)
         return path
 
@@ -318,8 +580,11 @@ class Environment(Item):
     def collect(self, targetdir, timestamp, delta):
         from os import path, environ
         from json import dumps
+        from ..redaction import get_active_redactor
+        redactor = get_active_redactor()
+        variables = environ.copy() if redactor is None else redactor.mask_environment(environ)
         with open(path.join(targetdir, "environment.json"), 'w') as fd:
-            fd.write(dumps(environ.copy(), indent=True))
+            fd.write(dumps(variables, indent=True))
 
     def __repr__(self):
         return "<Environment>"
@@ -333,8 +598,11 @@ class Hostname(Item):
             from os import path
             from socket import gethostname
             from json import dumps
+            from ..redaction import get_active_redactor
+            redactor = get_active_redactor()
+            hostname = gethostname() if redactor is None else redactor.redact_text(gethostname())
             with open(path.join(targetdir, "hostname.json"), 'w') as fd:
-                fd.write(dumps(dict(hostname=gethostname()), indent=True))
+                fd.write(dumps(dict(hostname=hostname), indent=True))
 
     def __repr__(self):
         return "<Hostname>"
@@ -0,0 +1,148 @@
+from .. import Item, find_executable
+from os import path
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+EXPORT_TEXT_BATCH_SIZE = 1000
+JOURNALCTL_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class Journal(Item):
+    def __init__(self, units=(), journal_priority=None, output_format="export", timeout_in_seconds=300, directory=None,
+                 prefix="journal", executable="journalctl"):
+        """
+        Define the entries of the systemd journal to collect, within the timeframe only.
+        units - only collect the entries of these systemd units (default: all the units)
+        journal_priority - only collect the entries of this syslog priority or more important ones, e.g. 'warning'
+                           or 4 (the 'priority' attribute of items is their scheduling priority)
+        output_format - the journalctl output format; 'export' keeps all the fields and can be read back with
+                        'systemd-journal-remote', 'short-iso' is human readable
+        timeout_in_seconds - maximum time to wait for journalctl to finish
+        directory - read the journal files in this directory instead of the system journal
+        prefix - the name of the output file, under 'journal'
+        executable - name or path of journalctl
+        """
+        super(Journal, self).__init__()
+        self.units = list(units)
+        self.journal_priority = journal_priority
+        self.output_format = output_format
+        self.timeout_in_seconds = timeout_in_seconds
+        self.directory = directory
+        self.prefix = prefix
+        self.executable = executable
+
+    def __repr__(self):
+        msg = "<Journal(units={!r}, journal_priority={!r}, output_format={!r}, directory={!r})>"
+        return msg.format(self.units, self.journal_priority, self.output_format, self.directory)
+
+    def __str__(self):
+        return "journal entries" + (" of {}".format(', '.join(self.units)) if self.units else "")
+
+    def get_arguments(self, timestamp, delta):
+        arguments = ["--no-pager", "--output", self.output_format,
+                     "--since", (timestamp - delta).strftime(JOURNALCTL_DATE_FORMAT),
+                     "--until", timestamp.strftime(JOURNALCTL_DATE_FORMAT)]
+        for unit in self.units:
+            arguments += ["--unit", unit]
+        if self.journal_priority is not None:
+            arguments += ["--priority", str(self.journal_priority)]
+        if self.directory is not None:
+            arguments += ["--directory", self.directory]
+        return arguments
+
+    @classmethod
+    def _pump(cls, src_fd, dst_fd, redactor, bucket):
+        if redactor is not None:
+            redactor.redact_stream(src_fd, dst_fd, bucket)
+            return
+        for chunk in iter(lambda: src_fd.read(CHUNK_SIZE), b''):
+            bucket.consume(len(chunk))
+            dst_fd.write(chunk)
+
+    @classmethod
+    def _pump_export(cls, src_fd, dst_fd, redactor, bucket):
+        """ redacts the 'FIELD=value' lines of the export format only; a binary field (its name on a line, a 64-bit
+        little-endian length, the data and a newline) is copied as it is, so its length still matches its data """
+        from struct import unpack
+        from ...util import check_cancelled
+
+        def consume(data):
+            if bucket is not None:
+                bucket.consume(len(data))
+            return data
+
+        def flush():
+            # the text lines are redacted in batches, a line never holds more than one field
+            check_cancelled()
+            dst_fd.write(redactor.redact(b''.join(text)))
+            del text[:]
+        text = []
+        for line in iter(src_fd.readline, b''):
+            consume(line)
+            if b'=' in line or line == b'\n' or not line.endswith(b'\n'):
+                text.append(line)
+                if len(text) >= EXPORT_TEXT_BATCH_SIZE:
+                    flush()
+                continue
+            flush()
+            length = consume(src_fd.read(8))
+            dst_fd.write(line + length)
+            remaining = unpack('<Q', length)[0] + 1 if len(length) == 8 else 0
+            while remaining:
+                chunk = consume(src_fd.read(min(remaining, CHUNK_SIZE)))
+                if not chunk:
+                    break
+                dst_fd.write(chunk)
+                remaining -= len(chunk)
+        flush()
+
+    def collect(self, targetdir, timestamp, delta):
+        from subprocess import Popen, PIPE, TimeoutExpired
+        from threading import Thread
+        from os import makedirs, remove
+        from ...throttling import get_active_bucket, get_active_resource_limits
+        from ...redaction import get_active_redactor
+        executable = self.executable if path.exists(self.executable) else find_executable(self.executable)
+        if not path.isabs(executable):
+            logger.info("{} not found, this host does not use the systemd journal".format(self.executable))
+            return
+        basedir = path.join(targetdir, "journal")
+        if not path.exists(basedir):
+            makedirs(basedir)
+        arguments = [executable] + self.get_arguments(timestamp, delta)
+        redactor, bucket, resource_limits = get_active_redactor(), get_active_bucket(), get_active_resource_limits()
+        logger.info("Going to run {}".format(arguments))
+        if resource_limits is not None:
+            arguments = resource_limits.get_command_prefix() + arguments
+        stderr_path = path.join(basedir, "{}.stderr.txt".format(self.prefix))
+        with open(path.join(basedir, "{}.{}".format(self.prefix, self.output_format)), 'wb') as dst_fd:
+            with open(stderr_path, 'wb') as stderr_fd:
+                # the entries are streamed into the file; they only pass through us if they need to be redacted or
+                # throttled on the way
+                pump = None
+                if redactor is None and bucket is None:
+                    process = Popen(arguments, stdout=dst_fd, stderr=stderr_fd)
+                else:
+                    process = Popen(arguments, stdout=PIPE, stderr=stderr_fd)
+                    export = redactor is not None and self.output_format == "export"
+                    pump = Thread(target=self._pump_export if export else self._pump,
+                                  args=(process.stdout, dst_fd, redactor, bucket))
+                    pump.daemon = True
+                    pump.start()
+                try:
+                    returncode = process.wait(self.timeout_in_seconds)
+                except TimeoutExpired:
+                    logger.error("{} did not finish in {} seconds, killing it".format(self, self.timeout_in_seconds))
+                    process.kill()
+                    process.wait()
+                    raise
+                finally:
+                    if pump is not None:
+                        pump.join()
+                        process.stdout.close()
+        if not path.getsize(stderr_path):
+            remove(stderr_path)
+        if returncode != 0:
+            raise RuntimeError("{} returned {}".format(executable, returncode))
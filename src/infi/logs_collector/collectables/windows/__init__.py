@@ -1,25 +1,47 @@
 from .. import Item, Command, Directory, File
-from os import environ, path
+from os import path
 from sys import maxsize
 from logging import getLogger
-from ...util import get_logs_directory
 
 logger = getLogger(__name__)
 
 arch = 'x64' if maxsize > 2**32 else 'x86'
 
-LOGS_DIR = get_logs_directory()
-SYSTEMROOT = environ.get("SystemRoot", r"C:\Windows")
-PROGRAM_FILES = environ.get("ProgramFiles", r"C:\Program Files")
-WINDOWS_EVENTLOGS_PATH = path.join(SYSTEMROOT, 'System32', 'winevt', 'Logs')
-CMD_PATH = path.join(SYSTEMROOT, 'System32', 'cmd.exe')
-DISKPART_PATH = path.join(SYSTEMROOT, 'System32', 'diskpart.exe')
-REG_PATH = path.join(SYSTEMROOT, 'System32', 'reg.exe')
-MSINFO32_PATH = path.join(PROGRAM_FILES.replace(" (x86)", ""), 'Common files', 'Microsoft shared', 'MSinfo', 'msinfo32.exe')
-MSINFO32_PATH_2 = path.join(SYSTEMROOT, 'System32', 'msinfo32.exe')
-MSINFO32_REPORT_PATH = path.join(LOGS_DIR, "msinfo32.txt")
-MINIDUMP_PATH = path.join(SYSTEMROOT, 'Minidump')
-MEMORYDUMP_PATH = path.join(SYSTEMROOT, 'MEMORY.DMP')
+_paths = None
+
+
+def get_paths():
+    """ returns the path constants of this module (LOGS_DIR, SYSTEMROOT, ...). They depend on the environment, so they
+    are computed on first use rather than when the module is imported. """
+    global _paths
+    if _paths is not None:
+        return _paths
+    from os import environ
+    from ...util import get_logs_directory
+    paths = dict(LOGS_DIR=get_logs_directory(),
+                 SYSTEMROOT=environ.get("SystemRoot", r"C:\Windows"),
+                 PROGRAM_FILES=environ.get("ProgramFiles", r"C:\Program Files"))
+    system32 = path.join(paths["SYSTEMROOT"], 'System32')
+    paths.update(WINDOWS_EVENTLOGS_PATH=path.join(system32, 'winevt', 'Logs'),
+                 CMD_PATH=path.join(system32, 'cmd.exe'),
+                 DISKPART_PATH=path.join(system32, 'diskpart.exe'),
+                 REG_PATH=path.join(system32, 'reg.exe'),
+                 MSINFO32_PATH=path.join(paths["PROGRAM_FILES"].replace(" (x86)", ""), 'Common files',
+                                         'Microsoft shared', 'MSinfo', 'msinfo32.exe'),
+                 MSINFO32_PATH_2=path.join(system32, 'msinfo32.exe'),
+                 MSINFO32_REPORT_PATH=path.join(paths["LOGS_DIR"], "msinfo32.txt"),
+                 MINIDUMP_PATH=path.join(paths["SYSTEMROOT"], 'Minidump'),
+                 MEMORYDUMP_PATH=path.join(paths["SYSTEMROOT"], 'MEMORY.DMP'))
+    _paths = paths
+    return _paths
+
+
+def __getattr__(name):
+    try:
+        return get_paths()[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 
 class Windows_Event_Logs(Item):
     def __init__(self, timeout_in_seconds=120):
@@ -63,6 +85,7 @@ class Windows_Event_Logs(Item):
     def collect_process(cls, targetdir, timestamp, delta):
         import logging
         import infi.eventlog
+        from ...util import check_cancelled
         import json
         from os import makedirs, path
         logger = logging.getLogger(__name__)
@@ -72,6 +95,7 @@ class Windows_Event_Logs(Item):
             makedirs(basedir)
         eventlog = infi.eventlog.LocalEventLog()
         for channel in eventlog.get_available_channels():
+            check_cancelled()
             channel_formatted = channel.replace(path.sep, '_').replace('/', '_')
             filepath = path.join(basedir, "{}.json".format(channel_formatted))
             # Generating a new query every time on purpose, because each can take some time
@@ -101,12 +125,13 @@ class Windows_Event_Logs(Item):
             raise
 
 def get_all():
-    msinfo_path = MSINFO32_PATH_2 if path.exists(MSINFO32_PATH_2) else MSINFO32_PATH
+    paths = get_paths()
+    msinfo_path = paths["MSINFO32_PATH_2"] if path.exists(paths["MSINFO32_PATH_2"]) else paths["MSINFO32_PATH"]
     return [
             Command("reg", ["query", r"HKLM\SOFTWARE\Microsoft\Windows NT\CurrentVersion\HotFix", "/s"]),
-            Command("sc", ["query"]), Directory(WINDOWS_EVENTLOGS_PATH, timeframe_only=False),
-            Command(msinfo_path, ["/report", path.join(MSINFO32_REPORT_PATH)], wait_time_in_seconds=300),
-            File(MSINFO32_REPORT_PATH),
-            Directory(MINIDUMP_PATH),
+            Command("sc", ["query"]), Directory(paths["WINDOWS_EVENTLOGS_PATH"], timeframe_only=False),
+            Command(msinfo_path, ["/report", path.join(paths["MSINFO32_REPORT_PATH"])], wait_time_in_seconds=300),
+            File(paths["MSINFO32_REPORT_PATH"]),
+            Directory(paths["MINIDUMP_PATH"]),
             Windows_Event_Logs(),
             ]
@@ -0,0 +1,214 @@
+""" A resident collector that accepts collection requests over a unix domain socket.
+
+Triggering a collection from a monitoring alert by starting a new process pays for the interpreter startup, the
+imports and cold caches every time. The daemon stays up, keeps the executable lookups and the outputs of static
+commands in memory (and directory scans in a scan cache, if given one), and runs the requests it receives one after
+the other.
+
+The protocol is a single line of JSON per connection, answered by a single line of JSON:
+
+    {"items": "os_items", "timestamp": "now", "delta": "1h", "output_path": "/tmp", "prefix": "alert"}
+    {"result": 0, "archive_path": "/tmp/alert-logs.2026-10-19.10-00-xxxxxx.tar.gz"}
+
+'items' is the name of an item factory in infi.logs_collector.items, 'timestamp' and 'delta' are parsed with
+the helpers in infi.logs_collector.scripts. Identical requests that are waiting in the queue (or being collected)
+are collected once and share the result. A "now" request is resolved when its collection starts, so the "now"
+requests that wait in the queue together share the next collection, however far apart they arrived.
+"""
+from logging import getLogger
+import threading
+
+logger = getLogger(__name__)
+
+
+class CollectionRequest(object):
+    def __init__(self, items="os_items", timestamp="now", delta="1h", output_path=None, prefix="collection"):
+        super(CollectionRequest, self).__init__()
+        self.items = items
+        self.timestamp = timestamp
+        self.delta = delta
+        self.output_path = output_path
+        self.prefix = prefix
+
+    @classmethod
+    def from_dict(cls, request):
+        unknown = set(request) - set(["items", "timestamp", "delta", "output_path", "prefix"])
+        if unknown:
+            raise ValueError("Unknown request keys: {}".format(', '.join(sorted(unknown))))
+        return cls(**request)
+
+    def __repr__(self):
+        return "<CollectionRequest(items={!r}, timestamp={!r}, delta={!r}, output_path={!r}, prefix={!r})>".format(
+            self.items, self.timestamp, self.delta, self.output_path, self.prefix)
+
+    def get_items(self):
+        from .items import get_factory
+        return get_factory(self.items)()
+
+    def parse(self):
+        """ returns (timestamp, delta) as datetime objects; "now" is the time parse() is called """
+        from .scripts import parse_datestring, parse_deltastring
+        return parse_datestring(self.timestamp), parse_deltastring(self.delta)
+
+    def is_now(self):
+        return self.timestamp == "now"
+
+    def get_key(self):
+        """ returns the key of identical requests; "now" is kept as it is, it is only resolved by parse() """
+        timestamp, delta = self.parse()
+        return (self.items, "now" if self.is_now() else timestamp, delta, self.output_path, self.prefix)
+
+
+class CollectorDaemon(object):
+    def __init__(self, socket_path, creation_dir=None, parent_dir_name="logs", scan_cache_path=None):
+        super(CollectorDaemon, self).__init__()
+        from six.moves.queue import Queue
+        self.socket_path = socket_path
+        self.creation_dir = creation_dir
+        self.parent_dir_name = parent_dir_name
+        self.scan_cache_path = scan_cache_path
+        self._scan_cache = None
+        self._queue = Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._worker = None
+
+    def submit(self, request):
+        """ queues a request and returns a Future of (end_result, archive_path).
+        A request identical to one that is still queued or running shares its future; a "now" request only shares
+        the future of a queued one, the collections that already started are too early for it. """
+        from concurrent.futures import Future
+        key = request.get_key()
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                logger.info("Request {!r} is already queued, sharing its result".format(request))
+                return future
+            future = self._pending[key] = Future()
+        self._queue.put((key, request, future))
+        return future
+
+    def _collect(self, request, timestamp, delta):
+        from . import run
+        return run(request.prefix, request.get_items(), timestamp, delta, output_path=request.output_path,
+                   creation_dir=self.creation_dir, parent_dir_name=self.parent_dir_name, silent=True,
+                   scan_cache=self._scan_cache)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            key, request, future = task
+            if request.is_now():
+                self._forget(key, future)
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._collect(request, *request.parse()))
+                except BaseException as error:
+                    logger.exception("Collection of {!r} failed".format(request))
+                    future.set_exception(error)
+            self._forget(key, future)
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def start(self):
+        """ starts listening on the socket and the worker thread, without blocking """
+        from six.moves import socketserver
+        from os import path, remove
+        from .collectables import enable_static_output_cache
+        from .scan_cache import ScanCache
+        enable_static_output_cache()
+        if self.scan_cache_path is not None:
+            self._scan_cache = ScanCache(self.scan_cache_path)
+        if path.exists(self.socket_path):
+            remove(self.socket_path)
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon._handle_connection(self.rfile, self.wfile)
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self._server.daemon_threads = True
+        self._worker = threading.Thread(target=self._work, name="collector-daemon-worker")
+        self._worker.daemon = True
+        self._worker.start()
+        threading.Thread(target=self._server.serve_forever, name="collector-daemon-server").start()
+        logger.info("Collector daemon listening on {}".format(self.socket_path))
+
+    def _handle_connection(self, rfile, wfile):
+        from json import loads, dumps
+        try:
+            request = CollectionRequest.from_dict(loads(rfile.readline().decode()))
+            end_result, archive_path = self.submit(request).result()
+            response = dict(result=end_result, archive_path=archive_path)
+        except Exception as error:
+            logger.exception("Failed to handle request")
+            response = dict(error=str(error))
+        wfile.write((dumps(response) + '\n').encode())
+
+    def shutdown(self):
+        from os import path, remove
+        from .collectables import enable_static_output_cache
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+        if path.exists(self.socket_path):
+            remove(self.socket_path)
+        if self._scan_cache is not None:
+            self._scan_cache.close()
+            self._scan_cache = None
+        enable_static_output_cache(False)
+
+    def serve_forever(self):
+        from time import sleep
+        self.start()
+        try:
+            while True:
+                sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+
+def request_collection(socket_path, items="os_items", timestamp="now", delta="1h", output_path=None,
+                       prefix="collection", timeout=None):
+    """ sends a collection request to a running daemon and returns (end_result, archive_path) """
+    from socket import socket, AF_UNIX, SOCK_STREAM
+    from json import dumps, loads
+    request = dict(items=items, timestamp=timestamp, delta=delta, output_path=output_path, prefix=prefix)
+    sock = socket(AF_UNIX, SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((dumps(request) + '\n').encode())
+        response = loads(sock.makefile('rb').readline().decode())
+    finally:
+        sock.close()
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    return response['result'], response['archive_path']
+
+
+def main(argv=None):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="run the logs collector as a daemon listening on a unix socket")
+    parser.add_argument("socket_path")
+    parser.add_argument("--creation-dir", default=None)
+    parser.add_argument("--parent-dir-name", default="logs")
+    parser.add_argument("--scan-cache", default=None, help="path of a persistent directory scan cache")
+    args = parser.parse_args(argv)
+    CollectorDaemon(args.socket_path, args.creation_dir, args.parent_dir_name, args.scan_cache).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
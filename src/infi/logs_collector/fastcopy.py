@@ -0,0 +1,194 @@
+""" Copying files aside without moving their data through user space when the platform allows it.
+
+copy_file tries, in order: a reflink (FICLONE, which shares the extents on btrfs/xfs), copy_file_range, sendfile
+and finally a buffered copy. Each method continues from where the previous one stopped, so a method that is not
+supported for a pair of files (or stops short, like on procfs where files report a size of zero) just hands over
+to the next one. Immutable files may also be hardlinked when the destination is on the same filesystem.
+
+Sparse files (core dumps, VM images) are copied extent by extent using SEEK_DATA/SEEK_HOLE, so the holes are
+neither read nor written and the copy stays sparse.
+"""
+from logging import getLogger
+import errno
+import os
+from .util import check_cancelled
+
+logger = getLogger(__name__)
+
+FICLONE = 0x40049409
+CHUNK_SIZE = 1024 * 1024
+UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF,
+                      errno.EPERM)
+ROTATED_LOG_PATTERN = r'.*(\.\d+|[-.]\d{8}|\.gz|\.bz2|\.xz|\.zst)$'
+
+
+def is_rotated_log(filename):
+    from re import match
+    return match(ROTATED_LOG_PATTERN, filename) is not None
+
+
+def _try_hardlink(src, dst):
+    try:
+        os.link(src, dst)
+        return True
+    except OSError as error:
+        logger.debug("hardlinking {!r} failed: {}".format(src, error))
+        return False
+
+
+def _try_reflink(src_fd, dst_fd):
+    try:
+        from fcntl import ioctl
+    except ImportError:
+        return False
+    try:
+        ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except (IOError, OSError) as error:
+        if error.errno not in UNSUPPORTED_ERRNOS:
+            raise
+        return False
+
+
+def _copy_file_range(src_fd, dst_fd, size, bucket):
+    return _zero_copy_loop(lambda count: os.copy_file_range(src_fd, dst_fd, count), size, bucket)
+
+
+def _sendfile(src_fd, dst_fd, size, bucket):
+    return _zero_copy_loop(lambda count: os.sendfile(dst_fd, src_fd, None, count), size, bucket)
+
+
+def _zero_copy_loop(copy_chunk, size, bucket):
+    copied = 0
+    while copied < size:
+        check_cancelled()
+        count = min(CHUNK_SIZE, size - copied)
+        if bucket is not None:
+            bucket.consume(count)
+        try:
+            written = copy_chunk(count)
+        except OSError as error:
+            if copied or error.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            break
+        if written == 0:
+            break
+        copied += written
+    return copied
+
+
+def _buffered_copy(src_fd, dst_fd, bucket):
+    copied = 0
+    while True:
+        check_cancelled()
+        data = os.read(src_fd, CHUNK_SIZE)
+        if not data:
+            break
+        if bucket is not None:
+            bucket.consume(len(data))
+        while data:
+            written = os.write(dst_fd, data)
+            data = data[written:]
+            copied += written
+    return copied
+
+
+def is_sparse(stat_result):
+    return getattr(stat_result, 'st_blocks', None) is not None and stat_result.st_blocks * 512 < stat_result.st_size
+
+
+def get_data_extents(fd, size):
+    """ returns a list of (offset, length) of the data (non-hole) regions of fd, or None if the platform or the
+    filesystem cannot tell """
+    if not hasattr(os, 'SEEK_DATA'):
+        return None
+    extents = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                data = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as error:
+                if error.errno == errno.ENXIO:  # no more data until the end of the file
+                    break
+                raise
+            hole = min(os.lseek(fd, data, os.SEEK_HOLE), size)
+            extents.append((data, hole - data))
+            offset = hole
+    except OSError as error:
+        logger.debug("SEEK_DATA/SEEK_HOLE are not supported: {}".format(error))
+        return None
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+    return extents
+
+
+def _copy_extents(src_fd, dst_fd, extents, size, bucket):
+    for offset, length in extents:
+        copied = 0
+        while copied < length:
+            check_cancelled()
+            count = min(CHUNK_SIZE, length - copied)
+            if bucket is not None:
+                bucket.consume(count)
+            data = os.pread(src_fd, count, offset + copied)
+            if not data:
+                break
+            os.pwrite(dst_fd, data, offset + copied)
+            copied += len(data)
+    os.ftruncate(dst_fd, size)
+
+
+def open_regular_file(src):
+    """ opens src for reading and returns its descriptor; raises shutil.SpecialFileError if src is not a regular file.
+    It is opened without blocking, since opening a FIFO for reading blocks until a writer shows up. """
+    from shutil import SpecialFileError
+    from stat import S_ISREG
+    fd = os.open(src, os.O_RDONLY | getattr(os, 'O_BINARY', 0) | getattr(os, 'O_NONBLOCK', 0))
+    try:
+        if not S_ISREG(os.fstat(fd).st_mode):
+            raise SpecialFileError("{!r} is not a regular file".format(src))
+    except:
+        os.close(fd)
+        raise
+    return fd
+
+
+def copy_file(src, dst, bucket=None, hardlink=False):
+    """ copies src to dst with its permission bits and times, returns the name of the method that was used.
+    bucket is an optional throttling.TokenBucket, hardlink allows hardlinking src when it is on the same filesystem.
+    Raises shutil.SpecialFileError if src is not a regular file (a FIFO, a device or a socket). """
+    from shutil import copystat
+    methods = []
+    binary = getattr(os, 'O_BINARY', 0)
+    src_fd = open_regular_file(src)
+    if hardlink and _try_hardlink(src, dst):
+        os.close(src_fd)
+        return "hardlink"
+    try:
+        stat_result = os.fstat(src_fd)
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | binary, 0o600)
+        try:
+            size = stat_result.st_size
+            extents = get_data_extents(src_fd, size) if size and is_sparse(stat_result) else None
+            if size and _try_reflink(src_fd, dst_fd):
+                methods.append("reflink")
+            elif extents is not None:
+                _copy_extents(src_fd, dst_fd, extents, size, bucket)
+                methods.append("sparse")
+            else:
+                copied = 0
+                for name, method in (("copy_file_range", _copy_file_range), ("sendfile", _sendfile)):
+                    if copied < size and hasattr(os, name):
+                        done = method(src_fd, dst_fd, size - copied, bucket)
+                        if done:
+                            methods.append(name)
+                        copied += done
+                if _buffered_copy(src_fd, dst_fd, bucket) or not methods:
+                    methods.append("buffered")
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    copystat(src, dst)
+    return '+'.join(methods)
@@ -0,0 +1,234 @@
+""" Collecting several incident windows in one pass.
+
+run_windows() collects the items for a list of (timestamp, delta) windows at once. Every Directory is walked and its
+files are copied aside once; each file is classified against all the windows and hardlinked into the tree of every
+window it falls in. Commands, scripts, the environment and the hostname do not depend on the timeframe, so they run
+once and their outputs are linked into every window. Other items (samples, event logs) are collected per window.
+
+The result is either one archive per window, or a single archive with a subtree per window in which the members
+shared between windows are stored once, as hard links.
+"""
+from logging import getLogger
+from os import path
+from .collectables import Item
+
+logger = getLogger(__name__)
+
+
+def _is_shared(item):
+    from .collectables import Command, Script, Environment, Hostname
+    return isinstance(item, (Command, Script, Environment, Hostname))
+
+
+def _make_target_dir(specific_dir):
+    from os import makedirs
+    for dirname in ["commands", "files", "collection-logs"]:
+        makedirs(path.join(specific_dir, dirname))
+
+
+def _link(src, dst):
+    from os import link, makedirs
+    from shutil import copy2
+    if path.exists(dst):
+        # already linked by another item that collects the same file
+        return
+    if not path.exists(path.dirname(dst)):
+        makedirs(path.dirname(dst))
+    try:
+        link(src, dst)
+    except OSError:
+        logger.debug("Failed to link {!r}, copying it instead".format(src))
+        copy2(src, dst)
+
+
+def _link_tree(srcdir, dstdir):
+    from os import walk
+    for dirpath, dirnames, filenames in walk(srcdir):
+        for filename in filenames:
+            src = path.join(dirpath, filename)
+            _link(src, path.join(dstdir, path.relpath(src, srcdir)))
+
+
+class Window(object):
+    def __init__(self, timestamp, delta, collect_dir, specific_dir):
+        super(Window, self).__init__()
+        self.timestamp = timestamp
+        self.delta = delta
+        self.collect_dir = collect_dir
+        self.specific_dir = specific_dir
+        self.end_result = True
+
+    def __repr__(self):
+        return "<Window(timestamp={!r}, delta={!r})>".format(self.timestamp, self.delta)
+
+    def contains(self, mtime):
+        from .collectables import Directory
+        return Directory.is_in_timeframe(mtime, self.timestamp, self.delta)
+
+
+class DirectoryForWindows(Item):
+    """ collects a Directory item for several windows: the files are copied to staging_dir once, and linked into
+    the 'files' directory of every window they fall in """
+    def __init__(self, item, windows, staging_dir):
+        super(DirectoryForWindows, self).__init__()
+        self.item = item
+        self.windows = windows
+        self.staging_dir = staging_dir
+
+    def __repr__(self):
+        return repr(self.item)
+
+    def __str__(self):
+        return str(self.item)
+
+    def _get_windows(self, filepath):
+        from os import lstat
+        from stat import S_ISREG
+        if not self.item.timeframe_only:
+            return self.windows
+        try:
+            stat_result = lstat(filepath)
+        except OSError as error:
+            logger.debug("stat on filepath {!r} failed: {}".format(filepath, error))
+            return []
+        if not S_ISREG(stat_result.st_mode):
+            return []
+        return [window for window in self.windows if window.contains(stat_result.st_mtime)]
+
+    @classmethod
+    def _get_span(cls, windows):
+        """ returns the (timestamp, delta) of the timeframe that spans all of windows """
+        since = min(window.timestamp - window.delta for window in windows)
+        until = max(window.timestamp + window.delta for window in windows)
+        return since + (until - since) / 2, (until - since) / 2
+
+    def collect_process(self, pruned_dirs=frozenset()):
+        """ returns the number of bytes copied; with an offset index, only the part of a file that spans the
+        windows it falls in is copied """
+        from os import makedirs
+        from .collectables import strip_os_prefix_from_path
+        from .offset_index import OffsetIndex, get_trimmed_range
+        from .util import check_cancelled
+        item = self.item
+        offset_index = OffsetIndex(item.offset_index_dir) if item.offset_index_dir and item.timeframe_only else None
+        collected_bytes = 0
+        # the timeframe filter is applied here, against all the windows at once
+        for dirpath, filenames in item.iter_matching_files(item.dirname, item.regex_basename, item.recursive,
+                                                           False, None, None, pruned_dirs):
+            relative_dirpath = strip_os_prefix_from_path(dirpath)
+            staging_directory = path.join(self.staging_dir, relative_dirpath)
+            for filename in filenames:
+                check_cancelled()
+                filepath = path.join(dirpath, filename)
+                windows = self._get_windows(filepath)
+                if not windows:
+                    continue
+                if not path.exists(staging_directory):
+                    makedirs(staging_directory)
+                byte_range = None if offset_index is None else \
+                    get_trimmed_range(offset_index, filepath, *self._get_span(windows))
+                collected_bytes += item.collect_logfile(dirpath, filename, staging_directory, item.hardlink_rotated,
+                                                        byte_range)
+                staged = path.join(staging_directory, filename)
+                if not path.exists(staged):
+                    continue
+                for window in windows:
+                    _link(staged, path.join(window.specific_dir, "files", relative_dirpath, filename))
+        return collected_bytes
+
+    def collect(self, targetdir, timestamp, delta):
+        from .util import make_blocking
+        pruned_dirs = self.item.get_pruned_dirs()
+        if pruned_dirs is None:
+            self.item.collected_bytes = 0
+            return
+        self.item.collected_bytes = make_blocking(self.collect_process, kwargs=dict(pruned_dirs=pruned_dirs),
+                                                  timeout=self.item.timeout_in_seconds)
+
+
+def _create_windows(tempdir, parent_dir_name, windows, single_archive):
+    from .util import STRFTIME_SHORT, get_host_dirname
+    result = []
+    names = set()
+    for index, (timestamp, delta) in enumerate(windows):
+        collect_dir = path.join(tempdir, "archive" if single_archive else "window-{}".format(index), parent_dir_name)
+        name = timestamp.strftime(STRFTIME_SHORT)
+        if name in names:
+            name = "{}.{}".format(name, index)
+        names.add(name)
+        window = Window(timestamp, delta, collect_dir, path.join(collect_dir, get_host_dirname(), name))
+        _make_target_dir(window.specific_dir)
+        result.append(window)
+    return result
+
+
+def _collect_items(prefix, items, windows, shared_dir, staging_dir, silent, interactive):
+    from logging import root, DEBUG
+    from . import collect, create_logging_handler_for_collection
+    from .collectables import Directory
+    first = windows[0]
+    with create_logging_handler_for_collection(shared_dir, prefix) as handler:
+        root.addHandler(handler)
+        root.setLevel(DEBUG)
+        try:
+            logger.info("Starting log collection of {} windows: {!r}".format(len(windows), windows))
+            for item in items:
+                if isinstance(item, Directory):
+                    result = collect(DirectoryForWindows(item, windows, staging_dir), shared_dir,
+                                     first.timestamp, first.delta, silent, interactive)
+                    for window in windows:
+                        window.end_result = window.end_result and result
+                elif _is_shared(item):
+                    result = collect(item, shared_dir, first.timestamp, first.delta, silent, interactive)
+                    for window in windows:
+                        window.end_result = window.end_result and result
+                else:
+                    for window in windows:
+                        result = collect(item, window.specific_dir, window.timestamp, window.delta, silent,
+                                         interactive)
+                        window.end_result = window.end_result and result
+        finally:
+            root.removeHandler(handler)
+            handler.flush()
+
+
+def run_windows(prefix, items, windows, output_path=None, creation_dir=None, parent_dir_name="logs", silent=False,
+                interactive=False, single_archive=False, samples_dir=None, resource_limits=None, redactor=None,
+                scan_cache=None, mount_health=None):
+    """ collects items for a list of (timestamp, delta) windows in one pass.
+    Returns a list of (end_result, archive_path), one per window, or a single one if single_archive is True.
+    output_path must be a directory (or None) when more than one archive is created.
+    The other arguments are the same as those of run(). """
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from . import get_tar_path, write_archive, collection_environment
+    if not windows:
+        raise ValueError("No windows to collect")
+    if not single_archive and len(windows) > 1 and output_path is not None and not path.isdir(output_path):
+        raise ValueError("Output path must be a directory when collecting several windows: {}".format(output_path))
+
+    def onerror(function, path, exc_info):
+        logger.debug("Failed to delete {!r}".format(path))
+
+    tempdir = mkdtemp(dir=creation_dir)
+    try:
+        shared_dir, staging_dir = path.join(tempdir, "shared"), path.join(tempdir, "staging")
+        _make_target_dir(shared_dir)
+        with collection_environment(items, silent, samples_dir, resource_limits, redactor, scan_cache,
+                                    mount_health) as (items, bucket):
+            # the directories of the windows are named after the host, which the redactor may redact
+            windows = _create_windows(tempdir, parent_dir_name, windows, single_archive)
+            _collect_items(prefix, items, windows, shared_dir, staging_dir, silent, interactive)
+            for window in windows:
+                _link_tree(shared_dir, window.specific_dir)
+            archives = [windows] if single_archive else [[window] for window in windows]
+            results = []
+            # the archives are written within the collection environment, so the bucket throttles them too
+            for archive_windows in archives:
+                archive_path = get_tar_path(prefix, output_path, archive_windows[0].timestamp, creation_dir)
+                write_archive(archive_path, archive_windows[0].collect_dir)
+                print("Logs collected successfully to {}".format(archive_path))
+                results.append((0 if all(window.end_result for window in archive_windows) else 1, archive_path))
+        return results
+    finally:
+        rmtree(tempdir, onerror=onerror)
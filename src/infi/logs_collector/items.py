@@ -4,25 +4,32 @@ def get_generic_os_items():
     from .collectables import Hostname, Environment
     return [Environment(), Hostname()]
 
-def linux():
+def linux(roots=None):
+    """ roots - optional roots.Root instances or paths of containers or chroots to collect the directories under """
     from .collectables import Directory, Command
-    return [ Command("uname", ["-a"]),
-             Command("df", ["-h"]),
+    from .collectables.linux import Journal
+    items = [ Command("uname", ["-a"], static=True),
+             Command("df", ["-h"], all_mounts=True),
              Command("mount"),
              Command("uptime"),
-             Command("lspci"),
+             Command("lspci", static=True),
              Command("lsmod"),
              Command("dmesg"),
-             Command("dmidecode"),
+             Command("dmidecode", static=True),
              Command("free", ["-m"]),
              Command("ifconfig", ["-a"]),
-             Command("ls", ["-laR", "/dev"]),
+             Command("ls", ["-laR", "/dev"], paths=["/dev"]),
              Command("ps", ["-ef"]),
              Command("ps", ["-eo", "pid,args,lstart,rsz"], prefix="ls_user_defined"),
-             Command("find", ["/var/crash", "-type", "f"], prefix='list_of_crash_files'),
+             Command("find", ["/var/crash", "-type", "f"], prefix='list_of_crash_files', paths=["/var/crash"]),
              Directory("/etc/", "issue|.*release", timeframe_only=False),
-             Directory("/var/log", "syslog.*|messages.*|boot.*")
+             Directory("/var/log", "syslog.*|messages.*|boot.*"),
+             Journal(),
              ] + get_generic_os_items()
+    if roots is None:
+        return items
+    from .roots import apply_to_roots
+    return apply_to_roots(items, roots)
 
 def windows():
     from .collectables.windows import get_all
@@ -32,3 +39,28 @@ def os_items():
     platform_name = get_platform_name()
     platform_func = globals().get(platform_name, list)
     return platform_func()
+
+FACTORY_NAMES = ("os_items", "linux", "windows", "get_generic_os_items")
+
+# the registry maps factory names to 'module:attribute' strings, which are only imported when the factory is used
+_registry = dict((name, "{}:{}".format(__name__, name)) for name in FACTORY_NAMES)
+_resolved_factories = {}
+
+def register_factory(name, target):
+    """ registers an item factory by the 'module:attribute' string of a function that returns a list of items """
+    if ':' not in target:
+        raise ValueError("Item factory target must be 'module:attribute': {!r}".format(target))
+    _registry[name] = target
+    _resolved_factories.pop(name, None)
+
+def get_factory_names():
+    return tuple(sorted(_registry))
+
+def get_factory(name):
+    if name not in _registry:
+        raise ValueError("Unknown item factory: {!r}".format(name))
+    if name not in _resolved_factories:
+        from importlib import import_module
+        module_name, attribute = _registry[name].split(':', 1)
+        _resolved_factories[name] = getattr(import_module(module_name), attribute)
+    return _resolved_factories[name]
@@ -0,0 +1,69 @@
+""" Metrics of a single collection, written as 'collection-logs/metrics.json' into the archive.
+
+When run() is given a metrics history path, the metrics are also appended to it as a line of JSON, so later runs
+can estimate how long items take (see the planning submodule).
+"""
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+METRICS_FILENAME = "metrics.json"
+HISTORY_LIMIT = 20
+
+
+class Metrics(object):
+    def __init__(self):
+        super(Metrics, self).__init__()
+        self.items = []
+        self.throttling = None
+        self.schedule = None
+
+    def add_item(self, item, seconds, result):
+        entry = dict(item=repr(item), seconds=round(seconds, 3), result=result)
+        if getattr(item, "collected_bytes", None) is not None:
+            entry.update(collected_bytes=item.collected_bytes)
+        self.items.append(entry)
+
+    def set_throttling(self, bucket):
+        self.throttling = None if bucket is None else bucket.get_stats()
+
+    def set_schedule(self, scheduler):
+        self.schedule = scheduler.to_dict() if scheduler.deadline_seconds is not None else None
+
+    def to_dict(self):
+        return dict(items=self.items, throttling=self.throttling, schedule=self.schedule)
+
+    def write(self, dirpath):
+        from os import path
+        from json import dumps
+        from .redaction import get_active_redactor
+        redactor = get_active_redactor()
+        text = dumps(self.to_dict(), indent=True)
+        with open(path.join(dirpath, METRICS_FILENAME), 'w') as fd:
+            fd.write(text if redactor is None else redactor.redact_text(text))
+
+    def append_to_history(self, history_path):
+        from json import dumps
+        from time import time
+        try:
+            with open(history_path, 'a') as fd:
+                fd.write(dumps(dict(self.to_dict(), time=time())) + '\n')
+        except (IOError, OSError):
+            logger.exception("Failed to write metrics history to {!r}".format(history_path))
+
+
+def load_history(history_path, limit=HISTORY_LIMIT):
+    """ returns the metrics of the last runs, oldest first """
+    from json import loads
+    from os import path
+    if history_path is None or not path.exists(history_path):
+        return []
+    with open(history_path) as fd:
+        lines = fd.readlines()[-limit:]
+    entries = []
+    for line in lines:
+        try:
+            entries.append(loads(line))
+        except ValueError:
+            logger.debug("Skipping a corrupted line in {!r}".format(history_path))
+    return entries
@@ -0,0 +1,152 @@
+""" Probing the health of mounts before items touch them.
+
+A Directory or a Command under a hung NFS, CIFS or iSCSI mount blocks until its timeout. With a MountHealth, the
+mounts under the paths of every item are probed first. Each probe is a statvfs in a daemon thread, and up to
+max_probes of the mounts an item needs are probed in parallel. A mount that does not answer within timeout_seconds
+(counted from the moment its statvfs was called, not from the moment it was queued) is dead for the rest of the run,
+and the result of every probe is cached for the run. A thread stuck in the kernel cannot be killed; it is left
+behind and does not count against max_probes.
+
+Items under a dead mount are skipped. Recursive Directory items do not descend into dead mounts below them, and a
+Command defined with all_mounts=True (df) is narrowed to the healthy mounts. The reason is logged in every case.
+"""
+from logging import getLogger
+from contextlib import contextmanager
+from os import path
+
+logger = getLogger(__name__)
+
+MOUNTS_PATH = "/proc/self/mounts"
+DEFAULT_TIMEOUT_SECONDS = 2
+DEFAULT_MAX_PROBES = 8
+
+_active_mount_health = None
+
+
+def _unescape(field):
+    # /proc/self/mounts escapes spaces, tabs, newlines and backslashes as octal
+    from re import sub
+    return sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), field)
+
+
+def get_mounts(mounts_path=MOUNTS_PATH):
+    """ returns the mount points of this host (on Linux) """
+    if not path.exists(mounts_path):
+        return []
+    with open(mounts_path) as fd:
+        return [_unescape(line.split()[1]) for line in fd if len(line.split()) > 1]
+
+
+def _is_under(filepath, mountpoint):
+    return filepath == mountpoint or filepath.startswith(mountpoint.rstrip('/') + '/')
+
+
+class _Probe(object):
+    def __init__(self, mountpoint):
+        super(_Probe, self).__init__()
+        from threading import Thread, Event
+        self.mountpoint = mountpoint
+        self.started = None
+        self.error = None
+        self.done = Event()
+        self.thread = Thread(target=self._run, name="probe {}".format(mountpoint))
+        self.thread.daemon = True
+
+    def _run(self):
+        from os import statvfs
+        from time import time
+        self.started = time()
+        try:
+            statvfs(self.mountpoint)
+        except OSError as error:
+            self.error = error
+        finally:
+            self.done.set()
+
+
+class MountHealth(object):
+    def __init__(self, timeout_seconds=DEFAULT_TIMEOUT_SECONDS, mounts=None, max_probes=DEFAULT_MAX_PROBES):
+        """
+        timeout_seconds - a mount that does not answer statvfs within this time is dead
+        mounts - the mount points to consider (default: the mounts of this host)
+        max_probes - the number of mounts probed at the same time
+        """
+        super(MountHealth, self).__init__()
+        self.timeout_seconds = timeout_seconds
+        self.mounts = sorted(set(get_mounts() if mounts is None else mounts))
+        self.max_probes = max_probes
+        self._problems = {}
+
+    def __repr__(self):
+        return "<MountHealth({} mounts)>".format(len(self.mounts))
+
+    def _probe(self, mountpoints):
+        from time import time
+        queued, running = list(mountpoints), []
+        while queued or running:
+            while queued and len(running) < self.max_probes:
+                probe = _Probe(queued.pop(0))
+                probe.thread.start()
+                running.append(probe)
+            running[0].done.wait(0.005)
+            for probe in list(running):
+                if probe.done.is_set():
+                    self._problems[probe.mountpoint] = None if probe.error is None else \
+                        "statvfs failed: {}".format(probe.error)
+                elif probe.started is not None and time() - probe.started > self.timeout_seconds:
+                    # the probe is stuck in the kernel; its thread is left behind
+                    self._problems[probe.mountpoint] = "statvfs did not return within {} seconds".format(
+                                                       self.timeout_seconds)
+                else:
+                    continue
+                running.remove(probe)
+        for mountpoint in mountpoints:
+            if self._problems[mountpoint] is not None:
+                logger.warning("Mount {!r} is dead: {}".format(mountpoint, self._problems[mountpoint]))
+
+    def get_mount(self, filepath):
+        """ returns the mount point filepath is on, without touching filepath """
+        filepath = path.abspath(filepath)
+        candidates = [mountpoint for mountpoint in self.mounts if _is_under(filepath, mountpoint)]
+        return max(candidates, key=len) if candidates else None
+
+    def get_dead_mounts(self, filepath=None, recursive=True):
+        """ returns {mount point: problem} of the dead mounts filepath is on (and under it, if recursive).
+        Without filepath, all the mounts are checked. """
+        if filepath is None:
+            mountpoints = list(self.mounts)
+        else:
+            filepath = path.abspath(filepath)
+            mountpoints = [self.get_mount(filepath)] if self.get_mount(filepath) else []
+            if recursive:
+                mountpoints += [mountpoint for mountpoint in self.mounts
+                                if mountpoint != filepath and _is_under(mountpoint, filepath)]
+        self._probe([mountpoint for mountpoint in mountpoints if mountpoint not in self._problems])
+        return dict((mountpoint, self._problems[mountpoint]) for mountpoint in mountpoints
+                    if self._problems[mountpoint] is not None)
+
+    def get_problem(self, filepath, recursive=True):
+        """ returns why filepath should not be touched, or None if all the mounts it needs are healthy """
+        dead = self.get_dead_mounts(filepath, recursive)
+        if not dead:
+            return None
+        return "; ".join("{} ({})".format(mountpoint, problem) for mountpoint, problem in sorted(dead.items()))
+
+    def get_healthy_mounts(self):
+        dead = self.get_dead_mounts()
+        return [mountpoint for mountpoint in self.mounts if mountpoint not in dead]
+
+
+def get_active_mount_health():
+    return _active_mount_health
+
+
+@contextmanager
+def mount_probing(mount_health):
+    """ makes the items collected within the context check the mounts they need with mount_health """
+    global _active_mount_health
+    previous, _active_mount_health = _active_mount_health, mount_health
+    try:
+        yield mount_health
+    finally:
+        _active_mount_health = previous
@@ -0,0 +1,231 @@
+""" Sparse timestamp to offset indexes of large text logs.
+
+Huge append-only logs that are collected with narrow timeframes again and again do not need to be copied whole,
+or even searched whole. An OffsetIndex keeps a sidecar file per log in a cache directory, with the path of the log
+on its first line, and then the device, inode and indexed size of the log and a sample of (offset, time) pairs, one
+every interval_bytes. A sample is the offset of the first line after the interval boundary that starts with a time
+(ISO-8601 or syslog).
+
+When the log grew since it was indexed, only the new part is sampled. When it was rotated (its inode changed or
+it shrank), the sidecar is dropped and the log is indexed again. The byte range of a timeframe is then found with
+a bisection of the samples, assuming the times in the log are increasing, and only that range is copied.
+
+Rotated logs are renamed and eventually deleted, so the cache directories are pruned once after every collection
+(see prune_offset_indexes): the sidecars that were not used for max_age_seconds and the least recently used ones
+beyond max_sidecars are removed by their modification times alone, and then the remaining sidecars of logs that no
+longer exist, reading only their first lines.
+"""
+from logging import getLogger
+from os import path
+import os
+
+logger = getLogger(__name__)
+
+DEFAULT_INTERVAL_BYTES = 64 * 1024
+DEFAULT_MAX_SIDECARS = 1000
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+PROBE_BYTES = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+COMPRESSED_LOG_PATTERN = r'.*\.(gz|bz2|xz|zst)$'
+
+
+class OffsetIndex(object):
+    def __init__(self, cache_dir, interval_bytes=DEFAULT_INTERVAL_BYTES, max_sidecars=DEFAULT_MAX_SIDECARS,
+                 max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        """
+        cache_dir - the directory the sidecar files are kept in
+        interval_bytes - the distance between two samples; smaller intervals give tighter ranges and bigger sidecars
+        max_sidecars, max_age_seconds - the number of sidecars kept by prune(), and how long an unused one is kept
+        """
+        super(OffsetIndex, self).__init__()
+        self.cache_dir = cache_dir
+        self.interval_bytes = interval_bytes
+        self.max_sidecars = max_sidecars
+        self.max_age_seconds = max_age_seconds
+
+    def __repr__(self):
+        return "<OffsetIndex({!r})>".format(self.cache_dir)
+
+    def get_sidecar_path(self, filepath):
+        from hashlib import sha1
+        return path.join(self.cache_dir, sha1(path.realpath(filepath).encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self, filepath):
+        import json
+        try:
+            with open(self.get_sidecar_path(filepath)) as fd:
+                fd.readline()
+                return json.load(fd)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _save(self, filepath, entry):
+        import json
+        if not path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        sidecar_path = self.get_sidecar_path(filepath)
+        temporary_path = "{}.{}.tmp".format(sidecar_path, os.getpid())
+        with open(temporary_path, 'w') as fd:
+            # the path is kept on a line of its own, so prune() does not need to load the whole sidecar
+            fd.write(json.dumps(path.realpath(filepath)) + "\n")
+            json.dump(entry, fd)
+        os.rename(temporary_path, sidecar_path)
+
+    def _sample(self, fd, offset, size, year):
+        """ returns (offset, time) of the first line with a time at or after offset, or None """
+        from .util import parse_line_time
+        start = max(offset - 1, 0)
+        fd.seek(start)
+        data = fd.read(min(PROBE_BYTES, size - start))
+        # a line that starts at the boundary is preceded by a newline, except for the first line of the file
+        position = 0 if offset == 0 else data.find(b'\n') + 1
+        if offset and not position:
+            return None
+        while True:
+            end = data.find(b'\n', position)
+            if end < 0:
+                return None
+            line_time = parse_line_time(data[position:end], year)
+            if line_time is not None:
+                return start + position, line_time
+            position = end + 1
+
+    def update(self, filepath):
+        """ indexes the part of filepath that was not indexed yet, returns the samples as a list of (offset, time) """
+        from time import localtime
+        stat_result = os.stat(filepath)
+        entry = self._load(filepath)
+        identity = [stat_result.st_dev, stat_result.st_ino]
+        if entry is None or entry["identity"] != identity or stat_result.st_size < entry["size"]:
+            if entry is not None:
+                logger.debug("{!r} was rotated, indexing it again".format(filepath))
+            entry = dict(identity=identity, size=0, next_offset=0, samples=[])
+        if stat_result.st_size == entry["size"]:
+            os.utime(self.get_sidecar_path(filepath), None)  # the modification time of a sidecar is its last use
+            return [tuple(sample) for sample in entry["samples"]]
+        year = localtime(stat_result.st_mtime).tm_year
+        offset = entry["next_offset"]
+        with open(filepath, 'rb') as fd:
+            while offset < stat_result.st_size:
+                sample = self._sample(fd, offset, stat_result.st_size, year)
+                if sample is None:
+                    if stat_result.st_size - offset <= PROBE_BYTES:
+                        break  # the last line is not complete yet, it is sampled on the next update
+                    offset += self.interval_bytes
+                    continue
+                entry["samples"].append(list(sample))
+                offset = sample[0] + self.interval_bytes
+        entry["size"], entry["next_offset"] = stat_result.st_size, offset
+        self._save(filepath, entry)
+        return [tuple(sample) for sample in entry["samples"]]
+
+    def _get_source(self, sidecar_path):
+        import json
+        try:
+            with open(sidecar_path) as fd:
+                return json.loads(fd.readline())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def prune(self):
+        """ removes the unused sidecars, the oldest ones beyond max_sidecars and the sidecars of logs that no longer
+        exist; returns the number of sidecars removed """
+        from glob import glob
+        from time import time
+        sidecars = []
+        for sidecar_path in glob(path.join(self.cache_dir, "*.json")):
+            try:
+                mtime = os.stat(sidecar_path).st_mtime
+            except OSError:
+                mtime = 0
+            sidecars.append((mtime, sidecar_path))
+        sidecars.sort(reverse=True)
+        now, removed = time(), 0
+        for index, (mtime, sidecar_path) in enumerate(sidecars):
+            # only the sidecars that are kept by their modification times are opened
+            if index < self.max_sidecars and now - mtime < self.max_age_seconds:
+                source = self._get_source(sidecar_path)
+                if isinstance(source, str) and path.exists(source):
+                    continue
+            try:
+                os.remove(sidecar_path)
+                removed += 1
+            except OSError as error:
+                logger.debug("Failed to remove {!r}: {}".format(sidecar_path, error))
+        return removed
+
+    def get_byte_range(self, filepath, since, until):
+        """ returns (start, end) of the part of filepath that may have lines with times between since and until
+        (seconds since the epoch) """
+        from bisect import bisect_left, bisect_right
+        samples = self.update(filepath)
+        size = os.stat(filepath).st_size
+        times = [sample_time for offset, sample_time in samples]
+        if not samples or times != sorted(times):
+            return 0, size
+        # the lines before the last sample that is earlier than since are all earlier than since, and the lines after
+        # the first sample that is later than until are all later than until
+        first = bisect_left(times, since) - 1
+        last = bisect_right(times, until)
+        start = samples[first][0] if first >= 0 else 0
+        end = samples[last][0] if last < len(samples) else size
+        return start, max(start, end)
+
+
+def prune_offset_indexes(items):
+    """ prunes the offset index of every cache directory the items use, once; returns the number of sidecars removed """
+    cache_dirs = set()
+    for item in items:
+        for directory in getattr(item, "directories", [item]):
+            if getattr(directory, "offset_index_dir", None) and directory.timeframe_only:
+                cache_dirs.add(directory.offset_index_dir)
+    return sum(OffsetIndex(cache_dir).prune() for cache_dir in sorted(cache_dirs))
+
+
+class _LimitedReader(object):
+    def __init__(self, fd, length):
+        super(_LimitedReader, self).__init__()
+        self._fd = fd
+        self._remaining = length
+
+    def read(self, size=-1):
+        size = self._remaining if size < 0 else min(size, self._remaining)
+        data = self._fd.read(size)
+        self._remaining -= len(data)
+        return data
+
+
+def copy_byte_range(src, dst, start, end, bucket=None, redactor=None):
+    """ copies the bytes between start and end of src to dst, through redactor if given, returns the bytes written """
+    from shutil import copystat
+    from .util import check_cancelled
+    from .fastcopy import open_regular_file
+    with os.fdopen(open_regular_file(src), 'rb') as src_fd:
+        src_fd.seek(start)
+        with open(dst, 'wb') as dst_fd:
+            reader = _LimitedReader(src_fd, end - start)
+            if redactor is not None:
+                redactor.redact_stream(reader, dst_fd, bucket)
+            else:
+                for chunk in iter(lambda: reader.read(CHUNK_SIZE), b''):
+                    check_cancelled()
+                    if bucket is not None:
+                        bucket.consume(len(chunk))
+                    dst_fd.write(chunk)
+    copystat(src, dst)
+    return os.stat(dst).st_size
+
+
+def get_trimmed_range(offset_index, filepath, timestamp, delta):
+    """ returns the (start, end) of filepath to collect for the timeframe, or None if it should be collected whole """
+    from re import match
+    from time import mktime
+    if offset_index is None or match(COMPRESSED_LOG_PATTERN, filepath):
+        return None
+    try:
+        start, end = offset_index.get_byte_range(filepath, mktime((timestamp - delta).timetuple()),
+                                                 mktime((timestamp + delta).timetuple()))
+    except (IOError, OSError) as error:
+        logger.debug("Failed to index {!r}: {}".format(filepath, error))
+        return None
+    return None if (start, end) == (0, os.stat(filepath).st_size) else (start, end)
@@ -0,0 +1,182 @@
+""" Planning a collection before running it.
+
+make_plan walks every Directory item with the same filters the collection uses, without copying anything. It finds
+the files that more than one item would collect, and estimates the size of the collection and how long it will take
+from the metrics history of previous runs. A plan can be printed (the --dry-run option of the logs-collector
+script) and passed to run(), which schedules the items by its estimates when the collection has a deadline.
+
+The duplicates themselves are skipped when they are collected, not when they are planned: the item that collects
+a file first may not be the one the plan expected, if the items were reordered or an item was skipped, failed or
+timed out. run() records the real paths of the files that were copied in a CollectedFiles, and the items after it
+skip them.
+"""
+from logging import getLogger
+from contextlib import contextmanager
+from os import path
+import threading
+
+logger = getLogger(__name__)
+
+DEFAULT_ITEM_SECONDS = 1.0
+
+_active_collected_files = None
+
+
+class ThroughputModel(object):
+    def __init__(self, bytes_per_second=None, item_seconds=None):
+        super(ThroughputModel, self).__init__()
+        self.bytes_per_second = bytes_per_second
+        self.item_seconds = item_seconds or {}
+
+    @classmethod
+    def from_history(cls, entries):
+        """ builds a model from metrics.load_history() entries """
+        total_bytes, total_seconds, item_seconds = 0, 0.0, {}
+        for entry in entries:
+            for item in entry.get("items", []):
+                if item.get("collected_bytes"):
+                    total_bytes += item["collected_bytes"]
+                    total_seconds += item["seconds"]
+                item_seconds.setdefault(item["item"], []).append(item["seconds"])
+        bytes_per_second = total_bytes / total_seconds if total_bytes and total_seconds else None
+        averages = dict((key, sum(values) / len(values)) for key, values in item_seconds.items())
+        return cls(bytes_per_second, averages)
+
+    def estimate_item_seconds(self, item):
+        return self.item_seconds.get(repr(item), DEFAULT_ITEM_SECONDS)
+
+    def estimate_directory_seconds(self, size):
+        return None if self.bytes_per_second is None else size / self.bytes_per_second
+
+
+class PlannedItem(object):
+    def __init__(self, item):
+        super(PlannedItem, self).__init__()
+        self.item = item
+        self.files = []
+        self.duplicates = []
+        self.size = 0
+        self.estimated_seconds = None
+
+    def is_directory(self):
+        from .collectables import Directory
+        return isinstance(self.item, Directory)
+
+
+class Plan(object):
+    def __init__(self, timestamp, delta):
+        super(Plan, self).__init__()
+        self.timestamp = timestamp
+        self.delta = delta
+        self.planned_items = []
+        self.owners = {}
+
+    def get_total_size(self):
+        return sum(planned.size for planned in self.planned_items)
+
+    def get_estimated_seconds(self):
+        estimates = [planned.estimated_seconds for planned in self.planned_items]
+        return None if None in estimates else sum(estimates)
+
+    def get_duplicates(self):
+        """ returns a list of (filepath, item collecting it, item that would have collected it again) """
+        return [(filepath, self.owners[filepath], planned.item)
+                for planned in self.planned_items for filepath in planned.duplicates]
+
+
+class CollectedFiles(object):
+    """ remembers the real paths of the files that were collected, so a file is collected by one item only """
+    def __init__(self):
+        super(CollectedFiles, self).__init__()
+        self._lock = threading.Lock()
+        self._paths = set()
+
+    def __contains__(self, filepath):
+        with self._lock:
+            return path.realpath(filepath) in self._paths
+
+    def add(self, filepath):
+        with self._lock:
+            self._paths.add(path.realpath(filepath))
+
+
+def get_active_collected_files():
+    return _active_collected_files
+
+
+@contextmanager
+def deduplicating(collected_files):
+    """ makes the Directory items within the context skip the files that are in collected_files """
+    global _active_collected_files
+    previous, _active_collected_files = _active_collected_files, collected_files
+    try:
+        yield collected_files
+    finally:
+        _active_collected_files = previous
+
+
+def _get_timeframe_args(item, timestamp, delta):
+    return (item.dirname, item.regex_basename, item.recursive, item.timeframe_only, timestamp, delta)
+
+
+def make_plan(items, timestamp, delta, history_path=None):
+    from .metrics import load_history
+    model = ThroughputModel.from_history(load_history(history_path))
+    plan = Plan(timestamp, delta)
+    for item in items:
+        planned = PlannedItem(item)
+        plan.planned_items.append(planned)
+        if not planned.is_directory():
+            planned.estimated_seconds = model.estimate_item_seconds(item)
+            continue
+        pruned_dirs = item.get_pruned_dirs()
+        if pruned_dirs is None:
+            planned.estimated_seconds = 0
+            continue
+        try:
+            for dirpath, filenames in item.iter_matching_files(*_get_timeframe_args(item, timestamp, delta),
+                                                               pruned_dirs=pruned_dirs):
+                for filename in filenames:
+                    filepath = path.realpath(path.join(dirpath, filename))
+                    if filepath in plan.owners:
+                        planned.duplicates.append(filepath)
+                        continue
+                    plan.owners[filepath] = item
+                    planned.files.append(filepath)
+                    try:
+                        planned.size += path.getsize(filepath)
+                    except OSError:
+                        logger.debug("stat on filepath {!r} failed".format(filepath))
+        except OSError:
+            logger.exception("Failed to plan {!r}".format(item))
+        planned.estimated_seconds = model.estimate_directory_seconds(planned.size)
+    return plan
+
+
+def _format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024.0
+    return "{:.1f} TB".format(size)
+
+
+def _format_seconds(seconds):
+    return "unknown" if seconds is None else "{:.1f}s".format(seconds)
+
+
+def format_plan(plan):
+    lines = ["Collection plan for {} - {}".format(plan.timestamp - plan.delta, plan.timestamp)]
+    for planned in plan.planned_items:
+        if planned.is_directory():
+            line = "  {}: {} files, {}, estimated {}".format(planned.item, len(planned.files),
+                                                             _format_size(planned.size),
+                                                             _format_seconds(planned.estimated_seconds))
+            if planned.duplicates:
+                line += " ({} files already collected by other items)".format(len(planned.duplicates))
+        else:
+            line = "  {}: estimated {}".format(planned.item, _format_seconds(planned.estimated_seconds))
+        lines.append(line)
+    lines.append("Total: {}, estimated {}".format(_format_size(plan.get_total_size()),
+                                                  _format_seconds(plan.get_estimated_seconds())))
+    return '\n'.join(lines)
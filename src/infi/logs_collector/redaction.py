@@ -0,0 +1,165 @@
+""" Redaction of sensitive data while files are copied aside and command outputs are written.
+
+A Redactor holds compiled byte patterns. Files are redacted chunk by chunk in the same pass that copies them, and
+only complete lines are handed to the patterns, so a match is never split between two chunks (unless a single line
+is longer than max_line_length). If a pattern has a group named 'keep', the text it captures is kept and only the
+rest of the match is replaced.
+The values of environment variables whose names match masked_keys are replaced in 'environment.json'.
+Everything else the collection writes goes through the redactor as well: the samples, 'hostname.json', the debug log
+and the metrics of the collection in 'collection-logs', and the names of the directories of the archive (the
+hostname in 'logs/<hostname>/', the commands in 'samples/').
+
+To measure the throughput of a redactor on this host:
+
+    python -m infi.logs_collector.redaction --benchmark
+"""
+from logging import getLogger, Formatter
+from contextlib import contextmanager
+
+logger = getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+REPLACEMENT = b"<redacted>"
+# the patterns avoid global case-insensitivity and leading lookarounds, which make Python's re engine much slower
+DEFAULT_PATTERNS = [
+    br'\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b',                                         # IPv4 addresses
+    br'\b[0-9a-fA-F]{1,4}(?::[0-9a-fA-F]{1,4}){7}\b',                                      # IPv6 addresses
+    br'(?P<keep>(?:password|passwd|secret|token|api[_-]?key|Password|Secret|Token|'
+    br'PASSWORD|PASSWD|SECRET|TOKEN|API[_-]?KEY)\s*[=:]\s*)[^\s,;]+',                      # key=value secrets
+    br'(?P<keep>(?i:authorization:\s*(?:basic|bearer)\s+))\S+',                            # HTTP credentials
+]
+DEFAULT_MASKED_KEYS = r'(?i).*(pass|secret|token|key|credential|auth).*'
+
+_active_redactor = None
+
+
+class Redactor(object):
+    def __init__(self, patterns=DEFAULT_PATTERNS, replacement=REPLACEMENT, masked_keys=DEFAULT_MASKED_KEYS,
+                 redact_hostname=True, max_line_length=64 * 1024):
+        """
+        patterns - regular expressions (bytes) of data to redact
+        replacement - what the redacted data is replaced with
+        masked_keys - regular expression of the names of environment variables whose values are masked
+        redact_hostname - also redact the name of this host
+        max_line_length - lines longer than this are redacted in pieces
+        """
+        super(Redactor, self).__init__()
+        from re import compile, escape
+        from socket import gethostname
+        patterns = list(patterns)
+        if redact_hostname and gethostname():
+            patterns.append(br'(?i)\b' + escape(gethostname().encode()) + br'\b')
+        self.patterns = [compile(pattern) for pattern in patterns]
+        self.replacement = replacement
+        self.masked_keys = compile(masked_keys)
+        self.max_line_length = max_line_length
+
+    def __repr__(self):
+        return "<Redactor({} patterns)>".format(len(self.patterns))
+
+    def _replace(self, match):
+        return match.group('keep') + self.replacement
+
+    def redact(self, data):
+        for pattern in self.patterns:
+            # a constant replacement keeps the substitution in C, the callback is only needed for partial matches
+            data = pattern.sub(self._replace if 'keep' in pattern.groupindex else self.replacement, data)
+        return data
+
+    def redact_text(self, text):
+        return self.redact(text.encode("utf-8", "surrogateescape")).decode("utf-8", "surrogateescape")
+
+    def redact_name(self, name):
+        """ returns name redacted, with the replacement stripped of the characters that are invalid in file names.
+        Underscores separate words in names (like the keys of samples), so the parts between them are redacted too. """
+        from re import sub
+        redacted = '_'.join(self.redact_text(part) for part in self.redact_text(name).split('_'))
+        return sub(r'[<>:"/\\|?*]', '', redacted)
+
+    def redact_stream(self, src_fd, dst_fd, bucket=None):
+        """ redacts everything read from src_fd into dst_fd in a single pass, returns the number of bytes read """
+        from .util import check_cancelled
+        pending = b''
+        total = 0
+        while True:
+            check_cancelled()
+            chunk = src_fd.read(CHUNK_SIZE)
+            if bucket is not None:
+                bucket.consume(len(chunk))
+            total += len(chunk)
+            if not chunk:
+                break
+            pending += chunk
+            end = pending.rfind(b'\n') + 1
+            if not end and len(pending) > self.max_line_length:
+                end = len(pending)
+            if end:
+                dst_fd.write(self.redact(pending[:end]))
+                pending = pending[end:]
+        if pending:
+            dst_fd.write(self.redact(pending))
+        return total
+
+    def redact_file(self, src, dst, bucket=None):
+        from os import fdopen
+        from shutil import copystat
+        from .fastcopy import open_regular_file
+        with fdopen(open_regular_file(src), 'rb') as src_fd:
+            with open(dst, 'wb') as dst_fd:
+                self.redact_stream(src_fd, dst_fd, bucket)
+        copystat(src, dst)
+
+    def mask_environment(self, environ):
+        return dict((key, self.replacement.decode() if self.masked_keys.match(key) else value)
+                    for key, value in environ.items())
+
+
+class RedactingFormatter(Formatter):
+    """ a logging formatter that redacts the formatted records """
+    def __init__(self, redactor, **kwargs):
+        super(RedactingFormatter, self).__init__(**kwargs)
+        self.redactor = redactor
+
+    def format(self, record):
+        return self.redactor.redact_text(super(RedactingFormatter, self).format(record))
+
+
+def get_active_redactor():
+    return _active_redactor
+
+
+@contextmanager
+def redaction(redactor):
+    """ redacts the files and command outputs collected within the context with redactor """
+    global _active_redactor
+    previous, _active_redactor = _active_redactor, redactor
+    try:
+        yield redactor
+    finally:
+        _active_redactor = previous
+
+
+def measure_throughput(megabytes=32, redactor=None):
+    """ returns the number of bytes per second redactor redacts, on synthetic syslog-like lines """
+    from io import BytesIO
+    from time import time
+    redactor = redactor or Redactor()
+    line = b"Oct 19 10:00:00 server sshd[1234]: Accepted password for user from 10.0.0.1 port 22 token=abcdef\n"
+    data = line * (megabytes * 1024 * 1024 // len(line))
+    started = time()
+    redactor.redact_stream(BytesIO(data), BytesIO())
+    return len(data) / max(time() - started, 1e-6)
+
+
+def main(argv=None):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="redaction utilities")
+    parser.add_argument("--benchmark", action="store_true", help="measure the redaction throughput")
+    parser.add_argument("--megabytes", type=int, default=32)
+    args = parser.parse_args(argv)
+    if args.benchmark:
+        print("{:.1f} MB/s".format(measure_throughput(args.megabytes) / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+""" Collecting the same Directory items under many roots: containers, chroots and mounted images.
+
+A Root is a directory that is the / of another system, such as the merged overlay rootfs of a container. The
+Directory items of a collection are applied under every root by a RootsCollection, concurrently, and the files of
+every root are laid out under 'files/<root id>/' in the archive. Items that are not Directory items (commands, the
+journal, the environment) describe the host, so they are collected once as usual.
+
+Containers of the same image share most of their files through the lower layers of their overlays. A file is
+identified by its inode, size and modification time; it is copied once, under the first root it was found in, and
+hardlinked under the other roots, so the archive stores its data once.
+
+The files of a root are confined to it: a symlink that resolves outside of the root (such as '/var/log' of a
+container linked to the '/var/log' of the host) is not followed, so the files of the host do not end up in the
+archive as if they were files of the root.
+
+The roots may be listed in a file, one per line, as 'path' or 'id=path', where path may be a glob pattern:
+
+    # every docker container
+    /var/lib/docker/overlay2/*/merged
+    build=/srv/chroots/build
+"""
+from logging import getLogger
+from os import path
+import threading
+from .collectables import Item
+
+logger = getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class Root(object):
+    def __init__(self, root_path, root_id=None):
+        """
+        root_path - the directory that is the / of the root
+        root_id - the name of the root in the archive (default: derived from root_path)
+        """
+        super(Root, self).__init__()
+        self.path = path.abspath(root_path)
+        self.root_id = root_id or get_root_id(self.path)
+
+    def __repr__(self):
+        return "<Root({!r}, root_id={!r})>".format(self.path, self.root_id)
+
+    def get_path(self, filepath):
+        """ returns the path of filepath under this root """
+        return path.join(self.path, filepath.lstrip(path.sep))
+
+    def get_relative_path(self, filepath):
+        """ returns the path filepath (under this root) has inside the root """
+        return path.join(path.sep, path.relpath(filepath, self.path))
+
+    def contains(self, filepath):
+        """ returns True if filepath, with its symlinks resolved, is inside this root """
+        real_root, real_path = path.realpath(self.path), path.realpath(filepath)
+        return real_path == real_root or real_path.startswith(real_root.rstrip(path.sep) + path.sep)
+
+
+def get_root_id(root_path):
+    """ returns a name for root_path; the generic last components of overlays ('merged', 'rootfs') are skipped """
+    from re import sub
+    parts = [part for part in root_path.split(path.sep) if part]
+    while len(parts) > 1 and parts[-1] in ("merged", "rootfs", "diff"):
+        parts.pop()
+    return sub(r'[^A-Za-z0-9_.-]', '_', parts[-1] if parts else "root")
+
+
+def load_roots(config_path):
+    """ returns the roots listed in config_path """
+    from glob import glob
+    roots = []
+    with open(config_path) as fd:
+        for line in fd:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            root_id, pattern = line.split('=', 1) if '=' in line else (None, line)
+            matches = sorted(glob(pattern.strip()))
+            if not matches:
+                logger.warning("No roots match {!r}".format(pattern))
+            roots += [Root(match, root_id and root_id.strip()) for match in matches]
+    return get_unique_roots(roots)
+
+
+def get_unique_roots(roots):
+    """ returns the roots with unique ids, suffixing the ids that repeat """
+    unique, ids = [], set()
+    for root in roots:
+        root = root if isinstance(root, Root) else Root(root)
+        root_id, index = root.root_id, 1
+        while root_id in ids:
+            index += 1
+            root_id = "{}-{}".format(root.root_id, index)
+        ids.add(root_id)
+        unique.append(Root(root.path, root_id))
+    return unique
+
+
+class SharedFiles(object):
+    """ remembers the files that were collected, so a file seen under several roots is copied once """
+    def __init__(self):
+        super(SharedFiles, self).__init__()
+        self._lock = threading.Lock()
+        self._files = {}
+        self._events = {}
+
+    @classmethod
+    def get_key(cls, filepath):
+        from os import stat
+        stat_result = stat(filepath)
+        return stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+    def claim(self, src, dst):
+        """ returns None if dst should be copied from src, or the (path, event) of the copy to hardlink it to """
+        try:
+            key = self.get_key(src)
+        except OSError:
+            return None
+        with self._lock:
+            if key in self._files:
+                return self._files[key]
+            self._files[key] = (dst, threading.Event())
+            self._events[dst] = self._files[key][1]
+            return None
+
+    def done(self, dst):
+        """ marks the copy to dst as finished (or failed), so the files waiting for it can be linked to it """
+        with self._lock:
+            event = self._events.pop(dst, None)
+        if event is not None:
+            event.set()
+
+    def link(self, claimed, dst):
+        """ hardlinks dst to the copy that was claimed, returns False if the copy cannot be linked """
+        from os import link
+        copy_path, event = claimed
+        event.wait()
+        try:
+            link(copy_path, dst)
+            return True
+        except OSError as error:
+            logger.debug("Failed to link {!r} to {!r}: {}".format(dst, copy_path, error))
+            return False
+
+
+class RootsCollection(Item):
+    def __init__(self, directories, roots, max_workers=DEFAULT_MAX_WORKERS, timeout_in_seconds=None):
+        """
+        Define Directory items to collect under every one of roots.
+        directories - collectables.Directory instances, with absolute paths as seen from inside the roots
+        roots - Root instances or paths
+        max_workers - the number of (root, directory) pairs collected concurrently
+        timeout_in_seconds - maximum time for the whole collection; a pair gets what is left of it, and the pairs that
+                             did not start in time are not collected. By default, the time it takes when every pair
+                             times out.
+        """
+        super(RootsCollection, self).__init__()
+        self.directories = list(directories)
+        self.roots = get_unique_roots(roots)
+        self.max_workers = max_workers
+        self.timeout_in_seconds = self._get_default_timeout() if timeout_in_seconds is None else timeout_in_seconds
+        self.collected_bytes = None
+
+    def _get_default_timeout(self):
+        timeouts = [directory.timeout_in_seconds for directory in self.directories]
+        if not timeouts or None in timeouts:
+            return None
+        rounds = -(-len(self.directories) * len(self.roots) // self.max_workers)
+        return max(timeouts) * rounds
+
+    def __repr__(self):
+        return "<RootsCollection({} directories, {} roots)>".format(len(self.directories), len(self.roots))
+
+    def __str__(self):
+        return "{} directories under {} roots".format(len(self.directories), len(self.roots))
+
+    def _collect_under_root(self, root, directory, targetdir, timestamp, delta, shared_files, deadline):
+        from copy import copy
+        from time import time
+        rooted = copy(directory)
+        rooted.dirname = root.get_path(directory.dirname)
+        rooted.root = root
+        rooted.shared_files = shared_files
+        if deadline is not None:
+            remaining = deadline - time()
+            if remaining <= 0:
+                raise RuntimeError("{!r} did not start within the {} seconds timeout_in_seconds".format(
+                                   rooted, self.timeout_in_seconds))
+            timeouts = [timeout for timeout in (directory.timeout_in_seconds, remaining) if timeout is not None]
+            rooted.timeout_in_seconds = min(timeouts)
+        rooted.collect(targetdir, timestamp, delta)
+        return rooted.collected_bytes or 0
+
+    def collect(self, targetdir, timestamp, delta):
+        from concurrent.futures import ThreadPoolExecutor
+        from time import time
+        shared_files = SharedFiles()
+        deadline = None if self.timeout_in_seconds is None else time() + self.timeout_in_seconds
+        pairs = [(root, directory) for root in self.roots for directory in self.directories]
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(executor.submit(self._collect_under_root, root, directory, targetdir, timestamp, delta,
+                                        shared_files, deadline), root, directory) for root, directory in pairs]
+            self.collected_bytes = 0
+            for future, root, directory in futures:
+                try:
+                    self.collected_bytes += future.result()
+                except Exception:
+                    logger.exception("Failed to collect {!r} under {!r}".format(directory, root))
+                    failures.append((root.root_id, str(directory)))
+        if failures:
+            raise RuntimeError("Failed to collect {} of {} directories under the roots: {!r}".format(
+                               len(failures), len(pairs), failures))
+
+
+def apply_to_roots(items, roots, max_workers=DEFAULT_MAX_WORKERS):
+    """ returns items with its Directory items replaced by a RootsCollection of them under roots """
+    from .collectables import Directory
+    items = list(items)
+    directories = [item for item in items if isinstance(item, Directory)]
+    if not directories:
+        return items
+    # the collection of the directories takes the place of the first one
+    first = items.index(directories[0])
+    others = [item for item in items if not isinstance(item, Directory)]
+    return others[:first] + [RootsCollection(directories, roots, max_workers)] + others[first:]
@@ -0,0 +1,243 @@
+""" Periodic snapshots of commands (and other cheap items) into a size-bounded on-disk ring.
+
+A collection that runs after an incident only shows `ps -ef` or `free -m` as they look at collection time. A
+Sampler runs in the background, snapshots a few items every interval and keeps the snapshots in a ring directory:
+
+    <ring_dir>/<key>/index          one "<epoch> <digest>" line per sample
+    <ring_dir>/<key>/<digest>.z     the zlib-compressed snapshot
+
+Consecutive identical snapshots only add an index line. When the ring grows over max_bytes, the oldest samples
+are dropped. A collection picks up the samples that fall inside the collection timeframe with the Samples item.
+"""
+from logging import getLogger
+from os import path
+from .collectables import Item
+
+logger = getLogger(__name__)
+
+INDEX_FILENAME = "index"
+BLOB_SUFFIX = ".z"
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_SAMPLED_EXECUTABLES = ("ps", "free", "df", "uptime")
+
+
+def get_sample_key(item):
+    from re import sub
+    from .collectables import Command
+    if isinstance(item, Command):
+        name = ' '.join([item.prefix or path.basename(item.executable)] + list(item.commandline_arguments))
+    else:
+        name = str(item)
+    return sub(r'[^\w.-]+', '_', name).strip('_')
+
+
+def snapshot(item):
+    """ returns the output of an item as bytes, without anything that changes between identical runs """
+    from .collectables import Command
+    if isinstance(item, Command):
+        return item._format_output(item._execute())
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from os import walk
+    tempdir = mkdtemp()
+    try:
+        item.collect(tempdir, None, None)
+        output = []
+        for dirpath, dirnames, filenames in walk(tempdir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                filepath = path.join(dirpath, filename)
+                with open(filepath, 'rb') as fd:
+                    output.append(b"\n===%s===:\n%s" % (path.relpath(filepath, tempdir).encode(), fd.read()))
+        return b''.join(output)
+    finally:
+        rmtree(tempdir, ignore_errors=True)
+
+
+class SampleRing(object):
+    def __init__(self, ring_dir, max_bytes=DEFAULT_MAX_BYTES):
+        super(SampleRing, self).__init__()
+        self.ring_dir = ring_dir
+        self.max_bytes = max_bytes
+        self._last_digests = {}
+
+    def _get_key_dir(self, key):
+        return path.join(self.ring_dir, key)
+
+    def _read_index(self, key):
+        index_path = path.join(self._get_key_dir(key), INDEX_FILENAME)
+        if not path.exists(index_path):
+            return []
+        with open(index_path) as fd:
+            return [(float(epoch), digest) for epoch, digest in (line.split() for line in fd if line.strip())]
+
+    def _write_index(self, key, entries):
+        from os import rename
+        index_path = path.join(self._get_key_dir(key), INDEX_FILENAME)
+        with open(index_path + ".tmp", 'w') as fd:
+            fd.writelines("{!r} {}\n".format(epoch, digest) for epoch, digest in entries)
+        rename(index_path + ".tmp", index_path)
+
+    def get_keys(self):
+        from os import listdir
+        if not path.isdir(self.ring_dir):
+            return []
+        return sorted(key for key in listdir(self.ring_dir) if path.isdir(self._get_key_dir(key)))
+
+    def add(self, key, epoch, data):
+        """ adds a sample, returns True if it differs from the previous sample of the same key """
+        from hashlib import sha1
+        from zlib import compress
+        from os import makedirs, rename
+        key_dir = self._get_key_dir(key)
+        if not path.isdir(key_dir):
+            makedirs(key_dir)
+        digest = sha1(data).hexdigest()
+        if key not in self._last_digests:
+            entries = self._read_index(key)
+            self._last_digests[key] = entries[-1][1] if entries else None
+        changed = self._last_digests[key] != digest
+        blob_path = path.join(key_dir, digest + BLOB_SUFFIX)
+        if changed and not path.exists(blob_path):
+            with open(blob_path + ".tmp", 'wb') as fd:
+                fd.write(compress(data))
+            rename(blob_path + ".tmp", blob_path)
+        with open(path.join(key_dir, INDEX_FILENAME), 'a') as fd:
+            fd.write("{!r} {}\n".format(epoch, digest))
+        self._last_digests[key] = digest
+        return changed
+
+    def get_size(self):
+        from os import walk, stat
+        return sum(stat(path.join(dirpath, filename)).st_size
+                   for dirpath, dirnames, filenames in walk(self.ring_dir) for filename in filenames)
+
+    def trim(self):
+        """ drops the oldest samples until the ring fits in max_bytes """
+        from os import remove
+        size = self.get_size()
+        if size <= self.max_bytes:
+            return
+        indexes = dict((key, self._read_index(key)) for key in self.get_keys())
+        while size > self.max_bytes and any(indexes.values()):
+            key = min((key for key in indexes if indexes[key]), key=lambda key: indexes[key][0][0])
+            epoch, digest = indexes[key].pop(0)
+            size -= len("{!r} {}\n".format(epoch, digest))
+            if digest not in set(entry[1] for entry in indexes[key]):
+                blob_path = path.join(self._get_key_dir(key), digest + BLOB_SUFFIX)
+                if path.exists(blob_path):
+                    size -= path.getsize(blob_path)
+                    remove(blob_path)
+        for key, entries in indexes.items():
+            self._write_index(key, entries)
+            if not entries:
+                self._last_digests.pop(key, None)
+
+    def iter_samples(self, key, since, until):
+        """ yields (first_epoch, last_epoch, data) for every run of identical samples between since and until """
+        from zlib import decompress
+        entries = [(epoch, digest) for epoch, digest in self._read_index(key) if since <= epoch <= until]
+        runs = []
+        for epoch, digest in entries:
+            if runs and runs[-1][2] == digest:
+                runs[-1][1] = epoch
+            else:
+                runs.append([epoch, epoch, digest])
+        for first, last, digest in runs:
+            blob_path = path.join(self._get_key_dir(key), digest + BLOB_SUFFIX)
+            try:
+                with open(blob_path, 'rb') as fd:
+                    data = decompress(fd.read())
+            except (IOError, OSError):
+                logger.debug("sample {!r} of {} was dropped from the ring".format(digest, key))
+                continue
+            yield first, last, data
+
+
+class Sampler(object):
+    def __init__(self, items, ring_dir, interval_seconds=60, max_bytes=DEFAULT_MAX_BYTES, niceness=10):
+        """
+        Periodically snapshot items into a SampleRing.
+        items - the items to sample; Commands are run directly, other items are collected into a temporary directory
+        interval_seconds - time between two samples
+        max_bytes - maximum size of the ring on disk
+        niceness - increment applied to the process priority when running forever
+        """
+        super(Sampler, self).__init__()
+        self.items = items
+        self.ring = SampleRing(ring_dir, max_bytes)
+        self.interval_seconds = interval_seconds
+        self.niceness = niceness
+
+    def sample_once(self, epoch=None):
+        from time import time
+        epoch = time() if epoch is None else epoch
+        for item in self.items:
+            try:
+                self.ring.add(get_sample_key(item), epoch, snapshot(item))
+            except:
+                logger.exception("Failed to sample {!r}".format(item))
+        self.ring.trim()
+
+    def run_forever(self):
+        from time import time, sleep
+        from os import nice
+        if self.niceness:
+            nice(self.niceness)
+        while True:
+            started = time()
+            self.sample_once(started)
+            sleep(max(0, self.interval_seconds - (time() - started)))
+
+
+class Samples(Item):
+    def __init__(self, ring_dir):
+        super(Samples, self).__init__()
+        self.ring_dir = ring_dir
+
+    def __repr__(self):
+        return "<Samples(ring_dir={!r})>".format(self.ring_dir)
+
+    def __str__(self):
+        return "samples from {}".format(self.ring_dir)
+
+    def collect(self, targetdir, timestamp, delta):
+        from os import makedirs
+        from time import mktime, localtime, strftime
+        from .util import STRFTIME_LONG
+        from .redaction import get_active_redactor
+        redactor = get_active_redactor()
+        ring = SampleRing(self.ring_dir)
+        until = mktime(timestamp.timetuple())
+        since = mktime((timestamp - delta).timetuple())
+        for key in ring.get_keys():
+            key_dir = path.join(targetdir, "samples", key if redactor is None else redactor.redact_name(key))
+            for first, last, data in ring.iter_samples(key, since, until):
+                if not path.exists(key_dir):
+                    makedirs(key_dir)
+                filename = "{}--{}.txt".format(strftime(STRFTIME_LONG, localtime(first)),
+                                               strftime(STRFTIME_LONG, localtime(last)))
+                with open(path.join(key_dir, filename), 'wb') as fd:
+                    fd.write(data if redactor is None else redactor.redact(data))
+
+
+def main(argv=None):
+    from argparse import ArgumentParser
+    from .items import os_items
+    from .collectables import Command
+    parser = ArgumentParser(description="sample commands periodically into a ring directory")
+    parser.add_argument("ring_dir")
+    parser.add_argument("--interval", type=int, default=60)
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument("--executable", action="append", dest="executables",
+                        help="sample the commands of this executable (default: {})".format(
+                            ', '.join(DEFAULT_SAMPLED_EXECUTABLES)))
+    args = parser.parse_args(argv)
+    executables = args.executables or DEFAULT_SAMPLED_EXECUTABLES
+    items = [item for item in os_items()
+             if isinstance(item, Command) and path.basename(item.executable) in executables]
+    Sampler(items, args.ring_dir, args.interval, args.max_bytes).run_forever()
+
+
+if __name__ == '__main__':
+    main()
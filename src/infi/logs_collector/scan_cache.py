@@ -0,0 +1,185 @@
+""" A persistent cache of directory scans, for directories with very many files.
+
+The cache is an SQLite file that records, for every scanned directory, its device, inode and mtime, and for every
+entry in it its kind, size and mtime. When a directory is scanned again and its device, inode and mtime did not
+change, no file was created, deleted or renamed in it (log rotation renames files, so it invalidates the entry),
+and the listing is answered from the cache without listing the directory.
+
+The mtime of a directory does not change when a file in it is appended to, so the cached size and mtime of a file
+are only trusted if it has the name of a rotated log (which is not written to anymore) and was not modified for
+trust_age_seconds; the others are stat-ed again, since a dormant log may be written to at any time. A directory
+modified within the last MTIME_GRANULARITY_SECONDS is never answered from the cache.
+The number of cached entries is capped, and the least recently used directories are dropped first.
+"""
+from logging import getLogger
+from contextlib import contextmanager
+from os import path
+import threading
+
+logger = getLogger(__name__)
+
+MTIME_GRANULARITY_SECONDS = 2
+DEFAULT_MAX_ENTRIES = 1000000
+DEFAULT_TRUST_AGE_SECONDS = 24 * 60 * 60
+
+KIND_FILE, KIND_DIRECTORY, KIND_OTHER = 0, 1, 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, dev INTEGER, ino INTEGER, mtime_ns INTEGER,
+                                        last_used REAL);
+CREATE TABLE IF NOT EXISTS entries (directory TEXT, name TEXT, kind INTEGER, size INTEGER, mtime REAL,
+                                    PRIMARY KEY (directory, name));
+"""
+
+_active_scan_cache = None
+
+
+class ScanCache(object):
+    def __init__(self, db_path, max_entries=DEFAULT_MAX_ENTRIES, trust_age_seconds=DEFAULT_TRUST_AGE_SECONDS):
+        super(ScanCache, self).__init__()
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.trust_age_seconds = trust_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = self._connect()
+
+    def __repr__(self):
+        return "<ScanCache({!r})>".format(self.db_path)
+
+    def _connect(self):
+        import sqlite3
+        from os import remove
+        try:
+            connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            connection.executescript(SCHEMA)
+            return connection
+        except sqlite3.DatabaseError:
+            logger.exception("Scan cache {!r} is corrupted, recreating it".format(self.db_path))
+            remove(self.db_path)
+            connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            connection.executescript(SCHEMA)
+            return connection
+
+    @staticmethod
+    def _get_kind(stat_result):
+        from stat import S_ISREG, S_ISDIR
+        if S_ISREG(stat_result.st_mode):
+            return KIND_FILE
+        return KIND_DIRECTORY if S_ISDIR(stat_result.st_mode) else KIND_OTHER
+
+    def _scan_from_disk(self, dirpath, dir_stat, now):
+        from os import scandir
+        entries = []
+        for entry in scandir(dirpath):
+            try:
+                stat_result = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            entries.append((entry.name, self._get_kind(stat_result), stat_result.st_size, stat_result.st_mtime))
+        cursor = self._connection.cursor()
+        cursor.execute("DELETE FROM entries WHERE directory = ?", (dirpath,))
+        cursor.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+                           [(dirpath, ) + entry for entry in entries])
+        if now - dir_stat.st_mtime > MTIME_GRANULARITY_SECONDS:
+            cursor.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)",
+                           (dirpath, dir_stat.st_dev, dir_stat.st_ino, dir_stat.st_mtime_ns, now))
+        else:
+            cursor.execute("DELETE FROM directories WHERE path = ?", (dirpath,))
+        return entries
+
+    def _scan_from_cache(self, dirpath, now):
+        from os import lstat
+        from .fastcopy import is_rotated_log
+        cursor = self._connection.cursor()
+        cursor.execute("UPDATE directories SET last_used = ? WHERE path = ?", (now, dirpath))
+        entries = []
+        for name, kind, size, mtime in cursor.execute("SELECT name, kind, size, mtime FROM entries "
+                                                      "WHERE directory = ?", (dirpath,)).fetchall():
+            if kind == KIND_FILE and (now - mtime < self.trust_age_seconds or not is_rotated_log(name)):
+                try:
+                    stat_result = lstat(path.join(dirpath, name))
+                except OSError:
+                    continue
+                kind, size, mtime = self._get_kind(stat_result), stat_result.st_size, stat_result.st_mtime
+                cursor.execute("UPDATE entries SET kind = ?, size = ?, mtime = ? WHERE directory = ? AND name = ?",
+                               (kind, size, mtime, dirpath, name))
+            entries.append((name, kind, size, mtime))
+        return entries
+
+    def scan(self, dirpath):
+        """ returns a list of (name, kind, size, mtime) of the entries in dirpath """
+        from os import stat
+        from time import time
+        now = time()
+        dir_stat = stat(dirpath)
+        with self._lock:
+            row = self._connection.execute("SELECT dev, ino, mtime_ns FROM directories WHERE path = ?",
+                                           (dirpath,)).fetchone()
+            if row == (dir_stat.st_dev, dir_stat.st_ino, dir_stat.st_mtime_ns):
+                self.hits += 1
+                return self._scan_from_cache(dirpath, now)
+            self.misses += 1
+            return self._scan_from_disk(dirpath, dir_stat, now)
+
+    def walk(self, top, recursive=True, pruned_dirs=frozenset()):
+        """ like os.walk, yields (dirpath, dirnames, filenames, {filename: (size, mtime)}); the sizes and mtimes are
+        of the regular files only. The directories in pruned_dirs are not entered. """
+        pending = [top]
+        while pending:
+            dirpath = pending.pop(0)
+            try:
+                entries = self.scan(dirpath)
+            except OSError as error:
+                logger.debug("Failed to scan {!r}: {}".format(dirpath, error))
+                continue
+            dirnames = sorted(name for name, kind, size, mtime in entries if kind == KIND_DIRECTORY)
+            filenames = sorted(name for name, kind, size, mtime in entries if kind != KIND_DIRECTORY)
+            files = dict((name, (size, mtime)) for name, kind, size, mtime in entries if kind == KIND_FILE)
+            yield dirpath, dirnames, filenames, files
+            if recursive:
+                pending = [path.join(dirpath, dirname) for dirname in dirnames
+                           if path.join(dirpath, dirname) not in pruned_dirs] + pending
+
+    def trim(self):
+        """ drops the least recently used directories until the number of entries is within max_entries """
+        with self._lock:
+            count = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            rows = self._connection.execute("SELECT d.path, COUNT(e.name) FROM directories d LEFT JOIN entries e "
+                                            "ON e.directory = d.path GROUP BY d.path ORDER BY d.last_used")
+            doomed = []
+            for dirpath, entries in rows.fetchall():
+                if count <= self.max_entries:
+                    break
+                doomed.append((dirpath,))
+                count -= entries
+            self._connection.executemany("DELETE FROM entries WHERE directory = ?", doomed)
+            self._connection.executemany("DELETE FROM directories WHERE path = ?", doomed)
+            self._connection.execute("DELETE FROM entries WHERE directory NOT IN (SELECT path FROM directories)")
+
+    def commit(self):
+        self.trim()
+        with self._lock:
+            self._connection.commit()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+
+def get_active_scan_cache():
+    return _active_scan_cache
+
+
+@contextmanager
+def scan_caching(scan_cache):
+    """ makes Directory items scan their directories through scan_cache within the context """
+    global _active_scan_cache
+    previous, _active_scan_cache = _active_scan_cache, scan_cache
+    try:
+        yield scan_cache
+    finally:
+        _active_scan_cache = previous
+        if scan_cache is not None:
+            scan_cache.commit()
@@ -0,0 +1,112 @@
+""" Scheduling the items of a collection that must finish within a deadline.
+
+Items have a priority (the 'priority' attribute, higher is more important, 0 by default) and an expected duration,
+taken from the 'expected_seconds' attribute, from a collection plan, or from the metrics history of previous runs.
+With a deadline, the items are collected in the order of their priorities, and before every item:
+
+- an item that is not expected to finish in the remaining time is skipped, unless it is critical; critical items
+  are collected even after the deadline passed
+- the timeout of the item is shrunk to the remaining time, so an item that overruns is aborted
+
+Part of the deadline (reserve_seconds) is kept for writing the archive. The skipped items are written to
+'collection-logs/metrics.json' under 'sacrificed'.
+"""
+from logging import getLogger
+from contextlib import contextmanager
+
+logger = getLogger(__name__)
+
+PRIORITY_LOW = -10
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 10
+PRIORITY_CRITICAL = 100
+TIMEOUT_ATTRIBUTES = ("timeout_in_seconds", "wait_time_in_seconds")
+RESERVE_FRACTION = 0.1
+
+
+def get_priority(item):
+    # only integers are scheduling priorities, anything else an item keeps under that name is ignored
+    priority = getattr(item, "priority", PRIORITY_NORMAL)
+    return priority if isinstance(priority, int) and not isinstance(priority, bool) else PRIORITY_NORMAL
+
+
+class Scheduler(object):
+    def __init__(self, deadline_seconds=None, history_path=None, plan=None, reserve_seconds=None):
+        """
+        deadline_seconds - the time the collection must finish in, or None for no deadline
+        history_path - the metrics history the expected durations of the items are learned from
+        plan - an optional planning.Plan of the items, for the expected durations of Directory items
+        reserve_seconds - the part of the deadline kept for writing the archive (default: 10% of the deadline)
+        """
+        super(Scheduler, self).__init__()
+        from time import time
+        from .planning import ThroughputModel
+        from .metrics import load_history
+        self.deadline_seconds = deadline_seconds
+        self.plan = plan
+        self.model = None if deadline_seconds is None else ThroughputModel.from_history(load_history(history_path))
+        if reserve_seconds is None and deadline_seconds is not None:
+            reserve_seconds = deadline_seconds * RESERVE_FRACTION
+        self.reserve_seconds = reserve_seconds
+        self.sacrificed = []
+        self._started = time()
+
+    def __repr__(self):
+        return "<Scheduler(deadline_seconds={!r})>".format(self.deadline_seconds)
+
+    def get_expected_seconds(self, item):
+        if getattr(item, "expected_seconds", None) is not None:
+            return item.expected_seconds
+        planned = [planned for planned in (self.plan.planned_items if self.plan else []) if planned.item is item]
+        if planned and planned[0].estimated_seconds is not None:
+            return planned[0].estimated_seconds
+        return self.model.estimate_item_seconds(item)
+
+    def get_remaining_seconds(self):
+        from time import time
+        return self.deadline_seconds - self.reserve_seconds - (time() - self._started)
+
+    def order(self, items):
+        """ returns the items in the order they should be collected in; items of the same priority keep their order """
+        items = list(items)
+        return items if self.deadline_seconds is None else sorted(items, key=lambda item: -get_priority(item))
+
+    def should_collect(self, item):
+        """ returns False, and records the item as sacrificed, if it should be skipped to meet the deadline """
+        if self.deadline_seconds is None:
+            return True
+        remaining, expected = self.get_remaining_seconds(), self.get_expected_seconds(item)
+        if get_priority(item) >= PRIORITY_CRITICAL:
+            return True
+        if remaining <= 0:
+            reason = "the deadline passed"
+        elif expected > remaining:
+            reason = "expected to take {:.1f} seconds, {:.1f} seconds remain".format(expected, remaining)
+        else:
+            return True
+        logger.warning("Skipping {!r} to meet the deadline: {}".format(item, reason))
+        self.sacrificed.append(dict(item=repr(item), priority=get_priority(item),
+                                    expected_seconds=round(expected, 3), reason=reason))
+        return False
+
+    @contextmanager
+    def budget(self, item):
+        """ shrinks the timeouts of item to the remaining time within the context """
+        if self.deadline_seconds is None:
+            yield
+            return
+        remaining = max(self.get_remaining_seconds(), 1)
+        original = dict((name, getattr(item, name)) for name in TIMEOUT_ATTRIBUTES
+                        if getattr(item, name, None) is not None)
+        for name, value in original.items():
+            if value > remaining:
+                logger.info("Shrinking {} of {!r} to {:.1f} seconds".format(name, item, remaining))
+                setattr(item, name, remaining)
+        try:
+            yield
+        finally:
+            for name, value in original.items():
+                setattr(item, name, value)
+
+    def to_dict(self):
+        return dict(deadline_seconds=self.deadline_seconds, sacrificed=self.sacrificed)
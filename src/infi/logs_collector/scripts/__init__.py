@@ -91,3 +91,64 @@ def parse_deltastring(string):
 def get_default_timestamp():
     from datetime import datetime
     return datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+
+
+def main(argv=None):
+    """ collects the default items of an item factory, or prints the collection plan with --dry-run.
+    The items are only planned ahead for --dry-run and --deadline, which schedules them by their estimates. """
+    from argparse import ArgumentParser
+    from .. import run
+    from ..items import get_factory, get_factory_names
+    from ..planning import make_plan, format_plan
+    from ..scan_cache import ScanCache, scan_caching
+    from ..mounts import MountHealth, mount_probing
+    parser = ArgumentParser(description="collect logs into an archive")
+    parser.add_argument("--items", default="os_items", choices=get_factory_names())
+    parser.add_argument("--timestamp", type=parse_datestring, default="now")
+    parser.add_argument("--delta", type=parse_deltastring, default="1h")
+    parser.add_argument("--output", default=None, help="directory or file path of the archive")
+    parser.add_argument("--prefix", default="collection")
+    parser.add_argument("--metrics-history", default=None, help="file for the metrics of previous runs")
+    parser.add_argument("--scan-cache", default=None, help="path of a persistent directory scan cache")
+    parser.add_argument("--work-dir", default=None, help="persistent directory to collect in, for --resume")
+    parser.add_argument("--resume", action="store_true", help="resume an interrupted collection in --work-dir")
+    parser.add_argument("--upload", default=None, help="upload the archive to an http(s):// or ftp:// URL while "
+                                                        "collecting, instead of writing it to --output")
+    parser.add_argument("--deadline", type=float, default=None, help="seconds the collection must finish in")
+    parser.add_argument("--probe-mounts", action="store_true", help="skip the items on hung mounts")
+    parser.add_argument("--roots", default=None, help="file listing container or chroot roots to collect the "
+                                                      "directories under")
+    parser.add_argument("--dry-run", action="store_true", help="print the collection plan without collecting")
+    args = parser.parse_args(argv)
+    if args.resume and args.work_dir is None:
+        parser.error("--resume requires --work-dir")
+    items = get_factory(args.items)()
+    if args.roots is not None:
+        from ..roots import load_roots, apply_to_roots
+        items = apply_to_roots(items, load_roots(args.roots))
+    upload = None
+    if args.upload is not None:
+        from ..upload import Upload, get_sink
+        upload = Upload(get_sink(args.upload))
+    timestamp, delta = args.timestamp, args.delta
+    if args.resume:
+        from ..checkpoint import read_timeframe
+        timestamp, delta = read_timeframe(args.work_dir) or (timestamp, delta)
+    scan_cache = None if args.scan_cache is None else ScanCache(args.scan_cache)
+    mount_health = MountHealth() if args.probe_mounts else None
+    plan = None
+    try:
+        if args.dry_run or args.deadline is not None:
+            with scan_caching(scan_cache), mount_probing(mount_health):
+                plan = make_plan(items, timestamp, delta, args.metrics_history)
+        if args.dry_run:
+            print(format_plan(plan))
+            return 0
+        end_result, archive_path = run(args.prefix, items, args.timestamp, args.delta, output_path=args.output,
+                                       plan=plan, metrics_history_path=args.metrics_history, scan_cache=scan_cache,
+                                       work_dir=args.work_dir, resume=args.resume, upload=upload,
+                                       deadline_seconds=args.deadline, mount_health=mount_health)
+    finally:
+        if scan_cache is not None:
+            scan_cache.close()
+    return end_result
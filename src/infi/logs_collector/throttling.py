@@ -0,0 +1,160 @@
+""" Resource controls, so a collection doesn't hurt the workload of the host it runs on.
+
+A TokenBucket caps the bandwidth of copying files aside and of writing them into the archive; the same bucket is
+shared by both. ResourceLimits lowers the CPU and I/O priority of the work of the collection: the threads that copy
+the files aside and write the archive, and the child processes that run the commands. The collecting process itself keeps its priority,
+since an unprivileged process cannot raise it back, and a process that collects again and again (like the daemon)
+would otherwise drop lower with every collection.
+"""
+from logging import getLogger
+from contextlib import contextmanager
+import threading
+
+logger = getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+_active_bucket = None
+_active_resource_limits = None
+
+
+class TokenBucket(object):
+    def __init__(self, bytes_per_second, burst_bytes=None):
+        super(TokenBucket, self).__init__()
+        from time import time
+        self.bytes_per_second = float(bytes_per_second)
+        self.burst_bytes = float(burst_bytes or max(bytes_per_second, CHUNK_SIZE))
+        self.consumed_bytes = 0
+        self.throttled_seconds = 0.0
+        self._tokens = self.burst_bytes
+        self._last_refill = time()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<TokenBucket(bytes_per_second={!r}, burst_bytes={!r})>".format(self.bytes_per_second,
+                                                                               self.burst_bytes)
+
+    def consume(self, nbytes):
+        """ blocks until nbytes may pass """
+        from time import time, sleep
+        with self._lock:
+            now = time()
+            self._tokens = min(self.burst_bytes, self._tokens + (now - self._last_refill) * self.bytes_per_second)
+            self._last_refill = now
+            self._tokens -= nbytes
+            self.consumed_bytes += nbytes
+            wait = -self._tokens / self.bytes_per_second if self._tokens < 0 else 0
+            self.throttled_seconds += wait
+        if wait:
+            sleep(wait)
+
+    def get_stats(self):
+        return dict(bytes_per_second=self.bytes_per_second, consumed_bytes=self.consumed_bytes,
+                    throttled_seconds=round(self.throttled_seconds, 3))
+
+
+class ThrottledReader(object):
+    def __init__(self, fileobj, bucket):
+        super(ThrottledReader, self).__init__()
+        self.fileobj = fileobj
+        self.bucket = bucket
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.bucket.consume(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+def get_active_bucket():
+    return _active_bucket
+
+
+@contextmanager
+def bandwidth_limit(bucket):
+    """ makes bucket the token bucket of the copying and archiving done within the context """
+    global _active_bucket
+    previous, _active_bucket = _active_bucket, bucket
+    try:
+        yield bucket
+    finally:
+        _active_bucket = previous
+
+
+class ResourceLimits(object):
+    def __init__(self, bytes_per_second=None, niceness=None, io_idle=False):
+        """
+        Resource controls for run().
+        bytes_per_second - bandwidth cap shared by copying files and writing the archive
+        niceness - increment applied to the CPU priority of the copying and archiving threads and the commands
+        io_idle - put the copying and archiving threads and the commands in the idle I/O scheduling class (Linux
+                  only)
+        The commands are run through nice and ionice. The priorities of threads can only be changed on Linux, where
+        the copying and archiving threads are short-lived, so their priorities are never changed back.
+        """
+        super(ResourceLimits, self).__init__()
+        self.bytes_per_second = bytes_per_second
+        self.niceness = niceness
+        self.io_idle = io_idle
+
+    def __repr__(self):
+        return "<ResourceLimits(bytes_per_second={!r}, niceness={!r}, io_idle={!r})>".format(
+            self.bytes_per_second, self.niceness, self.io_idle)
+
+    def get_bucket(self):
+        return None if self.bytes_per_second is None else TokenBucket(self.bytes_per_second)
+
+    def get_command_prefix(self):
+        """ returns the arguments to run a command with the lowered priorities with """
+        from os import name, path
+        from .collectables import find_executable
+        if name == 'nt':
+            return []
+        prefix = []
+        for enabled, arguments in ((self.niceness, ["nice", "-n", str(self.niceness)]),
+                                   (self.io_idle, ["ionice", "-c", "3"])):
+            if not enabled:
+                continue
+            executable = find_executable(arguments[0])
+            if path.isabs(executable):
+                prefix += [executable] + arguments[1:]
+            else:
+                logger.error("{} not found".format(arguments[0]))
+        return prefix
+
+    def lower_thread_priority(self):
+        """ lowers the priorities of the calling thread (Linux only, elsewhere they belong to the whole process) """
+        from os import getpriority, setpriority, PRIO_PROCESS
+        from sys import platform
+        if not platform.startswith("linux"):
+            return
+        thread_id = threading.get_native_id()
+        if self.niceness:
+            setpriority(PRIO_PROCESS, thread_id, getpriority(PRIO_PROCESS, thread_id) + self.niceness)
+        if self.io_idle:
+            from infi.execute import execute
+            from .collectables import find_executable
+            try:
+                result = execute([find_executable("ionice"), "-c", "3", "-p", str(thread_id)])
+            except OSError:
+                logger.error("ionice not found")
+                return
+            if result.get_returncode() != 0:
+                logger.error("ionice failed: {!r}".format(result.get_stderr()))
+
+
+def get_active_resource_limits():
+    return _active_resource_limits
+
+
+@contextmanager
+def lowered_priority(resource_limits):
+    """ makes the copying threads and the commands started within the context run with resource_limits """
+    global _active_resource_limits
+    previous, _active_resource_limits = _active_resource_limits, resource_limits
+    try:
+        yield resource_limits
+    finally:
+        _active_resource_limits = previous
@@ -0,0 +1,405 @@
+""" Uploading collections while they are collected.
+
+With an Upload, run() does not write the archive to local disk. The archive is written as a gzip stream, and the
+files every item collected are added to it (and removed from the collection directory) as soon as the item
+finishes. The compressed bytes are cut into chunks. The chunks are queued in a bounded spool and uploaded by a
+background thread while the collection goes on. The spool keeps chunks in memory up to max_memory_bytes and in a
+temporary file beyond that, up to max_spool_bytes. When it is full, the collection waits for the upload.
+
+Every chunk is sent with its offset in the archive, so a failed chunk can be sent again and the upload resumes
+where it stopped. The sinks:
+
+    HTTPSink("https://uploads.example.com/collections")   # PUT (or POST) per chunk, with a Content-Range header
+    FTPSink("ftp.example.com", directory="incoming")      # REST <offset> + STOR per chunk
+
+Other destinations subclass Sink.
+"""
+from logging import getLogger
+from collections import deque
+from os import path
+import threading
+
+logger = getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class Sink(object):
+    """ a destination for archives; send() must be idempotent for the same name and offset """
+    def begin(self, name):
+        pass
+
+    def send(self, name, offset, data):
+        raise NotImplementedError()
+
+    def finish(self, name, size):
+        pass
+
+    def get_location(self, name):
+        return name
+
+    def close(self):
+        pass
+
+
+class HTTPSink(Sink):
+    def __init__(self, url, method="PUT", headers=None, timeout=60):
+        """
+        url - the base URL; the archive is uploaded to <url>/<archive name>, with the query string of url (e.g. a
+              signature) kept
+        method - 'PUT' or 'POST'
+        headers - optional extra headers, e.g. for authorization
+        timeout - seconds to wait for every request
+        """
+        super(HTTPSink, self).__init__()
+        self.url = url
+        self.method = method
+        self.headers = headers or {}
+        self.timeout = timeout
+        self._connection = None
+
+    def __repr__(self):
+        return "<HTTPSink({!r}, method={!r})>".format(self.url, self.method)
+
+    def get_location(self, name):
+        from six.moves.urllib.parse import urlsplit, urlunsplit
+        parts = urlsplit(self.url)
+        return urlunsplit(parts._replace(path="{}/{}".format(parts.path.rstrip('/'), name)))
+
+    def _request(self, name, body, content_range):
+        from six.moves.urllib.parse import urlsplit, quote
+        from six.moves import http_client
+        parts = urlsplit(self.get_location(quote(name)))
+        if self._connection is None:
+            connection_class = http_client.HTTPSConnection if parts.scheme == "https" else http_client.HTTPConnection
+            self._connection = connection_class(parts.netloc, timeout=self.timeout)
+        headers = dict(self.headers)
+        headers.update({"Content-Range": content_range, "Content-Type": "application/gzip"})
+        target = parts.path + ("?" + parts.query if parts.query else "")
+        try:
+            self._connection.request(self.method, target, body, headers)
+            response = self._connection.getresponse()
+            response.read()
+        except Exception:
+            self.close()
+            raise
+        # 308 is what resumable upload protocols answer for a chunk that is not the last one
+        if response.status // 100 != 2 and response.status != 308:
+            self.close()
+            raise UploadError("{} {} returned {} {}".format(self.method, parts.path, response.status, response.reason))
+
+    def send(self, name, offset, data):
+        self._request(name, data, "bytes {}-{}/*".format(offset, offset + len(data) - 1))
+
+    def finish(self, name, size):
+        self._request(name, b'', "bytes */{}".format(size))
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class FTPSink(Sink):
+    def __init__(self, host, user="anonymous", password="", directory=None, port=21, timeout=60):
+        super(FTPSink, self).__init__()
+        self.host = host
+        self.user = user
+        self.password = password
+        self.directory = directory
+        self.port = port
+        self.timeout = timeout
+        self._ftp = None
+
+    def __repr__(self):
+        return "<FTPSink({!r}, directory={!r})>".format(self.host, self.directory)
+
+    def get_location(self, name):
+        return "ftp://{}/{}".format(self.host, name if self.directory is None else
+                                    "{}/{}".format(self.directory.strip('/'), name))
+
+    def _connect(self):
+        from ftplib import FTP
+        if self._ftp is None:
+            ftp = FTP()
+            ftp.connect(self.host, self.port, timeout=self.timeout)
+            ftp.login(self.user, self.password)
+            ftp.voidcmd("TYPE I")
+            if self.directory is not None:
+                ftp.cwd(self.directory)
+            self._ftp = ftp
+        return self._ftp
+
+    def send(self, name, offset, data):
+        try:
+            ftp = self._connect()
+            # REST makes the STOR write from offset, so sending a chunk again overwrites the same bytes
+            connection = ftp.transfercmd("STOR {}".format(name), rest=offset or None)
+            try:
+                connection.sendall(data)
+            finally:
+                connection.close()
+            ftp.voidresp()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self._ftp is not None:
+            try:
+                self._ftp.quit()
+            except Exception:
+                self._ftp.close()
+            self._ftp = None
+
+
+class Spool(object):
+    """ a bounded FIFO of (offset, data) chunks, kept in memory up to max_memory_bytes and in a temporary file
+    beyond that """
+    def __init__(self, max_memory_bytes, max_bytes, spool_dir=None):
+        super(Spool, self).__init__()
+        self.max_memory_bytes = max_memory_bytes
+        self.max_bytes = max_bytes
+        self.spool_dir = spool_dir
+        self._chunks = deque()
+        self._memory_bytes = 0
+        self._bytes = 0
+        self._file = None
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+
+    def put(self, offset, data):
+        """ queues a chunk, waiting while the spool is full; raises the error of the uploader if it failed """
+        from tempfile import TemporaryFile
+        with self._condition:
+            while self._bytes and self._bytes + len(data) > self.max_bytes and self._error is None:
+                self._condition.wait()
+            if self._error is not None:
+                raise UploadError("Upload failed: {}".format(self._error))
+            if self._memory_bytes + len(data) <= self.max_memory_bytes:
+                self._chunks.append((offset, data, None))
+                self._memory_bytes += len(data)
+            else:
+                if self._file is None:
+                    self._file = TemporaryFile(dir=self.spool_dir)
+                self._file.seek(0, 2)
+                self._chunks.append((offset, None, (self._file.tell(), len(data))))
+                self._file.write(data)
+            self._bytes += len(data)
+            self._condition.notify_all()
+
+    def peek(self):
+        """ waits for the first chunk and returns (offset, data), or None when the spool is closed and empty """
+        with self._condition:
+            while not self._chunks and not self._closed:
+                self._condition.wait()
+            if not self._chunks:
+                return None
+            offset, data, location = self._chunks[0]
+            if data is None:
+                self._file.seek(location[0])
+                data = self._file.read(location[1])
+            return offset, data
+
+    def pop(self):
+        with self._condition:
+            offset, data, location = self._chunks.popleft()
+            if data is not None:
+                self._memory_bytes -= len(data)
+            self._bytes -= len(data) if data is not None else location[1]
+            if self._file is not None and all(chunk[2] is None for chunk in self._chunks):
+                self._file.seek(0)
+                self._file.truncate()
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def fail(self, error):
+        with self._condition:
+            self._error = error
+            self._chunks.clear()
+            self._condition.notify_all()
+
+    def dispose(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class UploadStream(object):
+    """ a write-only file object that cuts what is written into chunks and uploads them in the background """
+    def __init__(self, upload, name):
+        super(UploadStream, self).__init__()
+        self.upload = upload
+        self.name = name
+        self.size = 0
+        self.sent_bytes = 0
+        self._buffer = []
+        self._buffered = 0
+        self._error = None
+        self._spool = Spool(upload.max_memory_bytes, upload.max_spool_bytes, upload.spool_dir)
+        upload.sink.begin(name)
+        self._thread = threading.Thread(target=self._upload, name="upload-{}".format(name))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _send(self, offset, data):
+        from time import sleep
+        delay = self.upload.retry_delay
+        for attempt in range(1, self.upload.max_attempts + 1):
+            try:
+                self.upload.sink.send(self.name, offset, data)
+                return
+            except Exception as error:
+                if attempt == self.upload.max_attempts:
+                    raise
+                logger.warning("Uploading {} bytes at offset {} of {} failed ({}), retrying in {} seconds".format(
+                               len(data), offset, self.name, error, delay))
+                sleep(delay)
+                delay *= 2
+
+    def _upload(self):
+        while True:
+            chunk = self._spool.peek()
+            if chunk is None:
+                break
+            offset, data = chunk
+            try:
+                self._send(offset, data)
+            except Exception as error:
+                logger.exception("Uploading {} failed".format(self.name))
+                self._error = error
+                self._spool.fail(error)
+                break
+            self.sent_bytes += len(data)
+            self._spool.pop()
+
+    def _flush(self):
+        data = b''.join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        if data:
+            self._spool.put(self.size - len(data), data)
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self.size += len(data)
+        if self._buffered >= self.upload.chunk_size:
+            self._flush()
+
+    def close(self):
+        """ waits for the upload to finish; raises UploadError if it failed """
+        try:
+            if self._error is None:
+                self._flush()
+        finally:
+            self._spool.close()
+            self._thread.join()
+            self._spool.dispose()
+        if self._error is not None:
+            self.upload.sink.close()
+            raise UploadError("Upload of {} failed: {}".format(self.name, self._error))
+        try:
+            self.upload.sink.finish(self.name, self.size)
+        finally:
+            self.upload.sink.close()
+
+
+class StreamingArchive(object):
+    """ an archive of the collection directory that is written to an UploadStream, adding files as they appear """
+    def __init__(self, stream, srcdir):
+        from tarfile import PAX_FORMAT
+        from .archive import CollectionTarFile
+        super(StreamingArchive, self).__init__()
+        self.stream = stream
+        self.srcdir = srcdir
+        self.location = stream.upload.sink.get_location(stream.name)
+        self._archive = CollectionTarFile.open(fileobj=stream, mode="w|gz", format=PAX_FORMAT)
+        self._added = set()
+
+    def _add(self, filepath, recursive=False):
+        self._archive.add(filepath, path.join(path.basename(self.srcdir), path.relpath(filepath, self.srcdir)),
+                          recursive=recursive)
+        self._added.add(filepath)
+
+    def add_new_files(self, final=False):
+        """ adds the files that were not added yet, and removes them from the collection directory.
+        The collection logs are still being written, so they are only added when final is True. """
+        from os import walk, remove
+        from . import fix_short_file
+        if self.srcdir not in self._added:
+            self._archive.add(self.srcdir, path.basename(self.srcdir), recursive=False)
+            self._added.add(self.srcdir)
+        for dirpath, dirnames, filenames in walk(self.srcdir):
+            if not final and "collection-logs" in dirnames:
+                dirnames.remove("collection-logs")
+            dirnames.sort()
+            for dirname in dirnames:
+                if path.join(dirpath, dirname) not in self._added:
+                    self._add(path.join(dirpath, dirname))
+            for filename in sorted(filenames):
+                filepath = path.join(dirpath, filename)
+                if filepath in self._added:
+                    continue
+                try:
+                    fix_short_file(filepath)
+                except OSError:
+                    logger.exception("OSError")
+                self._add(filepath)
+                remove(filepath)
+
+    def close(self):
+        try:
+            self.add_new_files(final=True)
+            self._archive.close()
+        finally:
+            self.stream.close()
+
+
+class Upload(object):
+    def __init__(self, sink, chunk_size=DEFAULT_CHUNK_SIZE, max_memory_bytes=4 * DEFAULT_CHUNK_SIZE,
+                 max_spool_bytes=64 * DEFAULT_CHUNK_SIZE, spool_dir=None, max_attempts=5, retry_delay=1):
+        """
+        sink - a Sink to upload the archive to
+        chunk_size - the number of compressed bytes sent in every request
+        max_memory_bytes - the number of bytes waiting for the upload that are kept in memory
+        max_spool_bytes - the number of bytes waiting for the upload, in memory and on disk, before the
+                          collection waits for the upload
+        spool_dir - the directory of the spool file (default: the system temporary directory)
+        max_attempts - the number of times every chunk is sent before the upload fails
+        retry_delay - seconds to wait before sending a chunk again; doubled after every attempt
+        """
+        super(Upload, self).__init__()
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.max_memory_bytes = max_memory_bytes
+        self.max_spool_bytes = max_spool_bytes
+        self.spool_dir = spool_dir
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def __repr__(self):
+        return "<Upload({!r})>".format(self.sink)
+
+    def start(self, name, srcdir):
+        """ starts uploading an archive of srcdir named name, returns a StreamingArchive """
+        return StreamingArchive(UploadStream(self, name), srcdir)
+
+
+def get_sink(url):
+    """ returns the sink of an http://, https:// or ftp://[user[:password]@]host[:port]/directory URL """
+    from six.moves.urllib.parse import urlsplit, unquote
+    parts = urlsplit(url)
+    if parts.scheme in ("http", "https"):
+        return HTTPSink(url)
+    if parts.scheme == "ftp":
+        return FTPSink(parts.hostname, unquote(parts.username or "anonymous"), unquote(parts.password or ""),
+                       parts.path.strip('/') or None, parts.port or 21)
+    raise ValueError("Unsupported upload URL: {}".format(url))
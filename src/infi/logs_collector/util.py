@@ -1,10 +1,13 @@
 import os
 import time
+import threading
 
 STRFTIME_SHORT = "%Y-%m-%d.%H-%M"
 STRFTIME_LONG = "%Y-%m-%d.%H-%M-%S"
 LOGGING_FORMATTER_KWARGS = dict(fmt='%(asctime)-25s %(levelname)-8s %(name)-50s %(message)s',
                                 datefmt='%Y-%m-%d %H:%M:%S %z')
+SYSLOG_TIME_FORMAT = "%b %d %H:%M:%S"
+ISO_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 def get_logs_directory():
     if os.name == "nt":
@@ -15,6 +18,27 @@ def get_logs_directory():
 def get_timestamp(seconds=False):
     return time.strftime(STRFTIME_LONG if seconds else STRFTIME_SHORT)
 
+def get_host_dirname():
+    """ returns the name of the directory of this host in the archive, redacted by the active redactor """
+    from socket import gethostname
+    from .redaction import get_active_redactor
+    redactor = get_active_redactor()
+    return gethostname() if redactor is None else redactor.redact_name(gethostname())
+
+def parse_line_time(line, year=None):
+    """ returns the time of an ISO-8601 or syslog line as seconds since the epoch, or None """
+    from datetime import datetime
+    text = line[:32].decode("ascii", "replace")
+    for candidate, time_format in ((text[:19].replace('T', ' '), ISO_TIME_FORMAT), (text[:15], SYSLOG_TIME_FORMAT)):
+        try:
+            parsed = datetime.strptime(candidate, time_format)
+        except ValueError:
+            continue
+        if time_format == SYSLOG_TIME_FORMAT:
+            parsed = parsed.replace(year=year or datetime.now().year)
+        return time.mktime(parsed.timetuple())
+    return None
+
 def get_platform_name():  # pragma: no cover
     from platform import system
     name = system().lower().replace('-', '_')
@@ -30,18 +54,68 @@ def init_colors():
         init()
 
 
+_cancellation = threading.local()
+
+
+class CollectionCancelled(Exception):
+    pass
+
+
+def check_cancelled():
+    """ raises CollectionCancelled if the make_blocking call this thread runs in timed out """
+    event = getattr(_cancellation, "event", None)
+    if event is not None and event.is_set():
+        raise CollectionCancelled()
+
+
 def make_blocking(func, args=(), kwargs=None, timeout=1):
+    """ runs func in a thread and waits up to timeout seconds (or as long as it takes, if timeout is None) for it,
+    with the priority of the active throttling.ResourceLimits. When it times out, func is asked to stop (it
+    calls check_cancelled() between units of work, such as files and chunks) and is waited for until it does, so it
+    never writes into a directory its caller already archived; TimeoutError is then raised """
     import concurrent.futures
+    from .throttling import get_active_resource_limits
+    event = threading.Event()
+    resource_limits = get_active_resource_limits()
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(func, *args, **kwargs or {})
+    def target():
+        _cancellation.event = event
+        if resource_limits is not None:
+            resource_limits.lower_thread_priority()
+        try:
+            return func(*args, **kwargs or {})
+        finally:
+            _cancellation.event = None
 
-        # Wait for the function to complete or timeout
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(target)
         try:
-            result = future.result(timeout=timeout)
-            return result
+            return future.result(timeout=timeout)
         except concurrent.futures.TimeoutError:
-            # If the function exceeds the timeout, cancel the task
-            future.cancel()
+            event.set()
+            try:
+                future.result()
+            except Exception:
+                pass  # whatever func raised while it stopped, it timed out
             raise TimeoutError(f"Execution of function {func.__name__} timed out ({timeout} seconds)")
-        
\ No newline at end of file
+        
+
+def measure_import_times(module_names, repeat=3):
+    """ imports module_names in a fresh interpreter with 'python -X importtime', and returns a dict of the cumulative
+    import time of every module that was imported, in microseconds (the fastest of repeat runs) """
+    from subprocess import Popen, PIPE
+    from sys import executable
+    times = {}
+    for _ in range(repeat):
+        process = Popen([executable, "-X", "importtime", "-c", "import " + ", ".join(module_names)],
+                        stdout=PIPE, stderr=PIPE)
+        _, stderr = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError("Failed to import {}: {}".format(module_names, stderr.decode(errors="replace")))
+        for line in stderr.decode(errors="replace").splitlines():
+            fields = line.split('|')
+            if not line.startswith("import time:") or not fields[1].strip().isdigit():
+                continue
+            name, cumulative = fields[2].strip(), int(fields[1])
+            times[name] = min(times.get(name, cumulative), cumulative)
+    return times
@@ -154,6 +154,22 @@ class LogCollectorTestCase(unittest.TestCase):
             items = [collectables.Directory("/tmp", "a", timeout_in_seconds=1)]
             result, archive_path = logs_collector.run("test", items, datetime.now(), None)
 
+    def test_timed_out_function_is_stopped(self):
+        from time import sleep
+        from infi.logs_collector.util import make_blocking, check_cancelled
+        progress = []
+
+        def work():
+            while True:
+                check_cancelled()
+                progress.append(None)
+                sleep(0.01)
+        with self.assertRaises(TimeoutError):
+            make_blocking(work, timeout=0.2)
+        count = len(progress)
+        sleep(0.1)
+        self.assertEqual(len(progress), count)
+
     def test_windows_with_mocks(self):
         from infi.logs_collector.items import windows
         result, archive_path = logs_collector.run("test", windows(), datetime.now(), None)
@@ -281,3 +297,1409 @@ class RealCollectablesTestCase(unittest.TestCase):
             with open(filepath) as fd:
                 contents += fd.read()
         self.assertIn('hello world', contents)
+
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        from infi.logs_collector.daemon import CollectorDaemon
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.daemon = CollectorDaemon(path.join(self.tempdir, "collector.sock"), creation_dir=self.tempdir)
+
+    def test_request_over_socket(self):
+        from infi.logs_collector.daemon import request_collection
+        self.daemon.start()
+        self.addCleanup(self.daemon.shutdown)
+        result, archive_path = request_collection(self.daemon.socket_path, "get_generic_os_items", "now", "1h",
+                                                  output_path=self.tempdir, timeout=60)
+        self.assertEqual(result, 0)
+        self.assertTrue(path.exists(archive_path))
+        self.assertEqual(path.dirname(archive_path), self.tempdir)
+
+    def test_unknown_items_factory(self):
+        from infi.logs_collector.daemon import request_collection
+        self.daemon.start()
+        self.addCleanup(self.daemon.shutdown)
+        with self.assertRaises(RuntimeError):
+            request_collection(self.daemon.socket_path, "no_such_factory", timeout=60)
+
+    def test_identical_requests_are_deduplicated(self):
+        from infi.logs_collector.daemon import CollectionRequest
+        request = CollectionRequest("get_generic_os_items", "01/01/2000 01:00:00", "1h")
+        first = self.daemon.submit(request)
+        second = self.daemon.submit(request)
+        self.assertIs(first, second)
+        self.assertEqual(self.daemon._queue.qsize(), 1)
+
+    def test_now_requests_are_deduplicated_until_collected(self):
+        from infi.logs_collector.daemon import CollectionRequest
+        from time import sleep
+        first = self.daemon.submit(CollectionRequest("get_generic_os_items", "now", "1h"))
+        sleep(1.1)
+        second = self.daemon.submit(CollectionRequest("get_generic_os_items", "now", "1h"))
+        submitted = datetime.now().replace(microsecond=0)
+        self.assertIs(first, second)
+        self.assertEqual(self.daemon._queue.qsize(), 1)
+        started = []
+        with patch.object(self.daemon, "_collect", side_effect=lambda *args: started.append(args) or (0, None)):
+            self.daemon._queue.put(None)
+            self.daemon._work()
+        self.assertEqual(first.result(), (0, None))
+        # "now" is resolved when the collection starts
+        self.assertGreaterEqual(started[0][1], submitted)
+        third = self.daemon.submit(CollectionRequest("get_generic_os_items", "now", "1h"))
+        self.assertIsNot(first, third)
+
+    def test_static_command_output_is_cached(self):
+        from infi.logs_collector.collectables import enable_static_output_cache
+        enable_static_output_cache()
+        self.addCleanup(enable_static_output_cache, False)
+        command = collectables.Command("echo", ["hello"], static=True)
+        first = command._execute_or_get_cached()
+        with patch.object(collectables.Command, "_execute") as execute:
+            second = command._execute_or_get_cached()
+        self.assertFalse(execute.called)
+        self.assertEqual(first.get_stdout(), second.get_stdout())
+
+
+class SamplingTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+
+    def test_consecutive_identical_samples_share_a_blob(self):
+        from infi.logs_collector.sampling import SampleRing
+        ring = SampleRing(self.tempdir)
+        self.assertTrue(ring.add("key", 1.0, b"a"))
+        self.assertFalse(ring.add("key", 2.0, b"a"))
+        self.assertTrue(ring.add("key", 3.0, b"b"))
+        self.assertEqual(len(glob(path.join(self.tempdir, "key", "*.z"))), 2)
+        runs = [(first, last, data) for first, last, data in ring.iter_samples("key", 0, 10)]
+        self.assertEqual(runs, [(1.0, 2.0, b"a"), (3.0, 3.0, b"b")])
+
+    def test_ring_is_trimmed_to_max_bytes(self):
+        from infi.logs_collector.sampling import SampleRing
+        from os import urandom
+        ring = SampleRing(self.tempdir, max_bytes=4096)
+        for epoch in range(10):
+            ring.add("key", float(epoch), urandom(1024))
+            ring.trim()
+        self.assertLessEqual(ring.get_size(), 4096)
+        epochs = [first for first, last, data in ring.iter_samples("key", 0, 100)]
+        self.assertIn(9.0, epochs)
+        self.assertNotIn(0.0, epochs)
+
+    def test_run_collects_samples_within_timeframe(self):
+        from infi.logs_collector.sampling import Sampler
+        from time import time
+        now = time()
+        sampler = Sampler([collectables.Command("echo", ["hello"])], path.join(self.tempdir, "ring"))
+        sampler.sample_once(now - 7200)
+        sampler.sample_once(now - 60)
+        result, archive_path = logs_collector.run("test", [], datetime.now(), timedelta(hours=1),
+                                                  output_path=self.tempdir, samples_dir=sampler.ring.ring_dir)
+        archive = TarFile.open(archive_path, "r:gz")
+        samples = [name for name in archive.getnames() if "/samples/echo_hello/" in name]
+        self.assertEqual(len(samples), 1)
+        self.assertIn(b"hello", archive.extractfile(samples[0]).read())
+
+
+class ThrottlingTestCase(unittest.TestCase):
+    def test_token_bucket_throttles(self):
+        from infi.logs_collector.throttling import TokenBucket
+        from time import time
+        bucket = TokenBucket(1024 * 1024, burst_bytes=1024 * 1024)
+        started = time()
+        for _ in range(3):
+            bucket.consume(512 * 1024)
+        self.assertEqual(bucket.consumed_bytes, 3 * 512 * 1024)
+        self.assertGreater(bucket.throttled_seconds, 0.4)
+        self.assertGreater(time() - started, 0.4)
+
+    def test_run_with_bandwidth_limit_reports_throttling(self):
+        from infi.logs_collector.throttling import ResourceLimits
+        from json import loads
+        from shutil import rmtree
+        tempdir = mkdtemp()
+        self.addCleanup(rmtree, tempdir, ignore_errors=True)
+        fd, src = mkstemp(dir=tempdir)
+        write(fd, b'x' * 1024 * 1024)
+        close(fd)
+        limits = ResourceLimits(bytes_per_second=2 * 1024 * 1024)
+        result, archive_path = logs_collector.run("test", [collectables.File(src)], datetime.now(), None,
+                                                  output_path=tempdir, resource_limits=limits)
+        archive = TarFile.open(archive_path, "r:gz")
+        [metrics_name] = [name for name in archive.getnames() if name.endswith("metrics.json")]
+        metrics = loads(archive.extractfile(metrics_name).read().decode())
+        self.assertEqual(metrics["throttling"]["consumed_bytes"], 1024 * 1024)
+        self.assertEqual(len(metrics["items"]), 1)
+
+    def test_niceness_applies_to_workers_and_commands_only(self):
+        from infi.logs_collector.throttling import ResourceLimits, lowered_priority
+        from infi.logs_collector.util import make_blocking
+        from os import nice, getpriority, PRIO_PROCESS
+        from shutil import rmtree
+        from threading import get_native_id
+        tempdir = mkdtemp()
+        self.addCleanup(rmtree, tempdir, ignore_errors=True)
+        niceness = nice(0)
+        limits = ResourceLimits(niceness=5)
+        for _ in range(2):
+            with lowered_priority(limits):
+                self.assertEqual(make_blocking(lambda: getpriority(PRIO_PROCESS, get_native_id())), niceness + 5)
+            result, archive_path = logs_collector.run("test", [collectables.Command("nice", [])], datetime.now(),
+                                                      None, output_path=tempdir, resource_limits=limits)
+            archive = TarFile.open(archive_path, "r:gz")
+            [output_name] = [name for name in archive.getnames() if "/commands/nice." in name]
+            self.assertIn("===stdout===:\n{}\n".format(niceness + 5).encode(), archive.extractfile(output_name).read())
+        self.assertEqual(nice(0), niceness)
+
+    def test_archive_is_written_with_lowered_priority(self):
+        from infi.logs_collector.throttling import ResourceLimits
+        from os import getpriority, PRIO_PROCESS
+        from shutil import rmtree
+        from threading import get_native_id
+        tempdir = mkdtemp()
+        self.addCleanup(rmtree, tempdir, ignore_errors=True)
+        priorities = []
+        real_add_directory = logs_collector.add_directory
+
+        def add_directory(*args, **kwargs):
+            priorities.append(getpriority(PRIO_PROCESS, get_native_id()))
+            return real_add_directory(*args, **kwargs)
+        with patch("infi.logs_collector.add_directory", side_effect=add_directory):
+            logs_collector.run("test", [collectables.Command("echo", ["hello"])], datetime.now(), None,
+                               output_path=tempdir, resource_limits=ResourceLimits(niceness=5))
+        self.assertEqual(priorities, [getpriority(PRIO_PROCESS, get_native_id()) + 5])
+
+
+class FastCopyTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.src = path.join(self.tempdir, "src.log.1")
+        with open(self.src, 'wb') as fd:
+            fd.write(b'0123456789' * 300000)
+
+    def test_copy_file(self):
+        from infi.logs_collector.fastcopy import copy_file
+        dst = path.join(self.tempdir, "dst")
+        method = copy_file(self.src, dst)
+        self.assertNotEqual(method, "hardlink")
+        self.assertEqual(open(dst, 'rb').read(), open(self.src, 'rb').read())
+        self.assertEqual(int(stat(dst).st_mtime), int(stat(self.src).st_mtime))
+
+    def test_copy_file__buffered_fallback(self):
+        import os
+        from infi.logs_collector.fastcopy import copy_file
+        dst = path.join(self.tempdir, "dst")
+        with patch("infi.logs_collector.fastcopy._try_reflink", return_value=False):
+            with patch.object(os, "copy_file_range", side_effect=OSError(18, "EXDEV"), create=True):
+                with patch.object(os, "sendfile", side_effect=OSError(22, "EINVAL"), create=True):
+                    method = copy_file(self.src, dst)
+        self.assertEqual(method, "buffered")
+        self.assertEqual(open(dst, 'rb').read(), open(self.src, 'rb').read())
+
+    def test_copy_file__hardlink(self):
+        from infi.logs_collector.fastcopy import copy_file
+        dst = path.join(self.tempdir, "dst")
+        self.assertEqual(copy_file(self.src, dst, hardlink=True), "hardlink")
+        self.assertEqual(stat(dst).st_ino, stat(self.src).st_ino)
+
+    def test_fifo_is_skipped(self):
+        from os import mkfifo
+        from shutil import SpecialFileError
+        from infi.logs_collector.fastcopy import copy_file
+        from infi.logs_collector.redaction import Redactor
+        from infi.logs_collector.offset_index import copy_byte_range
+        srcdir = path.join(self.tempdir, "logs")
+        makedirs(srcdir)
+        fifo = path.join(srcdir, "pipe.log")
+        mkfifo(fifo)
+        with open(path.join(srcdir, "app.log"), 'wb') as fd:
+            fd.write(b'x' * 100)
+        dst = path.join(self.tempdir, "dst")
+        for copy in (lambda: copy_file(fifo, dst), lambda: Redactor().redact_file(fifo, dst),
+                     lambda: copy_byte_range(fifo, dst, 0, 10)):
+            with self.assertRaises(SpecialFileError):
+                copy()
+        item = collectables.Directory(srcdir, ".*log", timeframe_only=False)
+        end_result, archive_path = logs_collector.run("test", [item], datetime.now(), timedelta(hours=1),
+                                                      output_path=self.tempdir, silent=True)
+        self.assertEqual(end_result, 0)
+        self.assertEqual(item.collected_bytes, 100)
+
+    def test_is_rotated_log(self):
+        from infi.logs_collector.fastcopy import is_rotated_log
+        self.assertTrue(is_rotated_log("messages.1"))
+        self.assertTrue(is_rotated_log("syslog.2.gz"))
+        self.assertTrue(is_rotated_log("messages-20260101"))
+        self.assertFalse(is_rotated_log("messages"))
+
+
+class SparseFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        from infi.logs_collector.fastcopy import is_sparse
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.srcdir = path.join(self.tempdir, "src")
+        makedirs(self.srcdir)
+        self.src = path.join(self.srcdir, "core")
+        with open(self.src, 'wb') as fd:
+            fd.truncate(64 * 1024 * 1024)
+            fd.seek(1024 * 1024)
+            fd.write(b'a' * 8192)
+            fd.seek(40 * 1024 * 1024)
+            fd.write(b'b' * 8192)
+        if not is_sparse(stat(self.src)):
+            raise SkipTest("filesystem does not support sparse files")
+        with open(self.src, 'rb') as fd:
+            self.content = fd.read()
+
+    def test_copy_file_keeps_holes(self):
+        from infi.logs_collector.fastcopy import copy_file, is_sparse
+        dst = path.join(self.tempdir, "dst")
+        with patch("infi.logs_collector.fastcopy._try_reflink", return_value=False):
+            self.assertEqual(copy_file(self.src, dst), "sparse")
+        self.assertTrue(is_sparse(stat(dst)))
+        self.assertEqual(open(dst, 'rb').read(), self.content)
+
+    def test_archive_stores_sparse_member(self):
+        archive_path = path.join(self.tempdir, "archive.tar.gz")
+        with logs_collector.open_archive(archive_path) as archive:
+            logs_collector.add_directory(archive, self.srcdir)
+        archive = TarFile.open(archive_path, "r:gz")
+        member = archive.getmember("src/core")
+        self.assertTrue(member.issparse())
+        self.assertEqual(member.size, len(self.content))
+        self.assertEqual(archive.extractfile(member).read(), self.content)
+
+    def test_workaround_issue_10760_does_not_fill_holes(self):
+        from infi.logs_collector.fastcopy import is_sparse
+        logs_collector.workaround_issue_10760(self.srcdir)
+        self.assertTrue(is_sparse(stat(self.src)))
+        self.assertEqual(stat(self.src).st_size, len(self.content))
+
+
+class RedactionTestCase(unittest.TestCase):
+    def test_redact(self):
+        from infi.logs_collector.redaction import Redactor
+        redactor = Redactor(redact_hostname=False)
+        self.assertEqual(redactor.redact(b"from 10.0.0.1 password=hunter2, ok"),
+                         b"from <redacted> password=<redacted>, ok")
+
+    def test_redact_stream_does_not_split_lines(self):
+        from infi.logs_collector import redaction
+        from io import BytesIO
+        redactor = redaction.Redactor(redact_hostname=False)
+        line = b"connection from 192.168.100.200 closed\n"
+        data = line * (2 * redaction.CHUNK_SIZE // len(line) + 1)
+        dst = BytesIO()
+        self.assertEqual(redactor.redact_stream(BytesIO(data), dst), len(data))
+        self.assertEqual(dst.getvalue(), data.replace(b"192.168.100.200", b"<redacted>"))
+
+    def test_mask_environment(self):
+        from infi.logs_collector.redaction import Redactor
+        masked = Redactor(redact_hostname=False).mask_environment(dict(DB_PASSWORD="x", HOME="/root"))
+        self.assertEqual(masked, dict(DB_PASSWORD="<redacted>", HOME="/root"))
+
+    def test_run_with_redactor(self):
+        from infi.logs_collector.redaction import Redactor
+        from shutil import rmtree
+        tempdir = mkdtemp()
+        self.addCleanup(rmtree, tempdir, ignore_errors=True)
+        fd, src = mkstemp(dir=tempdir)
+        write(fd, b"token=s3cr3t\n")
+        close(fd)
+        items = [collectables.File(src), collectables.Command("echo", ["10.1.2.3"]), collectables.Environment()]
+        with patch.dict("os.environ", dict(MY_SECRET="hunter2")):
+            result, archive_path = logs_collector.run("test", items, datetime.now(), None, output_path=tempdir,
+                                                      redactor=Redactor())
+        archive = TarFile.open(archive_path, "r:gz")
+        # the secrets are not hexadecimal, so they cannot show up in the checksums manifest by chance
+        contents = b''.join(archive.extractfile(member).read() for member in archive.getmembers() if member.isfile()
+                            and "collection-logs" not in member.name)
+        for secret in (b"s3cr3t", b"10.1.2.3", b"hunter2"):
+            self.assertNotIn(secret, contents)
+
+    def test_nothing_is_written_unredacted(self):
+        from infi.logs_collector.redaction import Redactor
+        from infi.logs_collector.sampling import Sampler
+        from shutil import rmtree
+        from time import time
+        tempdir = mkdtemp()
+        self.addCleanup(rmtree, tempdir, ignore_errors=True)
+        fd, src = mkstemp(dir=tempdir)
+        write(fd, b"token=s3cr3t\n")
+        close(fd)
+        sampler = Sampler([collectables.Command("echo", ["sampled", "10.1.2.3"])], path.join(tempdir, "ring"))
+        sampler.sample_once(time() - 60)
+        items = [collectables.File(src), collectables.Command("echo", ["10.1.2.3"]), collectables.Hostname()]
+        with patch("socket.gethostname", return_value="secret-host"):
+            result, archive_path = logs_collector.run("test", items, datetime.now(), timedelta(hours=1),
+                                                      output_path=tempdir, samples_dir=sampler.ring.ring_dir,
+                                                      redactor=Redactor())
+        archive = TarFile.open(archive_path, "r:gz")
+        members = archive.getmembers()
+        self.assertTrue([member for member in members if "/samples/" in member.name])
+        self.assertTrue([member for member in members if "/collection-logs/" in member.name and member.isfile()])
+        contents = b''.join(archive.extractfile(member).read() for member in members if member.isfile())
+        names = '\n'.join(member.name for member in members).encode()
+        for secret in (b"s3cr3t", b"10.1.2.3", b"secret-host"):
+            self.assertNotIn(secret, contents)
+            self.assertNotIn(secret, names)
+
+    def test_measure_throughput(self):
+        from infi.logs_collector.redaction import measure_throughput
+        self.assertGreater(measure_throughput(1), 0)
+
+
+class ChecksumsTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+
+    def _collect(self):
+        fd, src = mkstemp(dir=self.tempdir)
+        write(fd, b'some log line\n' * 1000)
+        close(fd)
+        items = [collectables.File(src), collectables.Command("echo", ["hello"])]
+        result, archive_path = logs_collector.run("test", items, datetime.now(), None, output_path=self.tempdir)
+        return archive_path
+
+    def test_manifest_is_the_last_member(self):
+        from infi.logs_collector.checksums import parse_manifest
+        archive = TarFile.open(self._collect(), "r:gz")
+        members = archive.getmembers()
+        self.assertEqual(members[-1].name, "logs/checksums")
+        algorithm, checksums = parse_manifest(archive.extractfile(members[-1]).read())
+        self.assertEqual(sorted(checksums), sorted(member.name for member in members[:-1] if member.isfile()))
+
+    def test_verify_archive(self):
+        from infi.logs_collector.checksums import verify_archive
+        self.assertEqual(verify_archive(self._collect()), [])
+
+    def _create_archive(self, manifest, size):
+        from io import BytesIO
+        from tarfile import TarInfo
+        archive_path = path.join(self.tempdir, "test.tar.gz")
+        with TarFile.open(archive_path, "w:gz") as archive:
+            for name, data in (("logs/host/big.log", b'\0' * size), ("logs/checksums", manifest)):
+                info = TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, BytesIO(data))
+        return archive_path
+
+    def test_verify_archive_with_unsupported_algorithm(self):
+        import sys
+        from infi.logs_collector.checksums import verify_archive, main
+        archive_path = self._create_archive(b"# algorithm: xxh3_128\n", 32 * 1024 * 1024)
+        with patch.dict(sys.modules, {"xxhash": None}):
+            with self.assertRaisesRegex(ValueError, "Unsupported algorithm"):
+                verify_archive(archive_path)
+            self.assertEqual(main(["verify", archive_path]), 1)
+
+    def test_verify_archive_stops_when_hashing_fails(self):
+        from infi.logs_collector.checksums import verify_archive, ContentHasher
+        archive_path = self._create_archive(b"# algorithm: blake2b\n", 32 * 1024 * 1024)
+        with patch.object(ContentHasher, "update", side_effect=RuntimeError("hashing failed")):
+            with self.assertRaisesRegex(RuntimeError, "hashing failed"):
+                verify_archive(archive_path, "blake2b")
+
+    def test_verify_directory_detects_corruption(self):
+        from infi.logs_collector.checksums import verify_directory
+        archive_path = self._collect()
+        extracted = path.join(self.tempdir, "extracted")
+        TarFile.open(archive_path, "r:gz").extractall(extracted)
+        manifest = path.join(extracted, "logs", "checksums")
+        self.assertEqual(verify_directory(extracted, manifest), [])
+        [command_output] = glob(path.join(extracted, "logs", "*", "*", "commands", "echo*"))
+        with open(command_output, 'ab') as fd:
+            fd.write(b'corrupted')
+        [(name, problem)] = verify_directory(extracted, manifest)
+        self.assertEqual(problem, "checksum mismatch")
+
+
+class PlanningTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.srcdir = path.join(self.tempdir, "src")
+        makedirs(path.join(self.srcdir, "sub"))
+        for filename in ["a.log", "b.log", path.join("sub", "c.log")]:
+            with open(path.join(self.srcdir, filename), 'wb') as fd:
+                fd.write(b'x' * 100)
+
+    def _get_items(self):
+        return [collectables.Directory(self.srcdir, ".*log", timeframe_only=False),
+                collectables.Directory(self.srcdir, "a.*", recursive=True, timeframe_only=False),
+                collectables.Command("echo", ["hello"])]
+
+    def test_make_plan_finds_duplicates(self):
+        from infi.logs_collector.planning import make_plan, format_plan
+        items = self._get_items()
+        plan = make_plan(items, datetime.now(), timedelta(hours=1))
+        self.assertEqual(plan.get_total_size(), 200)
+        self.assertEqual([(filepath, first, second) for filepath, first, second in plan.get_duplicates()],
+                         [(path.realpath(path.join(self.srcdir, "a.log")), items[0], items[1])])
+        self.assertIn("Total: 200.0 B", format_plan(plan))
+
+    def test_estimates_from_history(self):
+        from infi.logs_collector.planning import make_plan
+        history_path = path.join(self.tempdir, "history")
+        items = self._get_items()
+        logs_collector.run("test", items, datetime.now(), timedelta(hours=1), output_path=self.tempdir,
+                           metrics_history_path=history_path)
+        plan = make_plan(items, datetime.now(), timedelta(hours=1), history_path)
+        self.assertIsNotNone(plan.get_estimated_seconds())
+
+    def test_run_collects_duplicates_once(self):
+        items = self._get_items()
+        logs_collector.run("test", items, datetime.now(), timedelta(hours=1), output_path=self.tempdir)
+        self.assertEqual(items[0].collected_bytes, 200)
+        self.assertEqual(items[1].collected_bytes, 0)
+
+    def test_duplicates_are_decided_when_collected(self):
+        from infi.logs_collector.planning import make_plan
+        items = self._get_items()
+        plan = make_plan(items, datetime.now(), timedelta(hours=1))
+        real_collect_logfile = collectables.Directory.collect_logfile
+
+        def collect_logfile(src_directory, filename, *args, **kwargs):
+            if filename == "a.log" and not failed:
+                failed.append(filename)
+                return 0
+            return real_collect_logfile(src_directory, filename, *args, **kwargs)
+        failed = []
+        with patch.object(collectables.Directory, "collect_logfile", side_effect=collect_logfile):
+            logs_collector.run("test", items, datetime.now(), timedelta(hours=1), output_path=self.tempdir, plan=plan)
+        # the first item failed to copy a.log, which the plan assigned to it, so the second item collects it
+        self.assertEqual(items[0].collected_bytes, 100)
+        self.assertEqual(items[1].collected_bytes, 100)
+
+    def test_dry_run(self):
+        with patch("infi.logs_collector.run") as run:
+            self.assertEqual(scripts.main(["--items", "get_generic_os_items", "--dry-run"]), 0)
+        self.assertFalse(run.called)
+
+    def test_main_plans_only_when_needed(self):
+        with patch("infi.logs_collector.run", return_value=(0, None)) as run, \
+                patch("infi.logs_collector.planning.make_plan") as make_plan:
+            scripts.main(["--items", "get_generic_os_items"])
+            self.assertFalse(make_plan.called)
+            self.assertIsNone(run.call_args[1]["plan"])
+            scripts.main(["--items", "get_generic_os_items", "--deadline", "60"])
+            self.assertTrue(make_plan.called)
+            self.assertIs(run.call_args[1]["plan"], make_plan.return_value)
+
+    def test_resumed_collection_is_planned_with_its_timeframe(self):
+        from infi.logs_collector.checkpoint import Checkpoint
+        work_dir = path.join(self.tempdir, "work")
+        started = datetime(2026, 10, 1, 12, 0)
+        Checkpoint(work_dir, "collection", started, timedelta(hours=2)).close()
+        with patch("infi.logs_collector.run", return_value=(0, None)), \
+                patch("infi.logs_collector.planning.make_plan") as make_plan:
+            scripts.main(["--items", "get_generic_os_items", "--deadline", "60", "--work-dir", work_dir, "--resume"])
+        self.assertEqual(make_plan.call_args[0][1:3], (started, timedelta(hours=2)))
+
+
+class ScanCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        from os import utime
+        from time import time
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.srcdir = path.join(self.tempdir, "src")
+        makedirs(path.join(self.srcdir, "sub"))
+        for filename in ["a.log", "b.log", path.join("sub", "c.log")]:
+            with open(path.join(self.srcdir, filename), 'wb') as fd:
+                fd.write(b'x' * 100)
+        self._age(self.srcdir, path.join(self.srcdir, "sub"))
+
+    def _age(self, *dirpaths):
+        from os import utime
+        from time import time
+        for dirpath in dirpaths:
+            utime(dirpath, (time() - 60, time() - 60))
+
+    def _get_scan_cache(self, **kwargs):
+        from infi.logs_collector.scan_cache import ScanCache
+        scan_cache = ScanCache(path.join(self.tempdir, "scan_cache.db"), **kwargs)
+        self.addCleanup(scan_cache.close)
+        return scan_cache
+
+    def test_unchanged_directory_is_answered_from_the_cache(self):
+        scan_cache = self._get_scan_cache()
+        first = list(scan_cache.walk(self.srcdir))
+        self.assertEqual((scan_cache.hits, scan_cache.misses), (0, 2))
+        second = list(scan_cache.walk(self.srcdir))
+        self.assertEqual((scan_cache.hits, scan_cache.misses), (2, 2))
+        self.assertEqual(first, second)
+        self.assertEqual(second[0][1:3], (["sub"], ["a.log", "b.log"]))
+
+    def test_new_file_invalidates_the_directory(self):
+        scan_cache = self._get_scan_cache()
+        list(scan_cache.walk(self.srcdir))
+        with open(path.join(self.srcdir, "d.log"), 'wb') as fd:
+            fd.write(b'x')
+        self._age(self.srcdir)
+        self.assertEqual(list(scan_cache.walk(self.srcdir))[0][2], ["a.log", "b.log", "d.log"])
+        self.assertEqual((scan_cache.hits, scan_cache.misses), (1, 3))
+
+    def test_appending_to_an_old_file_is_seen(self):
+        from os import utime
+        from time import time
+        scan_cache = self._get_scan_cache(trust_age_seconds=60)
+        old = time() - 2 * 24 * 60 * 60
+        for filename in ("a.log", "b.log"):
+            utime(path.join(self.srcdir, filename), (old, old))
+        list(scan_cache.walk(self.srcdir, recursive=False))
+        with open(path.join(self.srcdir, "a.log"), 'ab') as fd:
+            fd.write(b'y' * 10)
+        [(dirpath, dirnames, filenames, files)] = list(scan_cache.walk(self.srcdir, recursive=False))
+        self.assertEqual(scan_cache.hits, 1)
+        self.assertEqual(files["a.log"][0], 110)
+        self.assertGreater(files["a.log"][1], time() - 60)
+
+    def test_cache_is_trimmed_to_max_entries(self):
+        scan_cache = self._get_scan_cache(max_entries=1)
+        list(scan_cache.walk(self.srcdir, recursive=False))
+        list(scan_cache.walk(path.join(self.srcdir, "sub")))
+        scan_cache.commit()
+        list(scan_cache.walk(self.srcdir))
+        self.assertEqual((scan_cache.hits, scan_cache.misses), (1, 3))
+
+    def test_run_with_scan_cache(self):
+        from infi.logs_collector.scan_cache import get_active_scan_cache
+        scan_cache = self._get_scan_cache()
+        item = collectables.Directory(self.srcdir, ".*log", recursive=True)
+        for expected_hits in (0, 2):
+            logs_collector.run("test", [item], datetime.now(), timedelta(hours=1), output_path=self.tempdir,
+                               scan_cache=scan_cache)
+            self.assertEqual(item.collected_bytes, 300)
+            self.assertEqual(scan_cache.hits, expected_hits)
+        self.assertIsNone(get_active_scan_cache())
+
+
+class IncidentsTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        from os import utime
+        from time import mktime
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.srcdir = path.join(self.tempdir, "src")
+        makedirs(self.srcdir)
+        self.first, self.second = datetime(2026, 10, 1, 12), datetime(2026, 10, 5, 12)
+        for filename, timestamp in [("first.log", self.first), ("second.log", self.second),
+                                    ("both.log", self.first), ("neither.log", datetime(2026, 9, 1))]:
+            with open(path.join(self.srcdir, filename), 'wb') as fd:
+                fd.write(b'x' * 100)
+            mtime = mktime(timestamp.timetuple())
+            utime(path.join(self.srcdir, filename), (mtime, mtime))
+        self.items = [collectables.Directory(self.srcdir, ".*log"),
+                      collectables.Directory(self.srcdir, "both.log", timeframe_only=False),
+                      collectables.Command("echo", ["hello"])]
+        self.windows = [(self.first, timedelta(hours=1)), (self.second, timedelta(hours=1))]
+
+    def _get_members(self, archive_path, kind=None):
+        with TarFile.open(archive_path) as archive:
+            return set(path.basename(member.name) for member in archive.getmembers()
+                       if (member.isfile() if kind is None else member.type == kind))
+
+    def test_archive_per_window(self):
+        results = logs_collector.run("test", self.items, self.first, timedelta(hours=1), output_path=self.tempdir,
+                                     windows=[(self.second, timedelta(hours=1))])
+        self.assertEqual([end_result for end_result, archive_path in results], [0, 0])
+        first, second = [self._get_members(archive_path) for end_result, archive_path in results]
+        self.assertIn("first.log", first)
+        self.assertNotIn("second.log", first)
+        self.assertEqual(set(["second.log", "both.log"]), set(["second.log", "both.log"]) & second)
+        self.assertNotIn("first.log", second)
+        for members in (first, second):
+            self.assertNotIn("neither.log", members)
+            self.assertTrue([member for member in members if member.startswith("echo.")])
+
+    def test_command_runs_once(self):
+        from infi.logs_collector.incidents import run_windows
+        with patch.object(collectables.Command, "_execute", wraps=self.items[2]._execute) as execute:
+            run_windows("test", self.items, self.windows, output_path=self.tempdir, silent=True)
+        self.assertEqual(execute.call_count, 1)
+
+    def test_single_archive_links_shared_members(self):
+        from tarfile import LNKTYPE
+        from infi.logs_collector.incidents import run_windows
+        [(end_result, archive_path)] = run_windows("test", self.items, self.windows, output_path=self.tempdir,
+                                                   silent=True, single_archive=True)
+        self.assertEqual(end_result, 0)
+        with TarFile.open(archive_path) as archive:
+            names = archive.getnames()
+        self.assertEqual(len([name for name in names if name.endswith(path.join(self.srcdir, "both.log"))]), 2)
+        self.assertIn("both.log", self._get_members(archive_path, LNKTYPE))
+
+    def test_bucket_throttles_archiving(self):
+        from infi.logs_collector.incidents import run_windows
+        from infi.logs_collector.throttling import ResourceLimits, TokenBucket
+        bucket = TokenBucket(1024 * 1024 * 1024)
+        size = path.getsize(path.join(self.srcdir, "both.log"))
+        items = [collectables.Directory(self.srcdir, "both.log", timeframe_only=False)]
+        with patch.object(ResourceLimits, "get_bucket", return_value=bucket):
+            run_windows("test", items, self.windows, output_path=self.tempdir, silent=True, single_archive=True,
+                        resource_limits=ResourceLimits(bytes_per_second=1024 * 1024 * 1024))
+        # copied aside, and then archived with the command outputs and the collection logs
+        self.assertGreater(bucket.consumed_bytes, 2 * size)
+
+    def test_host_directory_is_redacted(self):
+        from infi.logs_collector.incidents import run_windows
+        from infi.logs_collector.redaction import Redactor
+        with patch("socket.gethostname", return_value="secret-host"):
+            [(end_result, archive_path)] = run_windows("test", self.items, self.windows, output_path=self.tempdir,
+                                                       silent=True, single_archive=True, redactor=Redactor())
+        with TarFile.open(archive_path) as archive:
+            names = archive.getnames()
+        self.assertFalse([name for name in names if "secret-host" in name])
+
+
+class CheckpointTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.srcdir = path.join(self.tempdir, "src")
+        self.work_dir = path.join(self.tempdir, "work")
+        makedirs(self.srcdir)
+        for filename in ["a.log", "b.log"]:
+            with open(path.join(self.srcdir, filename), 'wb') as fd:
+                fd.write(b'x' * 100)
+        self.items = [collectables.Directory(self.srcdir, ".*log"), collectables.Command("echo", ["hello"])]
+
+    def _interrupted_run(self, timestamp):
+        real_collect = logs_collector.collect
+
+        def collect(item, *args, **kwargs):
+            if isinstance(item, collectables.Command):
+                raise RuntimeError("interrupted")
+            return real_collect(item, *args, **kwargs)
+
+        with patch("infi.logs_collector.collect", side_effect=collect):
+            with self.assertRaises(RuntimeError):
+                logs_collector.run("test", self.items, timestamp, timedelta(hours=1), output_path=self.tempdir,
+                                   silent=True, work_dir=self.work_dir)
+
+    def test_interrupted_collection_keeps_its_tree(self):
+        self._interrupted_run(datetime.now())
+        self.assertTrue(path.exists(path.join(self.work_dir, "journal")))
+        self.assertTrue(glob(path.join(self.work_dir, "tree", "logs", "*", "*", "files", "*", "*", "*", "a.log")))
+
+    def test_resume_skips_finished_items_and_uses_the_original_timeframe(self):
+        from infi.logs_collector.util import STRFTIME_SHORT
+        timestamp = datetime.now() - timedelta(minutes=5)
+        self._interrupted_run(timestamp)
+        with patch("infi.logs_collector.fastcopy.copy_file") as copy_file:
+            end_result, archive_path = logs_collector.run("test", self.items, datetime.now(), timedelta(hours=2),
+                                                          output_path=self.tempdir, silent=True,
+                                                          work_dir=self.work_dir, resume=True)
+        self.assertEqual(end_result, 0)
+        self.assertFalse(copy_file.called)
+        with TarFile.open(archive_path) as archive:
+            names = archive.getnames()
+        self.assertTrue([name for name in names if name.endswith("a.log")])
+        self.assertTrue([name for name in names if "/commands/echo" in name])
+        self.assertTrue([name for name in names if timestamp.strftime(STRFTIME_SHORT) in name])
+        self.assertEqual(listdir(self.work_dir), [])
+
+    def test_files_are_skipped_only_if_their_copy_is_intact(self):
+        from infi.logs_collector.checkpoint import Checkpoint
+        checkpoint = Checkpoint(self.work_dir, "test", datetime.now(), timedelta(hours=1))
+        dst = path.join(self.tempdir, "copy")
+        with open(dst, 'wb') as fd:
+            fd.write(b'x' * 50)
+        checkpoint.file_done("/src", 100)
+        checkpoint.close()
+        checkpoint = Checkpoint(self.work_dir, "test", datetime.now(), timedelta(hours=1), resume=True)
+        self.addCleanup(checkpoint.close)
+        self.assertFalse(checkpoint.is_file_done("/src", dst))
+        with open(dst, 'ab') as fd:
+            fd.write(b'x' * 50)
+        self.assertTrue(checkpoint.is_file_done("/src", dst))
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        from os import chmod
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.journalctl = path.join(self.tempdir, "journalctl")
+        with open(self.journalctl, 'w') as fd:
+            fd.write('#!/bin/sh\nfor arg in "$@"; do echo "$arg"; done\necho "MESSAGE=password=hunter2"\n')
+        chmod(self.journalctl, 0o755)
+        self.targetdir = path.join(self.tempdir, "target")
+        makedirs(self.targetdir)
+
+    def _collect(self, item):
+        item.collect(self.targetdir, datetime(2026, 10, 19, 12), timedelta(hours=1))
+        with open(path.join(self.targetdir, "journal", "journal.export"), 'rb') as fd:
+            return fd.read().decode().splitlines()
+
+    def test_timeframe_and_filters(self):
+        from infi.logs_collector.collectables.linux import Journal
+        lines = self._collect(Journal(units=["sshd", "cron"], journal_priority="warning", executable=self.journalctl))
+        self.assertEqual(lines[:8], ["--no-pager", "--output", "export", "--since", "2026-10-19 11:00:00",
+                                     "--until", "2026-10-19 12:00:00", "--unit"])
+        self.assertEqual(lines[8:13], ["sshd", "--unit", "cron", "--priority", "warning"])
+
+    def test_redacted_while_streamed(self):
+        from infi.logs_collector.collectables.linux import Journal
+        from infi.logs_collector.redaction import Redactor, redaction
+        # the export format is parsed when it is redacted, so the arguments are not echoed as if they were fields
+        with open(self.journalctl, 'w') as fd:
+            fd.write('#!/bin/sh\necho "MESSAGE=password=hunter2"\n')
+        with redaction(Redactor()):
+            lines = self._collect(Journal(executable=self.journalctl))
+        self.assertEqual(lines, ["MESSAGE=password=<redacted>"])
+
+    def test_binary_fields_are_not_redacted(self):
+        from struct import pack
+        from infi.logs_collector.collectables.linux import Journal
+        from infi.logs_collector.redaction import Redactor, redaction
+        binary = b"token=abc\n10.0.0.1\x00"
+        entry = b"MESSAGE=token=abc\nDATA\n" + pack('<Q', len(binary)) + binary + b"\nPRIORITY=3\n\n"
+        with open(path.join(self.tempdir, "entry"), 'wb') as fd:
+            fd.write(entry * 2)
+        with open(self.journalctl, 'w') as fd:
+            fd.write('#!/bin/sh\ncat {}\n'.format(path.join(self.tempdir, "entry")))
+        with redaction(Redactor()):
+            Journal(executable=self.journalctl).collect(self.targetdir, datetime.now(), timedelta(hours=1))
+        with open(path.join(self.targetdir, "journal", "journal.export"), 'rb') as fd:
+            data = fd.read()
+        self.assertEqual(data, entry.replace(b"MESSAGE=token=abc", b"MESSAGE=token=<redacted>") * 2)
+
+    def test_missing_journalctl_is_skipped(self):
+        from infi.logs_collector.collectables.linux import Journal
+        Journal(executable="no-such-journalctl").collect(self.targetdir, datetime.now(), timedelta(hours=1))
+        self.assertFalse(path.exists(path.join(self.targetdir, "journal")))
+
+
+class UploadTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        from os import urandom
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.srcdir = path.join(self.tempdir, "src")
+        makedirs(self.srcdir)
+        self.data = urandom(256 * 1024)
+        with open(path.join(self.srcdir, "a.log"), 'wb') as fd:
+            fd.write(self.data)
+
+    def _start_server(self, failures=1):
+        from threading import Thread
+        from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        uploads = {}
+        state = dict(failures=failures)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_PUT(self):
+                content_range = self.headers["Content-Range"][len("bytes "):]
+                data = self.rfile.read(int(self.headers["Content-Length"]))
+                if state["failures"]:
+                    state["failures"] -= 1
+                    self.send_response(503)
+                elif content_range.startswith("*/"):
+                    uploads[self.path] = bytes(uploads.get(self.path, b''))[:int(content_range[2:])]
+                    self.send_response(201)
+                else:
+                    offset = int(content_range.split('-')[0])
+                    buffer = uploads.setdefault(self.path, bytearray())
+                    buffer[offset:offset + len(data)] = data
+                    self.send_response(308)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        Thread(target=server.serve_forever).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return "http://127.0.0.1:{}/uploads".format(server.server_address[1]), uploads
+
+    def test_run_uploads_while_collecting(self):
+        from io import BytesIO
+        from infi.logs_collector.upload import Upload, HTTPSink
+        url, uploads = self._start_server()
+        upload = Upload(HTTPSink(url), chunk_size=16 * 1024, max_memory_bytes=32 * 1024, retry_delay=0)
+        items = [collectables.Directory(self.srcdir, ".*log"), collectables.Command("echo", ["hello"])]
+        end_result, location = logs_collector.run("test", items, datetime.now(), timedelta(hours=1),
+                                                  output_path=self.tempdir, upload=upload)
+        self.assertEqual(end_result, 0)
+        self.assertFalse(glob(path.join(self.tempdir, "*.tar.gz")))
+        [(upload_path, data)] = uploads.items()
+        self.assertTrue(location.endswith(upload_path))
+        with TarFile.open(fileobj=BytesIO(data)) as archive:
+            names = archive.getnames()
+            [member] = [name for name in names if name.endswith("a.log")]
+            self.assertEqual(archive.extractfile(member).read(), self.data)
+        self.assertTrue([name for name in names if "/commands/echo" in name])
+        self.assertTrue([name for name in names if name.endswith(".debug.log")])
+        self.assertTrue(names[-1].endswith("/checksums"))
+
+    def test_query_string_is_kept(self):
+        from infi.logs_collector.upload import HTTPSink
+        url, uploads = self._start_server(failures=0)
+        sink = HTTPSink(url + "/?signature=abc&expires=1")
+        self.addCleanup(sink.close)
+        self.assertEqual(sink.get_location("a.tar.gz"), url + "/a.tar.gz?signature=abc&expires=1")
+        sink.send("a.tar.gz", 0, b"data")
+        sink.finish("a.tar.gz", 4)
+        self.assertEqual(uploads, {"/uploads/a.tar.gz?signature=abc&expires=1": b"data"})
+
+    def test_spool_spills_to_disk_in_order(self):
+        from infi.logs_collector.upload import Spool
+        spool = Spool(max_memory_bytes=10, max_bytes=100, spool_dir=self.tempdir)
+        for offset in range(0, 40, 8):
+            spool.put(offset, b'x' * 8)
+        spool.close()
+        offsets = []
+        for chunk in iter(spool.peek, None):
+            offsets.append(chunk[0])
+            self.assertEqual(chunk[1], b'x' * 8)
+            spool.pop()
+        spool.dispose()
+        self.assertEqual(offsets, [0, 8, 16, 24, 32])
+
+    def test_ftp_sink_sends_chunks_at_their_offsets(self):
+        from infi.logs_collector.upload import FTPSink
+        with patch("ftplib.FTP") as FTP:
+            sink = FTPSink("ftp.example.com", directory="incoming")
+            sink.send("archive.tar.gz", 0, b'abc')
+            sink.send("archive.tar.gz", 3, b'def')
+            sink.close()
+        ftp = FTP.return_value
+        ftp.cwd.assert_called_once_with("incoming")
+        self.assertEqual([(call[0][0], call[1]["rest"]) for call in ftp.transfercmd.call_args_list],
+                         [("STOR archive.tar.gz", None), ("STOR archive.tar.gz", 3)])
+
+
+class RecordingItem(collectables.Item):
+    def __init__(self, name, collected, priority=0, expected_seconds=None):
+        super(RecordingItem, self).__init__()
+        self.name = name
+        self.collected = collected
+        self.priority = priority
+        self.expected_seconds = expected_seconds
+
+    def __repr__(self):
+        return "<RecordingItem({})>".format(self.name)
+
+    def collect(self, targetdir, timestamp, delta):
+        self.collected.append(self.name)
+
+
+class SchedulingTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+
+    def _run(self, items, deadline_seconds):
+        from json import loads
+        end_result, archive_path = logs_collector.run("test", items, datetime.now(), timedelta(hours=1),
+                                                      output_path=self.tempdir, silent=True,
+                                                      deadline_seconds=deadline_seconds)
+        with TarFile.open(archive_path) as archive:
+            [member] = [member for member in archive.getmembers() if member.name.endswith("metrics.json")]
+            return loads(archive.extractfile(member).read().decode())
+
+    def test_items_are_ordered_by_priority_and_sacrificed(self):
+        from infi.logs_collector.scheduling import PRIORITY_LOW, PRIORITY_HIGH, PRIORITY_CRITICAL
+        collected = []
+        items = [RecordingItem("low", collected, PRIORITY_LOW, expected_seconds=100),
+                 RecordingItem("normal", collected, expected_seconds=0.1),
+                 RecordingItem("critical", collected, PRIORITY_CRITICAL, expected_seconds=100),
+                 RecordingItem("high", collected, PRIORITY_HIGH, expected_seconds=0.1)]
+        metrics = self._run(items, deadline_seconds=10)
+        self.assertEqual(collected, ["critical", "high", "normal"])
+        [sacrificed] = metrics["schedule"]["sacrificed"]
+        self.assertEqual(sacrificed["item"], "<RecordingItem(low)>")
+
+    def test_timeouts_are_shrunk_to_the_deadline(self):
+        from time import time
+        item = collectables.Command("sleep", ["10"], wait_time_in_seconds=60)
+        started = time()
+        self._run([item], deadline_seconds=2)
+        self.assertLess(time() - started, 6)
+        self.assertEqual(item.wait_time_in_seconds, 60)
+
+    def test_critical_items_are_collected_after_the_deadline(self):
+        from infi.logs_collector.scheduling import Scheduler, PRIORITY_CRITICAL
+        collected = []
+        scheduler = Scheduler(deadline_seconds=10)
+        critical, normal = RecordingItem("critical", collected, PRIORITY_CRITICAL), RecordingItem("normal", collected)
+        with patch.object(scheduler, "get_remaining_seconds", return_value=-1):
+            self.assertTrue(scheduler.should_collect(critical))
+            self.assertFalse(scheduler.should_collect(normal))
+        self.assertEqual([entry["item"] for entry in scheduler.sacrificed], ["<RecordingItem(normal)>"])
+
+    def test_linux_items_are_ordered_with_a_deadline(self):
+        from infi.logs_collector.items import linux
+        from infi.logs_collector.scheduling import Scheduler
+        from infi.logs_collector.collectables.linux import Journal
+        items = linux() + [Journal(journal_priority="warning")]
+        self.assertEqual(sorted(map(id, Scheduler(deadline_seconds=60).order(items))), sorted(map(id, items)))
+
+    def test_no_deadline_keeps_the_order(self):
+        from infi.logs_collector.scheduling import PRIORITY_HIGH
+        collected = []
+        items = [RecordingItem("first", collected), RecordingItem("second", collected, PRIORITY_HIGH)]
+        metrics = self._run(items, deadline_seconds=None)
+        self.assertEqual(collected, ["first", "second"])
+        self.assertIsNone(metrics["schedule"])
+
+
+class MountsTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.srcdir = path.join(self.tempdir, "src")
+        self.dead = path.join(self.srcdir, "nfs")
+        makedirs(self.dead)
+        for filepath in [path.join(self.srcdir, "a.log"), path.join(self.dead, "b.log")]:
+            with open(filepath, 'wb') as fd:
+                fd.write(b'x' * 100)
+
+    def _get_mount_health(self, dead=None, **kwargs):
+        from infi.logs_collector.mounts import MountHealth
+        from threading import Event
+        dead = [self.dead] if dead is None else dead
+        mount_health = MountHealth(timeout_seconds=0.5, mounts=kwargs.pop("mounts", ["/"] + dead), **kwargs)
+        real_statvfs = __import__("os").statvfs
+        released = Event()
+        self.statvfs_calls = []
+
+        def statvfs(mountpoint):
+            self.statvfs_calls.append(mountpoint)
+            if mountpoint in dead:
+                released.wait(10)
+            return real_statvfs(mountpoint)
+
+        patcher = patch("os.statvfs", side_effect=statvfs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(released.set)
+        return mount_health
+
+    def test_get_mounts_unescapes_mount_points(self):
+        from infi.logs_collector.mounts import get_mounts
+        mounts_path = path.join(self.tempdir, "mounts")
+        with open(mounts_path, 'w') as fd:
+            fd.write("/dev/sda1 / ext4 rw 0 0\nserver:/share /mnt/my\\040share nfs rw 0 0\n")
+        self.assertEqual(get_mounts(mounts_path), ["/", "/mnt/my share"])
+
+    def test_dead_mount_is_probed_once(self):
+        from time import time
+        mount_health = self._get_mount_health()
+        started = time()
+        self.assertEqual(list(mount_health.get_dead_mounts(self.srcdir)), [self.dead])
+        self.assertIsNone(mount_health.get_problem(self.srcdir, recursive=False))
+        self.assertIsNotNone(mount_health.get_problem(path.join(self.dead, "b.log")))
+        self.assertLess(time() - started, 3)
+        self.assertEqual(self.statvfs_calls.count(self.dead), 1)
+
+    def test_probes_are_bounded_and_timed_from_their_start(self):
+        healthy = [path.join(self.srcdir, "healthy-{}".format(index)) for index in range(4)]
+        dead = [path.join(self.srcdir, "dead-{}".format(index)) for index in range(2)]
+        for dirpath in healthy + dead:
+            makedirs(dirpath)
+        from time import time
+        mount_health = self._get_mount_health(dead, mounts=dead + healthy, max_probes=2)
+        started = time()
+        # the healthy mounts are probed after the dead ones time out, later than timeout_seconds after the call
+        self.assertEqual(sorted(mount_health.get_dead_mounts()), dead)
+        self.assertGreaterEqual(time() - started, 0.5)
+        self.assertEqual(sorted(self.statvfs_calls[:2]), dead)
+        self.assertEqual(sorted(self.statvfs_calls[2:]), healthy)
+
+    def test_run_prunes_and_narrows_items(self):
+        mount_health = self._get_mount_health()
+        items = [collectables.Directory(self.srcdir, ".*log", recursive=True),
+                 collectables.Directory(self.dead, ".*log"),
+                 collectables.Command("echo", ["df"], all_mounts=True),
+                 collectables.Command("ls", ["-R", self.dead], paths=[self.dead])]
+        end_result, archive_path = logs_collector.run("test", items, datetime.now(), timedelta(hours=1),
+                                                      output_path=self.tempdir, mount_health=mount_health)
+        self.assertEqual(end_result, 0)
+        self.assertEqual(items[0].collected_bytes, 100)
+        self.assertEqual(items[1].collected_bytes, 0)
+        with TarFile.open(archive_path) as archive:
+            names = archive.getnames()
+            [echo] = [name for name in names if "/commands/echo" in name]
+            self.assertIn(b"df /\n", archive.extractfile(echo).read())
+        self.assertFalse([name for name in names if "/commands/ls" in name])
+
+
+class AnalysisTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.index_path = path.join(self.tempdir, "findings.db")
+
+    def _create_archive(self, host, timestamp, files):
+        from io import BytesIO
+        from tarfile import TarInfo
+        archive_path = path.join(self.tempdir, "{}.tar.gz".format(host))
+        with TarFile.open(archive_path, "w:gz") as archive:
+            for name, data in files.items():
+                info = TarInfo("logs/{}/{}/files/{}".format(host, timestamp, name))
+                info.size = len(data)
+                archive.addfile(info, BytesIO(data))
+        return archive_path
+
+    def _create_archives(self):
+        messages = (b"Oct 18 10:00:00 node-1 kernel: eth0 up\n" +
+                    b"Oct 18 10:00:01 node-1 kernel: Out of memory: Killed process 1234 (java)\n" +
+                    b"Oct 18 10:00:02 node-1 kernel: Kernel panic - not syncing: Fatal exception\n")
+        app = b"2026-10-18 11:00:00 starting\nTraceback (most recent call last):\n  File \"x.py\"\nKeyError: 1\n"
+        return [self._create_archive("node-1", "2026-10-19.09-00", {"var/log/messages": messages}),
+                self._create_archive("node-2", "2026-10-19.09-05", {"app.log": app, "checksums": b"Kernel panic"})]
+
+    def test_scan_member_across_chunks(self):
+        from io import BytesIO
+        from infi.logs_collector import analysis
+        data = b"ok\n" * 10 + b"invoked oom-killer: gfp_mask\n" + b"ok\n" * 10
+        with patch.object(analysis, "CHUNK_SIZE", 7):
+            findings = list(analysis._scan_member(BytesIO(data), analysis._get_pattern(), 2026))
+        self.assertEqual(findings, [("oom_kill", 11, None, "invoked oom-killer: gfp_mask")])
+
+    def test_index_and_query(self):
+        from time import mktime
+        from infi.logs_collector.analysis import analyze, Index
+        archives = self._create_archives()
+        self.assertEqual(analyze(archives, self.index_path, workers=2), 2)
+        self.assertEqual(analyze(archives, self.index_path, workers=2), 0)
+        index = Index(self.index_path)
+        self.addCleanup(index.close)
+        [oom] = index.query(signature="oom_kill")
+        self.assertEqual((oom["host"], oom["line_number"]), ("node-1", 2))
+        self.assertEqual(oom["time"], mktime(datetime(2026, 10, 18, 10, 0, 1).timetuple()))
+        [panic] = index.query(signature="kernel_panic")
+        self.assertEqual(panic["host"], "node-1")
+        [traceback] = index.query(signature="traceback", host="node-2")
+        self.assertEqual(traceback["member"], "logs/node-2/2026-10-19.09-05/files/app.log")
+        self.assertEqual(traceback["time"], mktime(datetime(2026, 10, 19, 9, 5).timetuple()))
+        self.assertEqual([finding["signature"] for finding in index.query(term="java")], ["oom_kill"])
+        since = mktime(datetime(2026, 10, 19).timetuple())
+        self.assertEqual([finding["signature"] for finding in index.query(since=since)], ["traceback"])
+
+    def test_parse_query_time(self):
+        from infi.logs_collector.analysis import parse_query_time
+        self.assertEqual(parse_query_time("2026-10-01"), mktime_of(datetime(2026, 10, 1)))
+        self.assertEqual(parse_query_time("2026-10-01 10:00"), mktime_of(datetime(2026, 10, 1, 10)))
+        self.assertEqual(parse_query_time("2099-01-01 10:00:00"), mktime_of(datetime(2099, 1, 1, 10)))
+
+    def test_query_boundaries_are_exact(self):
+        from infi.logs_collector.analysis import main
+        archives = self._create_archives()
+        with patch("sys.stdout") as stdout:
+            main(["index", self.index_path, "--workers", "1"] + archives)
+            main(["query", self.index_path, "--since", "2026-10-18 10:00:01", "--until", "2026-10-18 10:00:01"])
+        output = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        self.assertIn(" oom_kill ", output)
+        self.assertNotIn(" kernel_panic ", output)
+
+    def test_main(self):
+        from infi.logs_collector.analysis import main
+        archives = self._create_archives()
+        with patch("sys.stdout") as stdout:
+            self.assertEqual(main(["index", self.index_path, "--workers", "1"] + archives), 0)
+            self.assertEqual(main(["query", self.index_path, "--host", "node-1", "--signature", "oom_kill"]), 0)
+        output = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        self.assertIn("Analyzed 2 archives", output)
+        self.assertIn("node-1 oom_kill logs/node-1/2026-10-19.09-00/files/var/log/messages:2", output)
+
+
+class OffsetIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+        self.logdir = path.join(self.tempdir, "logs")
+        self.cache_dir = path.join(self.tempdir, "cache")
+        makedirs(self.logdir)
+        self.logfile = path.join(self.logdir, "app.log")
+
+    def _write_lines(self, start, minutes, mode='wb', step=timedelta(minutes=1)):
+        with open(self.logfile, mode) as fd:
+            for index in range(int(timedelta(minutes=minutes).total_seconds() / step.total_seconds())):
+                line_time = start + step * index
+                fd.write("{} message {}\n".format(line_time.strftime("%Y-%m-%d %H:%M:%S"), 'x' * 80).encode())
+
+    def _get_index(self):
+        from infi.logs_collector.offset_index import OffsetIndex
+        return OffsetIndex(self.cache_dir, interval_bytes=1024)
+
+    def test_update_is_incremental_and_dropped_on_rotation(self):
+        from infi.logs_collector.offset_index import OffsetIndex
+        self._write_lines(datetime(2026, 10, 18), 60)
+        samples = self._get_index().update(self.logfile)
+        self.assertEqual(samples[0][0], 0)
+        self.assertTrue(all(0 < b[0] - a[0] < 1200 for a, b in zip(samples, samples[1:])))
+        self._write_lines(datetime(2026, 10, 18, 1), 60, 'ab')
+        with patch.object(OffsetIndex, "_sample", autospec=True, side_effect=OffsetIndex._sample) as sample:
+            grown = self._get_index().update(self.logfile)
+        self.assertEqual(grown[:len(samples) - 1], samples[:-1])
+        self.assertLess(sample.call_count, len(grown) - len(samples) + 3)
+        from os import remove
+        remove(self.logfile)
+        self._write_lines(datetime(2026, 10, 19), 5)
+        self.assertEqual(self._get_index().update(self.logfile), [(0, mktime_of(datetime(2026, 10, 19)))])
+
+    def test_get_byte_range(self):
+        self._write_lines(datetime(2026, 10, 18), 600)
+        index = self._get_index()
+        start, end = index.get_byte_range(self.logfile, mktime_of(datetime(2026, 10, 18, 5)),
+                                          mktime_of(datetime(2026, 10, 18, 5, 10)))
+        with open(self.logfile, 'rb') as fd:
+            fd.seek(start)
+            data = fd.read(end - start)
+        self.assertIn(b"2026-10-18 05:00:00", data)
+        self.assertIn(b"2026-10-18 05:10:00", data)
+        self.assertNotIn(b"2026-10-18 04:30:00", data)
+        self.assertNotIn(b"2026-10-18 05:40:00", data)
+        self.assertEqual(index.get_byte_range(self.logfile, 0, 1e12), (0, path.getsize(self.logfile)))
+
+    def test_run_collects_the_timeframe_only(self):
+        from os import utime
+        self._write_lines(datetime(2026, 10, 18), 600, step=timedelta(seconds=5))
+        timestamp = datetime(2026, 10, 18, 9)
+        utime(self.logfile, (mktime_of(timestamp), mktime_of(timestamp)))
+        item = collectables.Directory(self.logdir, r"app\.log", offset_index_dir=self.cache_dir)
+        end_result, archive_path = logs_collector.run("test", [item], timestamp, timedelta(minutes=30),
+                                                      output_path=self.tempdir)
+        self.assertEqual(end_result, 0)
+        self.assertLess(item.collected_bytes, path.getsize(self.logfile) / 3)
+        with TarFile.open(archive_path) as archive:
+            [name] = [name for name in archive.getnames() if name.endswith("app.log")]
+            data = archive.extractfile(name).read()
+        self.assertIn(b"2026-10-18 08:30:00", data)
+        self.assertIn(b"2026-10-18 09:30:00", data)
+        self.assertNotIn(b"2026-10-18 07:00:00", data)
+        self.assertTrue(glob(path.join(self.cache_dir, "*.json")))
+
+    def test_windows_collect_the_timeframes_only(self):
+        from os import utime
+        from infi.logs_collector.incidents import run_windows
+        self._write_lines(datetime(2026, 10, 18), 600, step=timedelta(seconds=5))
+        timestamp = datetime(2026, 10, 18, 9)
+        utime(self.logfile, (mktime_of(timestamp), mktime_of(timestamp)))
+        item = collectables.Directory(self.logdir, r"app\.log", offset_index_dir=self.cache_dir)
+        [(end_result, archive_path)] = run_windows("test", [item], [(timestamp, timedelta(minutes=30)),
+                                                   (datetime(2026, 10, 18, 1), timedelta(minutes=30))],
+                                                   output_path=self.tempdir, silent=True, single_archive=True)
+        self.assertEqual(end_result, 0)
+        with TarFile.open(archive_path) as archive:
+            [name] = [name for name in archive.getnames() if name.endswith("app.log")]
+            data = archive.extractfile(name).read()
+        self.assertIn(b"2026-10-18 08:30:00", data)
+        self.assertIn(b"2026-10-18 09:30:00", data)
+        self.assertNotIn(b"2026-10-18 07:00:00", data)
+
+    def test_prune(self):
+        from os import remove, utime
+        from time import time
+        index = self._get_index()
+        logfiles = [path.join(self.logdir, "{}.log".format(name)) for name in ("old", "unused", "deleted", "new")]
+        for age, logfile in enumerate(logfiles):
+            with open(logfile, 'wb') as fd:
+                fd.write(b"2026-10-18 00:00:00 message\n")
+            index.update(logfile)
+            sidecar_path = index.get_sidecar_path(logfile)
+            utime(sidecar_path, (time() - 100 * (len(logfiles) - age), ) * 2)
+        remove(logfiles[2])
+        utime(index.get_sidecar_path(logfiles[1]), (time() - 1000, ) * 2)
+        index.max_sidecars, index.max_age_seconds = 2, 500
+        with patch.object(index, "_get_source", wraps=index._get_source) as get_source:
+            self.assertEqual(index.prune(), 3)
+        self.assertEqual(glob(path.join(self.cache_dir, "*.json")), [index.get_sidecar_path(logfiles[3])])
+        # the unused sidecar and the old one beyond max_sidecars are removed without being opened
+        self.assertEqual(sorted(call[0][0] for call in get_source.call_args_list),
+                         sorted(index.get_sidecar_path(logfile) for logfile in logfiles[2:]))
+
+    def test_run_prunes_once(self):
+        from infi.logs_collector.offset_index import OffsetIndex
+        self._write_lines(datetime(2026, 10, 18), 60)
+        items = [collectables.Directory(self.logdir, r"app\.log", offset_index_dir=self.cache_dir),
+                 collectables.Directory(self.logdir, r"app\.log", offset_index_dir=self.cache_dir)]
+        with patch.object(OffsetIndex, "prune", autospec=True, return_value=0) as prune:
+            logs_collector.run("test", items, datetime(2026, 10, 18), timedelta(minutes=30), output_path=self.tempdir,
+                               silent=True)
+        self.assertEqual(prune.call_count, 1)
+
+
+def mktime_of(value):
+    from time import mktime
+    return mktime(value.timetuple())
+
+
+class RootsTestCase(unittest.TestCase):
+    def setUp(self):
+        from shutil import rmtree
+        self.tempdir = mkdtemp()
+        self.addCleanup(rmtree, self.tempdir, ignore_errors=True)
+
+    def _write(self, filepath, data):
+        if not path.exists(path.dirname(filepath)):
+            makedirs(path.dirname(filepath))
+        with open(filepath, 'wb') as fd:
+            fd.write(data)
+
+    def test_load_roots(self):
+        from infi.logs_collector.roots import load_roots
+        for container in ("abc", "def"):
+            makedirs(path.join(self.tempdir, "overlay2", container, "merged"))
+        makedirs(path.join(self.tempdir, "chroot"))
+        config_path = path.join(self.tempdir, "roots")
+        with open(config_path, 'w') as fd:
+            fd.write("# containers\n{0}/overlay2/*/merged\n\nabc={0}/chroot\n{0}/missing/*\n".format(self.tempdir))
+        roots = load_roots(config_path)
+        self.assertEqual([root.root_id for root in roots], ["abc", "def", "abc-2"])
+        self.assertEqual(roots[2].path, path.join(self.tempdir, "chroot"))
+
+    def test_run_collects_shared_files_once(self):
+        from os import link
+        from infi.logs_collector.roots import Root
+        roots = [Root(path.join(self.tempdir, name)) for name in ("web", "db")]
+        for root in roots:
+            self._write(root.get_path("/var/log/messages"), root.root_id.encode() * 10)
+        self._write(roots[0].get_path("/etc/os-release"), b'x' * 1000)
+        makedirs(roots[1].get_path("/etc"))
+        link(roots[0].get_path("/etc/os-release"), roots[1].get_path("/etc/os-release"))
+        items = [collectables.Command("echo", ["hello"]), collectables.Directory("/var/log", "messages"),
+                 collectables.Directory("/etc", ".*release", timeframe_only=False)]
+        end_result, archive_path = logs_collector.run("test", items, datetime.now(), timedelta(hours=1),
+                                                      output_path=self.tempdir, roots=roots)
+        self.assertEqual(end_result, 0)
+        with TarFile.open(archive_path) as archive:
+            members = dict((member.name.split("/files/", 1)[-1], member) for member in archive.getmembers())
+        self.assertTrue(members["web/var/log/messages"].isfile())
+        self.assertTrue(members["db/var/log/messages"].isfile())
+        releases = [members["web/etc/os-release"], members["db/etc/os-release"]]
+        self.assertEqual(sorted(member.islnk() for member in releases), [False, True])
+        self.assertTrue([name for name in members if "/commands/echo" in name])
+
+    def test_symlinks_out_of_a_root_are_not_followed(self):
+        from os import symlink
+        from infi.logs_collector.roots import Root
+        root = Root(path.join(self.tempdir, "web"))
+        host = path.join(self.tempdir, "host")
+        self._write(path.join(host, "log", "messages"), b"host log")
+        self._write(path.join(host, "shadow"), b"host secret")
+        self._write(root.get_path("/etc/os-release"), b"web release")
+        makedirs(root.get_path("/var"))
+        symlink(path.join(host, "log"), root.get_path("/var/log"))
+        symlink(path.join(host, "shadow"), root.get_path("/etc/shadow"))
+        items = [collectables.Directory("/var/log", "messages", timeframe_only=False),
+                 collectables.Directory("/etc", ".*", timeframe_only=False)]
+        end_result, archive_path = logs_collector.run("test", items, datetime.now(), timedelta(hours=1),
+                                                      output_path=self.tempdir, roots=[root])
+        with TarFile.open(archive_path) as archive:
+            names = [member.name.split("/files/", 1)[-1] for member in archive.getmembers() if member.isfile()]
+        self.assertIn("web/etc/os-release", names)
+        self.assertNotIn("web/etc/shadow", names)
+        self.assertNotIn("web/var/log/messages", names)
+
+    def test_timeout_is_shared_by_the_roots(self):
+        from time import sleep
+        from infi.logs_collector.roots import Root, RootsCollection
+        from infi.logs_collector.scheduling import TIMEOUT_ATTRIBUTES
+        roots = [Root(path.join(self.tempdir, name)) for name in ("web", "db", "cache")]
+        collection = RootsCollection([collectables.Directory("/var/log", "messages", timeout_in_seconds=60)], roots,
+                                     max_workers=2)
+        self.assertIn("timeout_in_seconds", TIMEOUT_ATTRIBUTES)
+        self.assertEqual(collection.timeout_in_seconds, 120)
+        collection.timeout_in_seconds = 30
+        timeouts = []
+
+        def collect(rooted, targetdir, timestamp, delta):
+            timeouts.append(rooted.timeout_in_seconds)
+            rooted.collected_bytes = 0
+            sleep(0.2)
+        with patch.object(collectables.Directory, "collect", autospec=True, side_effect=collect):
+            collection.collect(self.tempdir, datetime.now(), timedelta(hours=1))
+        self.assertEqual(len(timeouts), 3)
+        self.assertTrue(all(29 < timeout <= 30 for timeout in timeouts[:2]))
+        self.assertLess(timeouts[2], 29.9)
+        collection.timeout_in_seconds = 0.1
+        with patch.object(collectables.Directory, "collect", autospec=True, side_effect=collect):
+            self.assertRaises(RuntimeError, collection.collect, self.tempdir, datetime.now(), timedelta(hours=1))
+
+    def test_shared_files_key_includes_the_device(self):
+        from infi.logs_collector.roots import SharedFiles
+        fd, filepath = mkstemp(dir=self.tempdir)
+        close(fd)
+        self.assertEqual(SharedFiles.get_key(filepath)[0], stat(filepath).st_dev)
+
+    def test_linux_items_apply_to_roots(self):
+        from infi.logs_collector.items import linux
+        from infi.logs_collector.roots import RootsCollection
+        items = linux(roots=[self.tempdir])
+        [collection] = [item for item in items if isinstance(item, RootsCollection)]
+        self.assertEqual(len(collection.directories), 2)
+        self.assertFalse([item for item in items if isinstance(item, collectables.Directory)])
+        self.assertEqual(len(items), len(linux()) - 1)
+
+
+class StartupTestCase(unittest.TestCase):
+    CLI_MODULES = ["infi.logs_collector.scripts", "infi.logs_collector.items", "infi.logs_collector.collectables.windows"]
+    DEFERRED_MODULES = ["colorama", "six", "sqlite3", "tarfile", "subprocess", "concurrent.futures", "socket", "json"]
+    # about 2.5 times the 40ms the CLI modules take to import, so a new eager import fails the test
+    IMPORT_BUDGET_MICROSECONDS = 100000
+
+    def test_import_time_budget(self):
+        from infi.logs_collector.util import measure_import_times
+        times = measure_import_times(self.CLI_MODULES)
+        self.assertFalse([name for name in self.DEFERRED_MODULES if name in times])
+        total = sum(times[name] for name in self.CLI_MODULES if name in times)
+        self.assertLess(total, self.IMPORT_BUDGET_MICROSECONDS)
+
+    def test_factories_are_resolved_on_first_use(self):
+        from infi.logs_collector import items
+        items.register_factory("test_factory", "infi.logs_collector.items:get_generic_os_items")
+        self.addCleanup(items._registry.pop, "test_factory")
+        self.assertIn("test_factory", items.get_factory_names())
+        self.assertNotIn("test_factory", items._resolved_factories)
+        self.assertIs(items.get_factory("test_factory"), items.get_generic_os_items)
+        self.assertIn("test_factory", items._resolved_factories)
+        with self.assertRaises(ValueError):
+            items.register_factory("bad", "no_attribute")
+
+    def test_silent_run_does_not_import_colorama(self):
+        import sys
+        from shutil import rmtree
+        tempdir = mkdtemp()
+        self.addCleanup(rmtree, tempdir, ignore_errors=True)
+        with patch.dict(sys.modules, {"colorama": None}):
+            end_result, archive_path = logs_collector.run("test", [collectables.Hostname()], datetime.now(),
+                                                          timedelta(hours=1), output_path=tempdir, silent=True)
+        self.assertEqual(end_result, 0)
+        self.assertTrue(path.exists(archive_path))
+
+    def test_script_header_is_cached(self):
+        import sys
+        header = collectables.Script._get_sys_path_header()
+        self.assertIs(collectables.Script._get_sys_path_header(), header)
+        with patch.object(sys, "path", sys.path + ["/nonexistent"]):
+            self.assertIn("/nonexistent", collectables.Script._get_sys_path_header())